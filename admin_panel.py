@@ -1,118 +1,173 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from functools import wraps
 from datetime import datetime
 import logging
 import os
-from config import (
-    ADMIN_USERNAME, ADMIN_PASSWORD, SECRET_KEY,
-    FLASK_HOST, FLASK_PORT
-)
+from config import ADMIN_USERNAME, ADMIN_PASSWORD, FLASK_HOST, FLASK_PORT
 from models import db, User, Game, Transaction
+from cartela_catalog import get_cartela
+import leaderboards
+import wallet
+import dashboard_data
+import outbox
+import transaction_review
+import app as game_api
+from room_manager import WrongShard
+from game_logic import BingoGame
+from sqlalchemy.exc import IntegrityError
 
-from telegram import Bot
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-bot = Bot(token=BOT_TOKEN)
-
-app = Flask(__name__)
-app.secret_key = SECRET_KEY
+# Mounted by app_factory.create_app() under ADMIN_PANEL_PREFIX
+panel_bp = Blueprint("panel", __name__)
 
 # 🔐 Admin login protection
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'admin_logged_in' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('panel.login'))
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@panel_bp.route('/admin/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
         if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
             session['admin_logged_in'] = True
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('panel.dashboard'))
         flash('Invalid credentials')
     return render_template('admin/login.html')
 
-@app.route('/admin/dashboard')
+@panel_bp.route('/admin/dashboard')
 @admin_required
 def dashboard():
-    players = User.query.all()
-    games = Game.query.all()
-    active_game = Game.query.filter_by(status="active").first()
-    pending_withdrawals = Transaction.query.filter_by(type="withdrawal", status="pending").all()
-    pending_deposits = Transaction.query.filter_by(type="deposit", status="pending").all()
-    return render_template(
-        'admin/dashboard.html',
-        players=players,
-        games=games,
-        active_game=active_game,
-        pending_withdrawals=pending_withdrawals,
-        pending_deposits=pending_deposits,
-        active_games=Game.query.filter_by(status="active").count(),
-        total_players=User.query.count()
-    )
+    # Lists are fetched by the page from the JSON panels below
+    return render_template('admin/dashboard.html', stats=dashboard_data.summary(db.session))
+
+# -------------------- DASHBOARD PANELS (JSON) --------------------
+
+def _panel(rows, cursor):
+    return jsonify({"rows": rows, "next": cursor})
+
+@panel_bp.route('/admin/panel/summary')
+@admin_required
+def panel_summary():
+    return jsonify(dashboard_data.summary(db.session))
+
+@panel_bp.route('/admin/panel/players')
+@admin_required
+def panel_players():
+    return _panel(*dashboard_data.players(
+        db.session,
+        before=request.args.get("before", type=int),
+        q=request.args.get("q") or None,
+        limit=min(request.args.get("limit", dashboard_data.PAGE_SIZE, type=int), 200)
+    ))
+
+@panel_bp.route('/admin/panel/games')
+@admin_required
+def panel_games():
+    return _panel(*dashboard_data.games(
+        db.session,
+        before=request.args.get("before", type=int),
+        status=request.args.get("status") or None,
+        limit=min(request.args.get("limit", dashboard_data.PAGE_SIZE, type=int), 200)
+    ))
+
+@panel_bp.route('/admin/panel/pending/<kind>')
+@admin_required
+def panel_pending(kind):
+    if kind not in ("deposit", "withdraw"):
+        return jsonify({"error": "Unknown queue"}), 404
+    try:
+        return _panel(*dashboard_data.pending(
+            db.session,
+            kind,
+            cursor=request.args.get("cursor"),
+            limit=min(request.args.get("limit", dashboard_data.PAGE_SIZE, type=int), 200)
+        ))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
 
-@app.route('/admin/game/start', methods=['POST'])
+@panel_bp.route('/admin/game/start', methods=['POST'])
 @admin_required
 def start_game():
-    game_id = request.form.get('game_id')
-    game = Game.query.get(game_id)
-    if game and game.status == "waiting":
-        game.status = "active"
-        game.called_numbers = []
-        game.created_at = datetime.utcnow()
-        db.session.commit()
+    # Through the room, so the first call is made and the game clock takes over
+    game_id = request.form.get('game_id', type=int)
+    if game_id is None:
+        flash('Could not start game')
+        return redirect(url_for('panel.dashboard'))
+    try:
+        with game_api.rooms.room(game_id) as game:
+            started = bool(game) and game.start_game()
+    except WrongShard as e:
+        flash(str(e))
+        return redirect(url_for('panel.dashboard'))
+    if started:
+        dashboard_data.invalidate_summary()
         flash('Game started successfully')
     else:
         flash('Could not start game')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('panel.dashboard'))
 
-@app.route('/admin/game/finish', methods=['POST'])
+@panel_bp.route('/admin/game/finish', methods=['POST'])
 @admin_required
 def finish_game():
-    game_id = request.form.get('game_id')
-    game = Game.query.get(game_id)
-    if game and game.status == "active":
-        game.status = "finished"
-        game.finished_at = datetime.utcnow()
-        db.session.commit()
+    # Through the room, so the clock stops, streams end and settlement refunds the stakes
+    game_id = request.form.get('game_id', type=int)
+    if game_id is None:
+        flash('Game not active or not found')
+        return redirect(url_for('panel.dashboard'))
+    try:
+        with game_api.rooms.room(game_id) as game:
+            finished = bool(game) and game.finish()
+    except WrongShard as e:
+        flash(str(e))
+        return redirect(url_for('panel.dashboard'))
+    if finished:
+        game_api.publish_finished(game_id, {"type": "winner", "winners": []})
+        dashboard_data.invalidate_summary()
         flash('Game marked as finished')
     else:
         flash('Game not active or not found')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('panel.dashboard'))
 
-@app.route('/admin/leaderboard')
+@panel_bp.route('/admin/leaderboard')
 @admin_required
 def leaderboard():
-    top_players = User.query.order_by(User.games_won.desc()).limit(10).all()
+    top_players = leaderboards.top(db.session, "wins", 10)
+    db.session.commit()
     return render_template('admin/leaderboard.html', players=top_players)
 
-@app.route('/admin/call_number', methods=['POST'])
+@panel_bp.route('/admin/call_number', methods=['POST'])
 @admin_required
 def call_number():
     game_id = int(request.form.get('game_id'))
     number = int(request.form.get('number'))
-    game = Game.query.get(game_id)
-    if not game or game.status != "active":
-        flash("Game not active or not found")
-        return redirect(url_for("dashboard"))
-
-    if number in game.called_numbers:
-        flash(f"Number {number} already called")
-        return redirect(url_for("dashboard"))
-
-    game.called_numbers.append(number)
-    db.session.commit()
+    try:
+        with game_api.rooms.room(game_id) as game:
+            if not game or game.status != "active":
+                flash("Game not active or not found")
+                return redirect(url_for("panel.dashboard"))
+            if not game.manual_call(number):
+                flash(f"Number {number} already called")
+                return redirect(url_for("panel.dashboard"))
+            winners = list(game.winner_ids) if game.status == "finished" else []
+    except WrongShard as e:
+        flash(str(e))
+        return redirect(url_for("panel.dashboard"))
+    game_api.publish_game_events(game_id, {
+        "type": "call", "game_id": game_id, "formatted": BingoGame.format_number(number),
+        "audio": BingoGame.audio_filename(number), "winners": winners
+    })
 
     logging.info(f"📢 Called number {number} in game {game_id}")
     flash(f"📢 Called number {number}")
 
-    return redirect(url_for("dashboard"))
+    return redirect(url_for("panel.dashboard"))
 
-@app.route('/admin/withdrawal/approve', methods=['POST'])
+@panel_bp.route('/admin/withdrawal/approve', methods=['POST'])
 @admin_required
 def approve_withdrawal():
     user_id = request.form.get('user_id')
@@ -122,20 +177,20 @@ def approve_withdrawal():
     tx = Transaction.query.get(tx_id)
     if not user or not tx:
         flash('User or transaction not found')
-        return redirect(url_for('dashboard'))
-    if user.balance >= amount:
-        user.balance -= amount
+        return redirect(url_for('panel.dashboard'))
+    if wallet.debit(db.session, user.id, amount, "withdraw", reference=f"tx:{tx.id}", transaction_id=tx.id):
         tx.status = "approved"
         tx.completed_at = datetime.utcnow()
+        outbox.enqueue(db.session, user.telegram_id, f"✅ Your withdrawal of {amount} birr was approved.")
         db.session.commit()
+        dashboard_data.invalidate_summary()
         logging.info(f"✅ Admin approved withdrawal TX {tx_id} for user {user_id}")
-        bot.send_message(chat_id=user.telegram_id, text=f"✅ Your withdrawal of {amount} birr was approved.")
         flash('Withdrawal approved')
     else:
         flash('Insufficient balance')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('panel.dashboard'))
 
-@app.route('/admin/withdrawal/reject', methods=['POST'])
+@panel_bp.route('/admin/withdrawal/reject', methods=['POST'])
 @admin_required
 def reject_withdrawal():
     tx_id = request.form.get('tx_id')
@@ -143,35 +198,39 @@ def reject_withdrawal():
     tx = Transaction.query.get(tx_id)
     if not tx:
         flash('Transaction not found')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('panel.dashboard'))
     tx.status = "rejected"
     tx.admin_note = reason
     tx.completed_at = datetime.utcnow()
+    outbox.enqueue(db.session, tx.user.telegram_id, f"❌ Your withdrawal request was rejected.\nReason: {reason}")
     db.session.commit()
+    dashboard_data.invalidate_summary()
     logging.info(f"❌ Admin rejected withdrawal TX {tx_id} with reason: {reason}")
-    bot.send_message(chat_id=tx.user.telegram_id, text=f"❌ Your withdrawal request was rejected.\nReason: {reason}")
     flash('Withdrawal rejected')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('panel.dashboard'))
 
-@app.route('/admin/deposit/approve', methods=['POST'])
+@panel_bp.route('/admin/deposit/approve', methods=['POST'])
 @admin_required
 def approve_deposit():
     tx_id = request.form.get('tx_id')
     tx = Transaction.query.get(tx_id)
     if not tx or tx.status != "pending":
         flash('Invalid transaction')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('panel.dashboard'))
     user = tx.user
-    user.balance += tx.amount
+    if not wallet.credit(db.session, user.id, tx.amount, "deposit", reference=f"tx:{tx.id}", transaction_id=tx.id):
+        flash('Invalid transaction')
+        return redirect(url_for('panel.dashboard'))
     tx.status = "approved"
     tx.completed_at = datetime.utcnow()
+    outbox.enqueue(db.session, user.telegram_id, f"✅ Your deposit of {tx.amount} birr was approved.")
     db.session.commit()
+    dashboard_data.invalidate_summary()
     logging.info(f"✅ Admin approved deposit TX {tx_id} for user {user.id}")
-    bot.send_message(chat_id=user.telegram_id, text=f"✅ Your deposit of {tx.amount} birr was approved.")
     flash('Deposit approved')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('panel.dashboard'))
 
-@app.route('/admin/deposit/reject', methods=['POST'])
+@panel_bp.route('/admin/deposit/reject', methods=['POST'])
 @admin_required
 def reject_deposit():
     tx_id = request.form.get('tx_id')
@@ -179,37 +238,64 @@ def reject_deposit():
     tx = Transaction.query.get(tx_id)
     if not tx:
         flash('Transaction not found')
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('panel.dashboard'))
     tx.status = "rejected"
     tx.admin_note = reason
     tx.completed_at = datetime.utcnow()
+    outbox.enqueue(db.session, tx.user.telegram_id, f"❌ Your deposit was rejected.\nReason: {reason}")
     db.session.commit()
+    dashboard_data.invalidate_summary()
     logging.info(f"❌ Admin rejected deposit TX {tx_id} with reason: {reason}")
-    bot.send_message(chat_id=tx.user.telegram_id, text=f"❌ Your deposit was rejected.\nReason: {reason}")
     flash('Deposit rejected')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('panel.dashboard'))
+
+@panel_bp.route('/admin/transactions/bulk/<action>', methods=['POST'])
+@admin_required
+def bulk_review(action):
+    if action not in ("approve", "reject"):
+        return jsonify({"error": "Unknown action"}), 404
+    payload = request.get_json(silent=True) or {}
+    try:
+        ids = transaction_review.ids_from_payload(db.session, payload)
+        if action == "approve":
+            results = transaction_review.approve_many(db.session, ids, ADMIN_USERNAME, payload.get("note", ""),
+                                                      transaction_review.amounts_from_payload(payload))
+        else:
+            results = transaction_review.reject_many(db.session, ids, ADMIN_USERNAME, payload.get("reason") or "No reason provided")
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "Batch conflicted with another approval, please retry"}), 409
+    dashboard_data.invalidate_summary()
+    logging.info(f"📦 Admin bulk {action}: {sum(r['status'] != 'error' for r in results)}/{len(results)} transactions")
+    return jsonify({"results": results})
 
-@app.route('/admin/user/<int:user_id>')
+@panel_bp.route('/admin/user/<int:user_id>')
 @admin_required
 def user_profile(user_id):
     user = User.query.get(user_id)
     if not user:
         flash("User not found")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("panel.dashboard"))
     return render_template("admin/user.html", user=user)
 
-@app.route('/admin/update_balance/<int:user_id>', methods=["POST"])
+@panel_bp.route('/admin/update_balance/<int:user_id>', methods=["POST"])
 @admin_required
 def update_balance(user_id):
     amount = float(request.form.get("amount", 0))
     user = User.query.get(user_id)
     if user:
-        user.balance += amount
-        db.session.commit()
-        flash(f"💰 Updated balance for {user.username}")
-    return redirect(url_for("user_profile", user_id=user_id))
+        if wallet.adjust(db.session, user.id, amount):
+            db.session.commit()
+            flash(f"💰 Updated balance for {user.username}")
+        else:
+            flash("Insufficient balance")
+    return redirect(url_for("panel.user_profile", user_id=user_id))
 
-@app.route('/admin/cartela/<int:game_id>/<int:user_id>/<int:cartela_number>')
+@panel_bp.route('/admin/cartela/<int:game_id>/<int:user_id>/<int:cartela_number>')
 @admin_required
 def view_cartela(game_id, user_id, cartela_number):
     from models import GameParticipant, Game
@@ -221,15 +307,22 @@ def view_cartela(game_id, user_id, cartela_number):
     game = Game.query.get(game_id)
     if not participant or not game:
         flash("Cartela not found")
-        return redirect(url_for("dashboard"))
-    return render_template("admin/cartela_viewer.html", participant=participant, game=game)
+        return redirect(url_for("panel.dashboard"))
+    return render_template(
+        "admin/cartela_viewer.html",
+        participant=participant,
+        game=game,
+        board=get_cartela(cartela_number),
+        marked=set(participant.marked_numbers or [])
+    )
 
-@app.route('/admin/logout')
+@panel_bp.route('/admin/logout')
 @admin_required
 def logout():
     session.pop('admin_logged_in', None)
     flash('Logged out successfully')
-    return redirect(url_for('login'))
+    return redirect(url_for('panel.login'))
 
 if __name__ == '__main__':
-    app.run(host=FLASK_HOST, port=FLASK_PORT, debug=True)
+    from app_factory import create_app
+    create_app().run(host=FLASK_HOST, port=FLASK_PORT, debug=True)
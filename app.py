@@ -1,87 +1,300 @@
 # app.py
-from flask import Flask, request, jsonify
-from database import db, init_db
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from database import db
 from models import User, Game, GameParticipant, Transaction
-from game_logic import BingoGame
+from game_store import InMemoryGameStore, SqlGameStore, JoinNotRecorded
+from room_manager import RoomManager, WrongShard
+import wallet
+import transaction_queries
+import leaderboards
+import metrics
+import webapp_auth
+from config import GAME_STORE, FLASK_PORT
+from game_clock import clock
+from live_hub import hub, PgBus
+from sqlalchemy.engine import make_url
 from datetime import datetime
-import os
 
-# 🔧 Flask App Setup
-app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET", "arada_secret_key")
-
-# 🧠 Database Initialization
-try:
-    init_db(app)
-except RuntimeError as e:
-    print(f"❌ Database setup error: {e}")
-    # Fallback to SQLite for local development
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///arada.db"
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.init_app(app)
-
-# 🎮 In-memory game store
-active_games = {}
+# 🎮 Game API. app_factory.create_app() mounts it next to the admin and payment routes.
+game_bp = Blueprint("game", __name__)
+
+# Game state store (shared through the database unless GAME_STORE=memory), made when the blueprint is mounted.
+# Routes change a room only inside `with rooms.room(game_id) as game:`, which holds that room's lock.
+game_store = None
+rooms = None
+
+@game_bp.record_once
+def _create_store(state):
+    global game_store, rooms
+    config = state.app.config
+    game_store = SqlGameStore(state.app) if GAME_STORE == "sql" else InMemoryGameStore()
+    rooms = RoomManager(game_store, own_rooms=config.get("OWN_ROOMS", True))
+    metrics.REGISTRY.collector("rooms", rooms.metrics)
+    hub.snapshot = _live_state
+    # On Postgres every serving process shares live events, so a stream can be served by
+    # any of them (the stream tier included), not only by the room's owner
+    if config.get("LIVE_BUS", config.get("START_WORKERS", True)) and \
+            make_url(config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() == "postgresql":
+        with state.app.app_context():
+            hub.bus = PgBus(db.engine, hub)
+        hub.bus.start()
+
+@game_bp.errorhandler(WrongShard)
+def wrong_shard(e):
+    response = jsonify({"error": str(e), "shard": e.shard})
+    response.headers["X-Game-Shard"] = str(e.shard)
+    return response, 421
+
+def __getattr__(name):
+    # `from app import app` keeps working; the app is only built when something asks for it
+    if name == "app":
+        from app_factory import create_app
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module 'app' has no attribute {name!r}")
+
+# -------------------- LIVE EVENTS --------------------
+
+def publish_game_events(game_id, event):
+    hub.publish(game_id, event)
+    if event.get("winners"):
+        publish_finished(game_id, {"type": "winner", "winners": event["winners"]})
+
+def publish_finished(game_id, winner_event):
+    # Last event of the room: its streams end after it and the channel is dropped
+    hub.publish(game_id, winner_event)
+    hub.publish("lobby", {"type": "finished", "game_id": game_id})
+    hub.discard(game_id)
+
+def _live_state(key):
+    # Sent with a resync, when a client's Last-Event-ID can't be caught up from the buffer
+    try:
+        return {"games": game_store.list_open()} if key == "lobby" else rooms.snapshot(key)
+    finally:
+        db.session.close()
+
+def _is_live(game_id):
+    # Streams stay open for minutes; their reads must not keep a pooled connection checked out
+    try:
+        snapshot = rooms.snapshot(game_id)
+    finally:
+        db.session.close()
+    return snapshot is not None and snapshot["status"] != "finished"
+
+# Auto calls made by the game clock go out to every subscriber of that room
+clock.subscribe(publish_game_events)
 
 # -------------------- GAME ROUTES --------------------
 
-@app.route("/game/create", methods=["POST"])
+@game_bp.route("/game/create", methods=["POST"])
 def create_game():
     data = request.json
     entry_price = data.get("entry_price", 10)
-    game = BingoGame(game_id=len(active_games) + 1, entry_price=entry_price)
-    active_games[game.game_id] = game
+    game = rooms.create(entry_price)
+    hub.publish("lobby", {"type": "created", "game_id": game.game_id, "entry_price": entry_price})
     return jsonify({"game_id": game.game_id})
 
-@app.route("/game/join", methods=["POST"])
-def join_game():
-    data = request.json
-    game_id = data.get("game_id")
-    user_id = data.get("user_id")
-    cartela_number = data.get("cartela_number")
+@game_bp.route("/game/list", methods=["GET"])
+def list_games():
+    return jsonify(game_store.list_open())
 
-    game = active_games.get(game_id)
-    if not game:
+@game_bp.route("/game/<int:game_id>/state", methods=["GET"])
+def game_state(game_id):
+    # For polling clients: the room's last snapshot, read without taking its lock
+    snapshot = rooms.snapshot(game_id)
+    if snapshot is None:
         return jsonify({"error": "Game not found"}), 404
-
-    board = game.add_player(user_id, cartela_number)
+    return jsonify(snapshot)
+
+def _game_id(game_id, data):
+    # The legacy routes take the room from the body; None when it's missing or not a number
+    try:
+        return int(game_id or data.get("game_id"))
+    except (TypeError, ValueError):
+        return None
+
+def _webapp_user_id():
+    # The player's users.id, from the Telegram WebApp initData the page sends; None if it doesn't check out
+    tg_user = webapp_auth.telegram_user(request.headers.get(webapp_auth.HEADER, ""))
+    if tg_user is None:
+        return None
+    return db.session.query(User.id).filter_by(telegram_id=tg_user["id"]).scalar()
+
+# /game/<id>/join and /game/<id>/mark carry the room in the path, so a load balancer can shard on it
+@game_bp.route("/game/join", methods=["POST"])
+@game_bp.route("/game/<int:game_id>/join", methods=["POST"])
+def join_game(game_id=None):
+    data = request.get_json(silent=True) or {}
+    game_id = _game_id(game_id, data)
+    if game_id is None:
+        return jsonify({"error": "game_id is required"}), 400
+    # Joining spends the player's balance, so the player is whoever Telegram signed for, never the body
+    user_id = _webapp_user_id()
+    if user_id is None:
+        return jsonify({"error": "Open the game from the bot to join"}), 401
+    # Optional: without one the room picks a free cartela
+    cartela_number = data.get("cartela_number")
+    if cartela_number is not None:
+        try:
+            cartela_number = int(cartela_number)
+        except (TypeError, ValueError):
+            cartela_number = 0
+        if cartela_number < 1:
+            return jsonify({"error": "cartela_number must be a positive whole number"}), 400
+    mode = db.session.query(User.play_mode).filter_by(id=user_id).scalar() or "auto"
+
+    with rooms.room(game_id) as game:
+        if not game:
+            return jsonify({"error": "Game not found"}), 404
+
+        try:
+            board = game.add_player(user_id, cartela_number, mode)
+        except wallet.InsufficientFunds as e:
+            return jsonify({"error": str(e)}), 402
+        except JoinNotRecorded as e:
+            return jsonify({"error": str(e)}), 503
+        if board:
+            pool_event = {"type": "pool", "game_id": game_id, "pool": game.pool, "players": game.total_players()}
+            hub.publish(game_id, pool_event)
+            hub.publish("lobby", pool_event)
     return jsonify({"cartela": board})
 
-@app.route("/game/call/<int:game_id>", methods=["POST"])
+# -------------------- CARTELA SELECTION --------------------
+
+@game_bp.route("/game/<int:game_id>/cartelas", methods=["GET"])
+def free_cartelas(game_id):
+    # {"size", "free_count", "free": base64 bitmap, bit n-1 set when cartela n can be picked}
+    with rooms.room(game_id) as game:
+        if not game:
+            return jsonify({"error": "Game not found"}), 404
+        return jsonify(game.cartelas.snapshot())
+
+def _cartela_number(data):
+    try:
+        return int(data.get("cartela_number", 0))
+    except (TypeError, ValueError):
+        return 0
+
+# Reservations belong to the Telegram user who opened the page, never to an ID in the body
+@game_bp.route("/game/<int:game_id>/cartelas/reserve", methods=["POST"])
+def reserve_cartela(game_id):
+    user_id = _webapp_user_id()
+    if user_id is None:
+        return jsonify({"error": "Open this page from the bot to pick a cartela"}), 401
+    number = _cartela_number(request.get_json(silent=True) or {})
+    with rooms.room(game_id) as game:
+        if not game:
+            return jsonify({"error": "Game not found"}), 404
+        if not game.cartelas.reserve(number, user_id):
+            if game.cartelas.available_to(number, user_id):
+                return jsonify({"error": f"You can hold at most {game.cartelas.limit} cartelas at once"}), 429
+            return jsonify({"error": "This cartela number is already taken"}), 409
+        return jsonify({"reserved": number, "user_id": user_id, "expires_in": game.cartelas.ttl})
+
+@game_bp.route("/game/<int:game_id>/cartelas/release", methods=["POST"])
+def release_cartela(game_id):
+    user_id = _webapp_user_id()
+    if user_id is None:
+        return jsonify({"error": "Open this page from the bot to pick a cartela"}), 401
+    number = _cartela_number(request.get_json(silent=True) or {})
+    with rooms.room(game_id) as game:
+        if not game:
+            return jsonify({"error": "Game not found"}), 404
+        return jsonify({"released": game.cartelas.cancel(number, user_id)})
+
+@game_bp.route("/game/call/<int:game_id>", methods=["POST"])
 def call_number(game_id):
-    game = active_games.get(game_id)
-    if not game:
-        return jsonify({"error": "Game not found"}), 404
-
-    result = game.call_number()
+    with rooms.room(game_id) as game:
+        if not game:
+            return jsonify({"error": "Game not found"}), 404
+        result = game.call_number()
+    if result:
+        publish_game_events(game_id, {"type": "call", "game_id": game_id, **result})
     return jsonify(result)
 
-@app.route("/game/mark", methods=["POST"])
-def mark_number():
-    data = request.json
-    game_id = data.get("game_id")
+@game_bp.route("/game/mark", methods=["POST"])
+@game_bp.route("/game/<int:game_id>/mark", methods=["POST"])
+def mark_number(game_id=None):
+    data = request.get_json(silent=True) or {}
+    game_id = _game_id(game_id, data)
+    if game_id is None:
+        return jsonify({"error": "game_id is required"}), 400
     user_id = data.get("user_id")
     number = data.get("number")
 
-    game = active_games.get(game_id)
-    if not game:
-        return jsonify({"error": "Game not found"}), 404
+    with rooms.room(game_id) as game:
+        if not game:
+            return jsonify({"error": "Game not found"}), 404
 
-    updated = game.mark_number(user_id, number)
-    win, message = game.check_winner(user_id)
+        updated = game.mark_number(user_id, number)
+        win, message, pattern = game.check_winner_pattern(user_id)
 
-    if win:
-        game.end_game(user_id)
+        if win and game.status == "active":
+            game.end_game(user_id)
+            publish_finished(game_id, {"type": "winner", "winners": game.winner_ids, "pattern": pattern})
 
     return jsonify({
         "marked": updated,
         "win": win,
-        "message": message
+        "message": message,
+        "pattern": pattern
     })
 
+@game_bp.route("/game/<int:game_id>/mode", methods=["POST"])
+def switch_mode(game_id):
+    # {"mode": "auto" | "manual"} for all of the caller's boards in this room
+    user_id = _webapp_user_id()
+    if user_id is None:
+        return jsonify({"error": "Open the game from the bot to change mode"}), 401
+    mode = (request.get_json(silent=True) or {}).get("mode")
+    if mode not in ("auto", "manual"):
+        return jsonify({"error": "mode must be auto or manual"}), 400
+
+    with rooms.room(game_id) as game:
+        if not game:
+            return jsonify({"error": "Game not found"}), 404
+        if user_id not in game.players:
+            return jsonify({"error": "You have no board in this game"}), 404
+
+        # Switching to auto daubs the numbers already called, which may complete a board
+        winners = game.toggle_mode(user_id, mode)
+        if winners:
+            _, _, pattern = game.check_winner_pattern(user_id)
+            publish_finished(game_id, {"type": "winner", "winners": game.winner_ids, "pattern": pattern})
+
+    return jsonify({"mode": mode, "win": bool(winners)})
+
+@game_bp.route("/game/<int:game_id>/stream", methods=["GET"])
+def game_stream(game_id):
+    if not _is_live(game_id):
+        return jsonify({"error": "Game not found or finished"}), 404
+    since = request.headers.get("Last-Event-ID", request.args.get("since", 0, type=int), type=int)
+    return Response(
+        stream_with_context(hub.stream(game_id, since)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@game_bp.route("/game/<int:game_id>/events", methods=["GET"])
+def game_events(game_id):
+    if not _is_live(game_id):
+        return jsonify({"error": "Game not found or finished"}), 404
+    since = request.args.get("since", 0, type=int)
+    last, events = hub.poll(game_id, since)
+    return Response(f'{{"last": {last}, "events": {events}}}', mimetype="application/json")
+
+@game_bp.route("/game/lobby/stream", methods=["GET"])
+def lobby_stream():
+    since = request.headers.get("Last-Event-ID", request.args.get("since", 0, type=int), type=int)
+    return Response(
+        stream_with_context(hub.stream("lobby", since)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # -------------------- DEPOSIT & WITHDRAW --------------------
 
-@app.route("/deposit", methods=["POST"])
+@game_bp.route("/deposit", methods=["POST"])
 def deposit():
     data = request.json
     user_id = data.get("user_id")
@@ -109,12 +322,13 @@ def deposit():
         completed_at=datetime.utcnow()
     )
     db.session.add(tx)
-    user.balance += amount
+    db.session.flush()
+    wallet.credit(db.session, user.id, amount, "deposit", reference=f"tx:{tx.id}", transaction_id=tx.id)
     db.session.commit()
 
-    return jsonify({"message": "Deposit confirmed", "new_balance": user.balance})
+    return jsonify({"message": "Deposit confirmed", "new_balance": wallet.balance(db.session, user.id)})
 
-@app.route("/withdraw", methods=["POST"])
+@game_bp.route("/withdraw", methods=["POST"])
 def withdraw():
     data = request.json
     user_id = data.get("user_id")
@@ -141,43 +355,53 @@ def withdraw():
 
 # -------------------- ADMIN ROUTES --------------------
 
-@app.route("/admin/transactions", methods=["GET"])
+@game_bp.route("/admin/transactions", methods=["GET"])
 def admin_transactions():
-    txs = Transaction.query.order_by(Transaction.created_at.desc()).limit(50).all()
-    data = []
-    for tx in txs:
-        user = User.query.get(tx.user_id)
-        data.append({
+    # Filters: ?type=&status=&method=&since=&until=; the next page's cursor comes back in X-Next-Cursor
+    try:
+        txs, cursor = transaction_queries.query(db.session, **transaction_queries.filters_from_args(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    data = [
+        {
             "id": tx.id,
-            "user": user.username if user else "unknown",
+            "user": tx.username or "unknown",
             "type": tx.type,
             "amount": tx.amount,
             "method": tx.method,
             "reference": tx.reference,
             "status": tx.status,
             "created_at": tx.created_at.isoformat()
-        })
-    return jsonify(data)
+        }
+        for tx in txs
+    ]
+    response = jsonify(data)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return response
 
-@app.route("/admin/approve/<int:tx_id>", methods=["POST"])
+@game_bp.route("/admin/approve/<int:tx_id>", methods=["POST"])
 def approve_transaction(tx_id):
     tx = Transaction.query.get(tx_id)
     if not tx or tx.status != "pending":
         return jsonify({"error": "Transaction not found or already processed"}), 400
 
-    tx.status = "approved"
-    tx.completed_at = datetime.utcnow()
-
-    user = User.query.get(tx.user_id)
     if tx.type == "deposit":
-        user.balance += tx.amount
+        applied = wallet.credit(db.session, tx.user_id, tx.amount, "deposit", reference=f"tx:{tx.id}", transaction_id=tx.id)
     elif tx.type == "withdraw":
-        user.balance -= tx.amount
+        applied = wallet.debit(db.session, tx.user_id, tx.amount, "withdraw", reference=f"tx:{tx.id}", transaction_id=tx.id)
+    else:
+        applied = True
+    if not applied:
+        db.session.rollback()
+        return jsonify({"error": "Insufficient balance or already processed"}), 400
 
+    tx.status = "approved"
+    tx.completed_at = datetime.utcnow()
     db.session.commit()
     return jsonify({"message": "Transaction approved."})
 
-@app.route("/admin/reject/<int:tx_id>", methods=["POST"])
+@game_bp.route("/admin/reject/<int:tx_id>", methods=["POST"])
 def reject_transaction(tx_id):
     tx = Transaction.query.get(tx_id)
     if not tx or tx.status != "pending":
@@ -189,14 +413,15 @@ def reject_transaction(tx_id):
 
 # -------------------- LEADERBOARD --------------------
 
-@app.route("/leaderboard", methods=["GET"])
+@game_bp.route("/leaderboard", methods=["GET"])
 def leaderboard():
-    top_users = User.query.order_by(User.games_won.desc(), User.balance.desc()).limit(10).all()
+    top_users = leaderboards.top(db.session, "wins", 10)
+    db.session.commit()
     data = [
         {
-            "username": user.username,
-            "wins": user.games_won,
-            "balance": user.balance
+            "username": user["username"],
+            "wins": user["games_won"],
+            "balance": user["balance"]
         }
         for user in top_users
     ]
@@ -205,6 +430,9 @@ def leaderboard():
 # -------------------- START SERVER --------------------
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
-    app.run(host="0.0.0.0", port=int(os.getenv("FLASK_PORT", 5000)), debug=True)
+    from app_factory import create_app
+    import migrations
+    dev_app = create_app()
+    with dev_app.app_context():
+        migrations.migrate()
+    dev_app.run(host="0.0.0.0", port=FLASK_PORT, debug=True)
@@ -0,0 +1,73 @@
+# app_factory.py
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, Optional
+
+from flask import Flask
+
+from config import SECRET_KEY, ADMIN_PANEL_PREFIX
+from database import init_db
+import metrics
+
+# One WSGI app for everything the web process serves: the game API, the Telegram
+# admin routes, the admin panel, payment / SMS webhooks, the bot's WebApp pages and,
+# in webhook mode, the bot itself (Telegram updates arrive at /webhook).
+# Building it opens no connections and talks to nobody: the database engine is made
+# on the first query, the schema is only touched by migrations.migrate(), and the
+# Telegram client is only built when the first update arrives. /metrics reports what
+# this process has served.
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    """
+    config overrides app.config before anything is mounted, e.g.
+    {"SQLALCHEMY_DATABASE_URI": "sqlite://", "START_WORKERS": False} for a test app.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__, template_folder="templates", static_folder="static")
+    app.secret_key = os.getenv("FLASK_SECRET") or SECRET_KEY
+    app.config.update(START_WORKERS=True, ADMIN_PANEL_PREFIX=ADMIN_PANEL_PREFIX)
+    app.config.update(config or {})
+
+    try:
+        init_db(app)
+    except RuntimeError as e:
+        logging.warning(f"{e} Falling back to sqlite:///arada.db")
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///arada.db"
+        init_db(app)
+
+    from app import game_bp
+    from admin_panel import panel_bp
+    from routes.admin import admin_bp
+    from routes.cartela import cartela_bp
+    from routes.payment import payment_bp
+    from routes.metrics import metrics_bp
+    from routes.telegram import telegram_bp
+
+    app.register_blueprint(game_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(payment_bp)
+    app.register_blueprint(cartela_bp)
+    app.register_blueprint(telegram_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(panel_bp, url_prefix=app.config["ADMIN_PANEL_PREFIX"])
+
+    # Request timings, SQL per request and the opt-in profiler, served at /metrics
+    metrics.init_app(app)
+
+    @app.cli.command("migrate")
+    def migrate_command():
+        """Create missing tables, columns and indexes."""
+        import migrations
+        migrations.migrate()
+
+    app.config["STARTUP_SECONDS"] = time.perf_counter() - started
+    logging.info(f"App built in {app.config['STARTUP_SECONDS'] * 1000:.1f} ms")
+    return app
+
+if __name__ == "__main__":
+    # python app_factory.py  -> cold-start cost of a web worker (blueprint imports included)
+    built = create_app({"START_WORKERS": False})
+    print(f"create_app: {built.config['STARTUP_SECONDS'] * 1000:.1f} ms, "
+          f"{len(sys.modules)} modules loaded, telegram imported: {'telegram' in sys.modules}")
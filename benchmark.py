@@ -0,0 +1,497 @@
+# benchmark.py
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# Load generator and micro-benchmarks, run in-process against a throwaway database:
+#
+#   python benchmark.py                       # everything, on a temp SQLite file
+#   python benchmark.py load --rooms 20 --players 50 --db postgresql://localhost/arada_bench
+#   python benchmark.py micro --save bench.json
+#   python benchmark.py --compare bench.json  # exit 1 if anything got slower than allowed
+#
+# Requests go through the Flask test client, so latencies are the app and the database
+# without the network. Queries are counted per endpoint from SQLAlchemy cursor events.
+# Use a database you can throw away: the load run creates users, rooms and transactions.
+
+# -------------------- RECORDING --------------------
+
+class Recorder:
+    """
+    Latencies and query counts per label. Queries run on the thread that made the
+    request, so a thread-local label attributes them; work handed to other threads
+    (the game clock, bot_db's pool) is counted with `measure(..., count_all=True)`.
+    """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.total_queries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def on_query(self):
+        label = getattr(self._local, "label", None)
+        with self._lock:
+            self.total_queries += 1
+            if label:
+                self.queries[label] += 1
+
+    @contextmanager
+    def measure(self, label: str, count_all: bool = False):
+        self._local.label = None if count_all else label
+        before = self.total_queries
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.errors[label] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.label = None
+            with self._lock:
+                self.latencies[label].append(elapsed)
+                if count_all:
+                    self.queries[label] += self.total_queries - before
+
+    def report(self, wall: float) -> Dict[str, Dict[str, float]]:
+        results = {}
+        for label, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            results[label] = {
+                "count": len(ordered),
+                "p50_ms": _percentile(ordered, 50) * 1000,
+                "p99_ms": _percentile(ordered, 99) * 1000,
+                "per_sec": len(ordered) / wall if wall else 0.0,
+                "queries": self.queries[label] / len(ordered),
+                "errors": self.errors[label],
+            }
+        return results
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def print_table(title: str, results: Dict[str, Dict[str, float]], wall: float):
+    print(f"\n{title} ({wall:.2f}s)")
+    print(f"  {'endpoint':<34}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}{'errors':>7}")
+    for label, r in results.items():
+        print(f"  {label:<34}{r['count']:>7}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+              f"{r['per_sec']:>9.1f}{r['queries']:>9.2f}{r['errors']:>7}")
+
+# -------------------- APP --------------------
+
+_recorder: Optional[Recorder] = None
+
+def _on_query(*args):
+    if _recorder is not None:
+        _recorder.on_query()
+
+def count_queries(recorder: Recorder) -> Recorder:
+    """
+    Sends every statement from now on to `recorder`. Listening on the Engine class
+    also catches bot_db's own engine.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    global _recorder
+    if not event.contains(Engine, "before_cursor_execute", _on_query):
+        event.listen(Engine, "before_cursor_execute", _on_query)
+    _recorder = recorder
+    return recorder
+
+def build_app(db_url: str):
+    from app_factory import create_app
+    from database import db
+    import migrations
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": db_url, "START_WORKERS": False})
+    with app.app_context():
+        migrations.migrate()
+        db.session.remove()
+    return app, count_queries(Recorder())
+
+def seed_users(app, count: int) -> List[Tuple[int, int]]:
+    from sqlalchemy import insert, select
+    from database import db
+    from models import User
+
+    # Telegram IDs well away from real ones and from earlier runs against the same database;
+    # each starts with enough balance for its joins, which take the stake up front
+    base = 9_000_000_000_000 + int(time.time() * 1000) % 1_000_000_000 * 1000
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {"telegram_id": base + i, "username": f"bench{i}", "balance": 1000.0, "balance_cents": 100000}
+            for i in range(count)
+        ])
+        db.session.commit()
+        users = [tuple(row) for row in db.session.execute(
+            select(User.id, User.telegram_id).where(User.telegram_id >= base).order_by(User.id)
+        )]
+        db.session.remove()
+    return users
+
+def call(client, recorder: Recorder, label: str, method: str, url: str, body: Optional[dict] = None,
+         headers: Optional[dict] = None):
+    with recorder.measure(label):
+        response = client.open(url, method=method, json=body, headers=headers)
+    if response.status_code >= 500:
+        recorder.errors[label] += 1
+    return response
+
+# -------------------- LOAD --------------------
+
+def run_load(app, recorder: Recorder, rooms: int, players: int, polls: int, concurrency: int,
+             call_interval: float) -> float:
+    """
+    rooms × players users each join a room, then poll its state and mark whatever has
+    been called, `polls` times. A caller per room keeps numbers coming every
+    call_interval seconds (the game clock also calls on its own schedule).
+    Then every player deposits and asks to withdraw, and an admin approves the withdrawals.
+    """
+    import webapp_auth
+
+    users = seed_users(app, rooms * players)
+    user_ids = [uid for uid, _ in users]
+    client = app.test_client()
+    game_ids = [
+        call(client, recorder, "POST /game/create", "POST", "/game/create", {"entry_price": 10}).get_json()["game_id"]
+        for _ in range(rooms)
+    ]
+    assignments = [(game_ids[i % rooms], uid, tg_id) for i, (uid, tg_id) in enumerate(users)]
+    random.shuffle(assignments)
+    done = threading.Event()
+
+    def caller(game_id: int):
+        client = app.test_client()
+        while not done.is_set():
+            call(client, recorder, "POST /game/call/<id>", "POST", f"/game/call/{game_id}")
+            done.wait(call_interval)
+
+    def player(game_id: int, user_id: int, telegram_id: int):
+        client = app.test_client()
+        call(client, recorder, "GET /game/<id>/cartelas", "GET", f"/game/{game_id}/cartelas")
+        call(client, recorder, "POST /game/<id>/join", "POST", f"/game/{game_id}/join", {},
+             {webapp_auth.HEADER: webapp_auth.sign({"id": telegram_id})})
+        marked = set()
+        for _ in range(polls):
+            state = call(client, recorder, "GET /game/<id>/state", "GET", f"/game/{game_id}/state").get_json()
+            for number in state.get("called", ()):
+                if number not in marked:
+                    marked.add(number)
+                    call(client, recorder, "POST /game/<id>/mark", "POST", f"/game/{game_id}/mark",
+                         {"user_id": user_id, "number": number})
+        call(client, recorder, "GET /game/list", "GET", "/game/list")
+
+    def banker(user_id: int):
+        client = app.test_client()
+        call(client, recorder, "POST /deposit", "POST", "/deposit",
+             {"user_id": user_id, "amount": 100, "method": "telebirr", "phone": "0911000000",
+              "code": f"TXBENCH{user_id}"})
+        call(client, recorder, "POST /withdraw", "POST", "/withdraw",
+             {"user_id": user_id, "amount": 50, "phone": "0911000000"})
+
+    started = time.perf_counter()
+    callers = [threading.Thread(target=caller, args=(g,), daemon=True) for g in game_ids]
+    for thread in callers:
+        thread.start()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda a: player(*a), assignments))
+        done.set()
+        list(pool.map(banker, user_ids))
+
+    admin = app.test_client()
+    cursor = None
+    while True:
+        url = "/admin/transactions?type=withdraw&status=pending" + (f"&cursor={cursor}" if cursor else "")
+        response = call(admin, recorder, "GET /admin/transactions", "GET", url)
+        for tx in response.get_json():
+            call(admin, recorder, "POST /admin/approve/<id>", "POST", f"/admin/approve/{tx['id']}")
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    call(admin, recorder, "GET /leaderboard", "GET", "/leaderboard")
+    for thread in callers:
+        thread.join()
+    return time.perf_counter() - started
+
+# -------------------- TELEGRAM --------------------
+
+def make_fake_bot(sent: Dict[str, int]):
+    from telegram import Bot
+
+    message_ids = itertools.count(1)
+
+    class FakeBot(Bot):
+        """
+        A Bot whose API calls never leave the process: every method gets a plausible
+        answer, and each call is counted in `sent` by API method.
+        """
+
+        async def _do_post(self, endpoint, data, **kwargs):
+            sent[endpoint] += 1
+            if endpoint == "getMe":
+                return {"id": 1, "is_bot": True, "first_name": "Arada", "username": "arada_bench_bot",
+                        "can_join_groups": True, "can_read_all_group_messages": False,
+                        "supports_inline_queries": False}
+            if endpoint in ("sendMessage", "editMessageText"):
+                return {"message_id": next(message_ids), "date": int(time.time()),
+                        "chat": {"id": data.get("chat_id") or 1, "type": "private"}, "text": data.get("text", "")}
+            return True
+
+    return FakeBot("0:benchmark")
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, telegram_id: int) -> dict:
+        return {"id": telegram_id, "is_bot": False, "first_name": "Bench", "username": f"tg{telegram_id}"}
+
+    def _message(self, telegram_id: int, text: str) -> dict:
+        message = {"message_id": next(self._ids), "date": int(time.time()), "text": text,
+                   "chat": {"id": telegram_id, "type": "private"}, "from": self._user(telegram_id)}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def text(self, telegram_id: int, text: str) -> dict:
+        return {"update_id": next(self._ids), "message": self._message(telegram_id, text)}
+
+    def button(self, telegram_id: int, data: str) -> dict:
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "from": self._user(telegram_id), "chat_instance": "bench",
+            "data": data, "message": self._message(telegram_id, "menu"),
+        }}
+
+def run_bot(db_url: str, recorder: Recorder, users: int) -> float:
+    """
+    Each simulated user starts the bot, opens the game, makes a deposit claim, asks for
+    a withdrawal and joins a lobby. Updates are handled one at a time so each one's
+    queries (made on bot_db's pool threads) can be attributed to it.
+    """
+    from telegram import Update
+    import bot
+    import bot_db
+
+    bot_db.configure(db_url)
+    sent: Dict[str, int] = defaultdict(int)
+    fake = make_fake_bot(sent)
+    updates = UpdateFactory()
+    base = 8_000_000_000_000 + int(time.time() * 1000) % 1_000_000_000 * 1000
+
+    script = [
+        ("/start", lambda t: updates.text(t, "/start")),
+        ("/play", lambda t: updates.text(t, "/play")),
+        ("button withdraw", lambda t: updates.button(t, "withdraw")),
+        ("text withdraw amount", lambda t: updates.text(t, "50")),
+        ("button deposit_menu", lambda t: updates.button(t, "deposit_menu")),
+        ("button deposit_cbe_birr", lambda t: updates.button(t, "deposit_cbe_birr")),
+        ("text deposit amount", lambda t: updates.text(t, "100")),
+        ("text deposit tx id", lambda t: updates.text(t, f"TX{t}")),
+        ("/preview", lambda t: updates.text(t, "/preview")),
+        ("/joinlobby", lambda t: updates.text(t, "/joinlobby")),
+    ]
+
+    async def drive() -> float:
+        application = bot.build_application(bot=fake)
+        current = [""]
+
+        async def count_error(update, context):
+            recorder.errors[current[0]] += 1
+
+        # Handler exceptions are swallowed by the application, so count them as errors here
+        application.add_error_handler(count_error)
+        await application.initialize()
+        started = time.perf_counter()
+        for i in range(users):
+            telegram_id = base + i
+            for label, make in script:
+                update = Update.de_json(make(telegram_id), application.bot)
+                current[0] = f"bot {label}"
+                with recorder.measure(current[0], count_all=True):
+                    await application.process_update(update)
+        wall = time.perf_counter() - started
+        await application.shutdown()
+        return wall
+
+    wall = asyncio.run(drive())
+    print(f"\nFake Bot API calls: {dict(sent)}")
+    return wall
+
+# -------------------- MICRO --------------------
+
+def _time_per_op(setup, body, repeat: int) -> float:
+    """
+    Best seconds per operation over `repeat` runs; setup() builds fresh state
+    outside the timer and returns (state, operations).
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        state, ops = setup()
+        started = time.perf_counter()
+        body(state)
+        best = min(best, (time.perf_counter() - started) / ops)
+    return best
+
+def run_micro(players: int, repeat: int) -> Dict[str, float]:
+    """
+    generate_board, mark_number and check_winner on a room of `players` manual-mode
+    players (one board each, so at most CARTELA_SIZE) with all 75 numbers called,
+    in microseconds per call.
+    """
+    from game_logic import BingoGame
+    from config import CARTELA_SIZE
+
+    players = min(players, CARTELA_SIZE)
+    def full_room():
+        game = BingoGame(game_id=1)
+        game.status = "active"                      # no clock, no auto-start
+        for uid in range(1, players + 1):
+            game.add_player(uid, mode="manual")
+        for number in range(1, 76):
+            game.manual_call(number)
+        return game
+
+    numbers = list(range(1, 76))
+
+    def generate_setup():
+        return BingoGame(game_id=1), CARTELA_SIZE
+
+    def generate(game):
+        for n in range(1, CARTELA_SIZE + 1):
+            game.generate_board(n)
+
+    def mark_setup():
+        return full_room(), players * len(numbers)
+
+    def mark(game):
+        for uid in range(1, players + 1):
+            for number in numbers:
+                game.mark_number(uid, number)
+
+    def winner_setup():
+        game = full_room()
+        for uid in range(1, players + 1, 2):           # half the room fully marked, half untouched
+            for number in numbers:
+                game.mark_number(uid, number)
+        return game, players
+
+    def check(game):
+        for uid in range(1, players + 1):
+            game.check_winner(uid)
+
+    return {
+        "generate_board": _time_per_op(generate_setup, generate, repeat) * 1e6,
+        "mark_number": _time_per_op(mark_setup, mark, repeat) * 1e6,
+        "check_winner": _time_per_op(winner_setup, check, repeat) * 1e6,
+    }
+
+# -------------------- BASELINES --------------------
+
+def compare(results: Dict[str, Any], baseline_path: str, tolerance: float) -> List[str]:
+    """
+    Names everything more than `tolerance` (0.5 = 50%) slower, or heavier on queries,
+    than the saved baseline.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, old in baseline.get("micro", {}).items():
+        new = results.get("micro", {}).get(name)
+        if new is not None and new > old * (1 + tolerance):
+            regressions.append(f"{name}: {old:.2f} -> {new:.2f} µs")
+    for section in ("load", "bot"):
+        for label, old in baseline.get(section, {}).items():
+            new = results.get(section, {}).get(label)
+            if new is None:
+                continue
+            # Sub-millisecond endpoints jitter by more than any tolerance, so ignore moves under 1 ms
+            if new["p99_ms"] > old["p99_ms"] * (1 + tolerance) and new["p99_ms"] - old["p99_ms"] > 1.0:
+                regressions.append(f"{label}: p99 {old['p99_ms']:.2f} -> {new['p99_ms']:.2f} ms")
+            if new["queries"] > old["queries"] + 0.5:
+                regressions.append(f"{label}: {old['queries']:.2f} -> {new['queries']:.2f} queries/request")
+    return regressions
+
+# -------------------- MAIN --------------------
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Arada Bingo load generator and micro-benchmarks")
+    parser.add_argument("suite", nargs="*", help="load, bot and/or micro (default: all three)")
+    parser.add_argument("--db", help="database URL (default: a new SQLite file in a temp directory)")
+    parser.add_argument("--store", choices=["sql", "memory"], default="sql", help="GAME_STORE for the run")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--players", type=int, default=20, help="players per room")
+    parser.add_argument("--polls", type=int, default=10, help="state polls per player")
+    parser.add_argument("--concurrency", type=int, default=16, help="request threads")
+    parser.add_argument("--call-interval", type=float, default=0.05, help="seconds between calls per room")
+    parser.add_argument("--bot-users", type=int, default=50)
+    parser.add_argument("--micro-players", type=int, default=100, help="boards in the micro-benchmark room")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", help="write results as JSON, e.g. as a baseline")
+    parser.add_argument("--compare", help="baseline JSON; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args(argv)
+    suites = set(args.suite) or {"load", "bot", "micro"}
+    if suites - {"load", "bot", "micro"}:
+        parser.error(f"unknown suite: {', '.join(sorted(suites - {'load', 'bot', 'micro'}))}")
+
+    # Read by config at import time, so set before anything imports it
+    os.environ["GAME_STORE"] = args.store
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")   # joins are signed as WebApp users with it
+    db_url = args.db or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='arada-bench-'), 'bench.db')}"
+    results: Dict[str, Any] = {}
+
+    if suites & {"load", "bot"}:
+        print(f"Database: {db_url} (game store: {args.store})")
+        app, recorder = build_app(db_url)
+        if "load" in suites:
+            wall = run_load(app, recorder, args.rooms, args.players, args.polls, args.concurrency,
+                            args.call_interval)
+            results["load"] = recorder.report(wall)
+            print_table(f"Game API: {args.rooms} rooms × {args.players} players, {args.concurrency} threads",
+                        results["load"], wall)
+        if "bot" in suites:
+            recorder = count_queries(Recorder())
+            wall = run_bot(db_url, recorder, args.bot_users)
+            results["bot"] = recorder.report(wall)
+            print_table(f"Telegram handlers: {args.bot_users} users, one update at a time", results["bot"], wall)
+
+    if "micro" in suites:
+        results["micro"] = run_micro(args.micro_players, args.repeat)
+        print(f"\nMicro-benchmarks (up to {args.micro_players} boards, best of {args.repeat})")
+        for name, micros in results["micro"].items():
+            print(f"  {name:<20}{micros:>10.2f} µs/call")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved to {args.save}")
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n❌ Slower than {args.compare}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n✅ Within {args.tolerance:.0%} of {args.compare}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# bingo_bits.py
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+# Cells are numbered 0..24 row by row; bit `cell` of a board mask is set when marked.
+FREE_CELL = 12
+FREE_MASK = 1 << FREE_CELL
+FULL_MASK = (1 << 25) - 1
+
+# -------------------- WINNING PATTERNS --------------------
+
+def _mask(cells: Sequence[int]) -> int:
+    mask = 0
+    for cell in cells:
+        mask |= 1 << cell
+    return mask
+
+# (mask, pattern name), in the order check_winner has always reported them
+WIN_PATTERNS: Tuple[Tuple[int, str], ...] = tuple(
+    [(_mask(range(r * 5, r * 5 + 5)), "row") for r in range(5)]
+    + [(_mask(range(c, 25, 5)), "column") for c in range(5)]
+    + [(_mask([0, 6, 12, 18, 24]), "diagonal"), (_mask([4, 8, 12, 16, 20]), "diagonal")]
+    + [(_mask([0, 4, 20, 24]), "corner")]
+)
+
+# Only the patterns that pass through a cell can be completed by marking it
+CELL_PATTERNS: Tuple[Tuple[Tuple[int, str], ...], ...] = tuple(
+    tuple(p for p in WIN_PATTERNS if p[0] & (1 << cell)) for cell in range(25)
+)
+
+PATTERN_MESSAGES = {
+    "row": "Winner - Row complete!",
+    "column": "Winner - Column complete!",
+    "diagonal": "Winner - Diagonal complete!",
+    "corner": "Winner - Corner complete!",
+}
+
+def winning_pattern(mask: int) -> Optional[str]:
+    for pattern, name in WIN_PATTERNS:
+        if mask & pattern == pattern:
+            return name
+    return None
+
+def pattern_through(mask: int, cell: int) -> Optional[str]:
+    for pattern, name in CELL_PATTERNS[cell]:
+        if mask & pattern == pattern:
+            return name
+    return None
+
+def cell_index(board: Sequence[int]) -> Dict[int, int]:
+    return {number: cell for cell, number in enumerate(board) if cell != FREE_CELL}
+
+def marked_numbers(board: Sequence[int], mask: int) -> List[int]:
+    return sorted(board[cell] for cell in range(25) if mask >> cell & 1)
+
+# -------------------- ENGINE --------------------
+
+class BitBoardEngine:
+    """
+    Holds every cartela in a game as a 25-bit mask.
+    A number -> [(board, cell)] reverse index makes a call touch only the boards holding it,
+    and a win check only looks at the patterns through the cell that was just marked.
+    """
+
+    def __init__(self):
+        self.masks: List[int] = []
+        self.owners: List[int] = []
+        self.winners: Dict[int, str] = {}            # board -> pattern name
+        self.index: Dict[int, List[Tuple[int, int]]] = {}
+
+    def add_board(self, owner: int, board: Sequence[int], cells: Optional[Mapping[int, int]] = None) -> int:
+        board_id = len(self.masks)
+        self.masks.append(FREE_MASK)
+        self.owners.append(owner)
+        for number, cell in (cells or cell_index(board)).items():
+            self.index.setdefault(number, []).append((board_id, cell))
+        return board_id
+
+    def mark(self, board_id: int, cell: int) -> Optional[str]:
+        bit = 1 << cell
+        mask = self.masks[board_id]
+        if mask & bit:
+            return None
+        mask |= bit
+        self.masks[board_id] = mask
+        pattern = pattern_through(mask, cell)
+        if pattern:
+            self.winners.setdefault(board_id, pattern)
+        return pattern
+
+    def reset(self):
+        self.masks = [FREE_MASK] * len(self.masks)
+        self.winners.clear()
+
+    def boards_with(self, number: int) -> List[Tuple[int, int]]:
+        return self.index.get(number, [])
+
+    def result(self, board_ids: Sequence[int]) -> Tuple[bool, str, Optional[str]]:
+        for board_id in board_ids:
+            pattern = self.winners.get(board_id)
+            if pattern:
+                return True, PATTERN_MESSAGES[pattern], pattern
+        return False, "Keep playing", None
@@ -2,21 +2,21 @@ import os
 import logging
 import asyncio
 import random
-from flask import Flask, request, jsonify, render_template
+import signal
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
+    Application, ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
     ContextTypes, filters
 )
-from sqlalchemy import func
-from database import db, init_db
-from models import User, Transaction, Game, Lobby
+from config import BOT_MODE, TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_SECRET, METRICS_PORT, PROFILER, PROFILER_INTERVAL
+import bot_db
+import metrics
+from broadcaster import BroadcastEngine
+from outbox import OutboxWorker
 from utils.is_valid_tx_id import is_valid_tx_id
 from utils.referral_link import referral_link
 from utils.toggle_language import toggle_language
 from utils.build_main_keyboard import build_main_keyboard
-from routes.admin import admin_bp
-from routes.payment import payment_bp  # ✅ NEW
 
 logging.basicConfig(level=logging.INFO)
 
@@ -24,75 +24,15 @@ BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 WEBAPP_URL = os.getenv("WEBAPP_URL", "https://arada-bingo.et")
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "364344971").split(",")]
 
-flask_app = Flask(__name__, template_folder="templates", static_folder="static")
-flask_app.secret_key = os.getenv("FLASK_SECRET", "bot_secret")
-
-try:
-    init_db(flask_app)
-except RuntimeError:
-    flask_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///arada.db"
-    flask_app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.init_app(flask_app)
-
-flask_app.register_blueprint(admin_bp)
-flask_app.register_blueprint(payment_bp)  # ✅ NEW
-telegram_app = ApplicationBuilder().token(BOT_TOKEN).build()
-
-@app.route("/cartela", methods=["GET", "POST"])
-def cartela():
-    telegram_id = request.args.get("id")
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if request.method == "GET":
-        return jsonify({
-            "cartela": user.cartela,
-            "bonus": [random.randint(1, 90) for _ in range(5)],
-            "winner": str(user.telegram_id) if user.games_won > 0 else None
-        })
-    else:
-        new_cartela = request.json.get("cartela")
-        user.cartela = new_cartela
-        db.session.commit()
-        return jsonify({"status": "updated"})
-
-@app.route("/cartela-editor")
-def cartela_editor():
-    return render_template("cartela.html", game_id="12345", entry_price=10, player_count=5, pool=50, sound_enabled=True, play_mode="jackpot")
-
-@app.route("/admin/dashboard")
-def admin_dashboard():
-    pending_deposits = Transaction.query.filter_by(type="deposit", status="pending").all()
-    pending_withdrawals = Transaction.query.filter_by(type="withdraw", status="pending").all()
-    games = Game.query.order_by(Game.created_at.desc()).limit(10).all()
-    players = User.query.order_by(User.created_at.desc()).limit(10).all()
-    return render_template("admin_dashboard.html", pending_deposits=pending_deposits, pending_withdrawals=pending_withdrawals, games=games, players=players)
-
-@app.route("/admin/approve_deposit", methods=["POST"])
-def approve_deposit():
-    tx_id = request.form.get("tx_id")
-    amount = int(request.form.get("amount"))
-    user_id = int(request.form.get("user_id"))
-    tx = Transaction.query.get(tx_id)
-    user = User.query.get(user_id)
-    if tx and user:
-        tx.status = "approved"
-        tx.amount = amount
-        user.balance += amount
-        db.session.commit()
-    return jsonify({"status": "approved"})
-
-@app.route("/admin/approve_withdrawal", methods=["POST"])
-def approve_withdrawal():
-    tx_id = request.form.get("tx_id")
-    tx = Transaction.query.get(tx_id)
-    if tx and tx.status == "pending":
-        tx.status = "approved"
-        db.session.commit()
-    return jsonify({"status": "approved"})
+# The bot's web pages (/cartela, /cartela-editor) are served by app_factory.create_app();
+# this module only builds the Telegram client, and only when the bot actually runs.
+# With BOT_MODE=webhook the web workers handle updates (see telegram_intake) and this
+# process only registers the webhook and sends the notification outbox.
 
 LANGUAGE_MAP = {
     "en": {
         "welcome": "Welcome to Arada Bingo Ethiopia!",
-        "deposit": "💰 Deposit Instructions:\nSend to:\n- CBE Birr: 0920927761\n- Telebirr: 0920927761\n- CBE Bank: 1000316113347\nThen reply with your transaction ID.",
+        "deposit": "💰 Deposit Instructions:\nSend to:\n- CBE Birr: 0920927761\n- Telebirr: 0920927761\n- CBE Bank: 1000316113347\nThen reply with the amount you sent and your transaction ID.",
         "withdraw": "💸 Withdrawal Request:\nEnter the amount you want to withdraw.\nWe will send to your preferred account.",
         "stats": "📊 Your Stats:\nBalance: {balance} birr\nGames Played: {played}\nGames Won: {won}\nReferrals: {ref_count}/10\nReferral Link: {link}",
         "invite": "🎁 Invite your friends!\nShare this link:\n{link}\nYou’ll earn 5 birr when they play their first game.\nBonus: 50 birr when you reach 10!",
@@ -117,44 +57,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = update.effective_user.id
     username = update.effective_user.username
 
-    with flask_app.app_context():
-        user = User.query.filter_by(telegram_id=str(telegram_id)).first()
-
-        if not user:
-            user = User(
-                telegram_id=str(telegram_id),
-                username=username,
-                balance=0,
-                language="en"
-            )
-
-            if referral_telegram_id and referral_telegram_id != telegram_id:
-                referrer = User.query.filter_by(telegram_id=str(referral_telegram_id)).first()
-                if referrer:
-                    user.referrer_id = referrer.id
-                    db.session.add(user)
-                    db.session.commit()
-
-                    active_refs = [u for u in referrer.referred_users if u.games_played > 0]
-                    if len(active_refs) + 1 == 10:
-                                                referrer.balance += 50
-                        db.session.add(Transaction(
-                            user_id=referrer.id,
-                            type="referral_milestone",
-                            amount=50,
-                            status="approved",
-                            reason="Milestone: 10 active referrals"
-                        ))
-                        db.session.add(referrer)
-                        await context.bot.send_message(
-                            chat_id=int(referrer.telegram_id),
-                            text="🎉 You reached 10 active referrals! You've earned a 50 birr bonus!"
-                        )
-
-        else:
-            db.session.commit()
-
-        user_language = user.language
+    user, milestone_referrer = await bot_db.register_user(telegram_id, username, referral_telegram_id)
+    if milestone_referrer:
+        await context.bot.send_message(
+            chat_id=milestone_referrer.telegram_id,
+            text="🎉 You reached 10 active referrals! You've earned a 50 birr bonus!"
+        )
+    user_language = user.language
 
     context.chat_data["language"] = user_language
     lang = LANGUAGE_MAP.get(user_language, LANGUAGE_MAP["en"])
@@ -172,15 +81,13 @@ async def play_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 async def preview(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    telegram_id = str(update.effective_user.id)
-    with flask_app.app_context():
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        cartela = user.cartela or [12, 34, 56, 78, 90]
-        animated = "✨ " + " 🎯 ".join(str(n) for n in cartela) + " ✨"
-        await update.message.reply_text(f"🎨 Your cartela:\n{animated}")
+    telegram_id = update.effective_user.id
+    cartela = await bot_db.get_cartela(telegram_id) or [12, 34, 56, 78, 90]
+    animated = "✨ " + " 🎯 ".join(str(n) for n in cartela) + " ✨"
+    await update.message.reply_text(f"🎨 Your cartela:\n{animated}")
 
 async def edit_cartela(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    telegram_id = str(update.effective_user.id)
+    telegram_id = update.effective_user.id
     text = update.message.text.strip()
     try:
         numbers = [int(n) for n in text.split(",") if 1 <= int(n) <= 90]
@@ -190,120 +97,91 @@ async def edit_cartela(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Please enter 5 numbers between 1 and 90, separated by commas.")
         return
 
-    with flask_app.app_context():
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        user.cartela = numbers
-        db.session.add(user)
-        db.session.commit()
-        await update.message.reply_text(f"✅ Cartela updated: {numbers}")
+    await bot_db.set_cartela(telegram_id, numbers)
+    await update.message.reply_text(f"✅ Cartela updated: {numbers}")
 
 async def join_lobby(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    telegram_id = str(update.effective_user.id)
-    with flask_app.app_context():
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        lobby = Lobby.query.filter_by(status="waiting").first()
-        if not lobby:
-            lobby = Lobby(status="waiting", jackpot=0)
-            db.session.add(lobby)
-            db.session.commit()
-
-        lobby.players.append(user)
-        db.session.add(lobby)
-        db.session.commit()
-        await update.message.reply_text(f"🧩 Joined lobby #{lobby.id}. Waiting for others...")
+    lobby = await bot_db.join_lobby(update.effective_user.id)
+    if not lobby:
+        await update.message.reply_text("❌ You must start the bot first using /start.")
+        return
+    await update.message.reply_text(f"🧩 Joined lobby #{lobby.id}. Waiting for others...")
 
 async def start_jackpot(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    telegram_id = str(update.effective_user.id)
-    with flask_app.app_context():
-        lobby = Lobby.query.filter(Lobby.players.any(telegram_id=str(telegram_id)), Lobby.status=="waiting").first()
-        if not lobby or len(lobby.players) < 2:
-            await update.message.reply_text("❌ Need at least 2 players to start jackpot round.")
-            return
-
-        lobby.status = "active"
-        lobby.jackpot = len(lobby.players) * 10
-        db.session.add(lobby)
-        db.session.commit()
-
-        for player in lobby.players:
-            await context.bot.send_message(chat_id=int(player.telegram_id), text=f"🎰 Jackpot Round Started!\nJackpot: {lobby.jackpot} birr")
+    lobby = await bot_db.start_lobby(update.effective_user.id)
+    if not lobby:
+        await update.message.reply_text("❌ Need at least 2 players to start jackpot round.")
+        return
 
-        await update.message.reply_text(f"✅ Jackpot round started with {len(lobby.players)} players.")
+    await get_broadcaster(context).send_many(
+        (player.telegram_id, f"🎰 Jackpot Round Started!\nJackpot: {lobby.jackpot} birr")
+        for player in lobby.players
+    )
+    await update.message.reply_text(f"✅ Jackpot round started with {len(lobby.players)} players.")
 
 async def end_jackpot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message and update.effective_user.id in ADMIN_IDS:
-        with flask_app.app_context():
-            lobby = Lobby.query.filter_by(status="active").first()
-            if not lobby or not lobby.players:
-                await update.message.reply_text("❌ No active jackpot lobby.")
-                return
-
-            winner = random.choice(lobby.players)
-            winner.balance += lobby.jackpot
-            db.session.add(Transaction(
-                user_id=winner.id,
-                type="jackpot_win",
-                amount=lobby.jackpot,
-                status="approved",
-                reason=f"Jackpot win in lobby #{lobby.id}"
-            ))
-            lobby.status = "completed"
-            db.session.commit()
-
-            for player in lobby.players:
-                msg = "🎉 You won the jackpot!" if player.id == winner.id else "😢 You lost this round."
-                await context.bot.send_message(chat_id=int(player.telegram_id), text=msg)
+        finished = await bot_db.finish_lobby(random.choice)
+        if not finished:
+            await update.message.reply_text("❌ No active jackpot lobby.")
+            return
 
-            await update.message.reply_text(f"✅ Jackpot paid to @{winner.username}")
+        lobby, winner = finished
+        await get_broadcaster(context).send_many(
+            (player.telegram_id, "🎉 You won the jackpot!" if player.id == winner.id else "😢 You lost this round.")
+            for player in lobby.players
+        )
+        await update.message.reply_text(f"✅ Jackpot paid to @{winner.username}")
 
 async def jackpot_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
-        with flask_app.app_context():
-            winners = db.session.query(User.username, func.sum(Transaction.amount))\
-                .join(Transaction).filter(Transaction.type=="jackpot_win")\
-                .group_by(User.username).order_by(func.sum(Transaction.amount).desc()).limit(5).all()
-
-            lines = ["🏆 Jackpot Winners:"]
-            for name, total in winners:
-                lines.append(f"@{name} – {total} birr won")
+        winners = await bot_db.jackpot_leaders(5)
+        lines = ["🏆 Jackpot Winners:"]
+        for name, total in winners:
+            lines.append(f"@{name} – {total} birr won")
 
-            await update.message.reply_text("\n".join(lines))
+        await update.message.reply_text("\n".join(lines))
 
 async def referral_contest(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
-        with flask_app.app_context():
-            users = User.query.all()
-            leaderboard = []
-
-            for u in users:
-                active_refs = [r for r in u.referred_users if r.games_played > 0]
-                bonus = sum(tx.amount for tx in u.transactions if tx.type in ["referral_bonus", "referral_milestone"])
-                if active_refs:
-                    leaderboard.append((u.username, len(active_refs), bonus))
-
-            leaderboard.sort(key=lambda x: x[1], reverse=True)
-            lines = ["🎁 Referral Contest Leaderboard:"]
-            for name, count, bonus in leaderboard[:10]:
-                lines.append(f"@{name} – {count} active referrals, {bonus} birr earned")
+        leaderboard = await bot_db.referral_contest(10)
+        lines = ["🎁 Referral Contest Leaderboard:"]
+        for name, count, bonus in leaderboard:
+            lines.append(f"@{name} – {count} active referrals, {bonus} birr earned")
 
-            await update.message.reply_text("\n".join(lines))
+        await update.message.reply_text("\n".join(lines))
 
 async def replay(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    telegram_id = str(update.effective_user.id)
-    with flask_app.app_context():
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        last_game = Game.query.filter(Game.participants.any(user_id=user.id)).order_by(Game.created_at.desc()).first()
-        if not last_game:
-            await update.message.reply_text("📭 No games played yet.")
-            return
+    last_game = await bot_db.last_game(update.effective_user.id)
+    if not last_game:
+        await update.message.reply_text("📭 No games played yet.")
+        return
+
+    result = "🎉 You won!" if last_game.won else "😢 You lost."
+    sound = "🔊 Sound: ON" if context.chat_data.get("sound_enabled", True) else "🔇 Sound: OFF"
+    await update.message.reply_text(f"🕹️ Last Game #{last_game.game_id}\n{result}\n{sound}")
 
-        result = "🎉 You won!" if last_game.winner_id == user.id else "😢 You lost."
-        sound = "🔊 Sound: ON" if context.chat_data.get("sound_enabled", True) else "🔇 Sound: OFF"
-        await update.message.reply_text(f"🕹️ Last Game #{last_game.id}\n{result}\n{sound}")
 async def remindme(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         await update.message.reply_text("📅 Reminder set! We'll notify you before the next game starts.")
 
+def get_broadcaster(context: ContextTypes.DEFAULT_TYPE) -> BroadcastEngine:
+    # One engine (and one rate limiter) per running bot
+    return context.bot_data.setdefault("broadcaster", BroadcastEngine(context.bot))
+
+async def run_broadcast(context: ContextTypes.DEFAULT_TYPE, broadcast_id: int, chat_id: int):
+    status = await context.bot.send_message(chat_id=chat_id, text=f"📢 Broadcast #{broadcast_id} started...")
+
+    async def progress(stats):
+        text = (f"📢 Broadcast #{broadcast_id}: {stats.sent} sent, {stats.failed} failed"
+                + (" ✅ done" if stats.finished else "..."))
+        try:
+            await status.edit_text(text)
+        except Exception as e:
+            logging.debug(f"Could not update broadcast progress: {e}")
+
+    await get_broadcaster(context).run(broadcast_id, progress)
+
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message:
         sender_id = update.effective_user.id
@@ -316,15 +194,19 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("📢 Please include a message to broadcast.")
             return
 
-        with flask_app.app_context():
-            users = User.query.all()
-            for user in users:
-                try:
-                    await context.bot.send_message(chat_id=int(user.telegram_id), text=f"📢 Announcement:\n{text}")
-                except Exception as e:
-                    logging.warning(f"Failed to send to {user.telegram_id}: {e}")
+        broadcast_id = await get_broadcaster(context).start(text, sender_id)
+        context.application.create_task(run_broadcast(context, broadcast_id, update.effective_chat.id))
+
+async def resume_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message:
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.message.reply_text("❌ You are not authorized to broadcast.")
+            return
+        if not context.args or not context.args[0].isdigit():
+            await update.message.reply_text("📢 Usage: /resume_broadcast <id>")
+            return
 
-        await update.message.reply_text("✅ Broadcast sent to all users.")
+        context.application.create_task(run_broadcast(context, int(context.args[0]), update.effective_chat.id))
 
 async def toggle_auto_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     current = context.chat_data.get("auto_mode", False)
@@ -353,10 +235,13 @@ async def deposit_method(update: Update, context: ContextTypes.DEFAULT_TYPE):
     method = query.data.replace("deposit_", "")
     context.chat_data["deposit_method"] = method
 
+    context.chat_data.pop("deposit_amount", None)
+
+    # The claim states the amount, so a matching bank SMS can approve it without an admin
     instructions = {
-        "cbe_birr": "Send to CBE Birr 0920927761 and reply with the transaction ID.",
-        "telebirr": "Send to Telebirr 0920927761 and reply with the transaction ID.",
-        "cbe_bank": "Deposit to CBE Account 1000316113347 and reply with the transaction ID."
+        "cbe_birr": "Send to CBE Birr 0920927761 and reply with the amount you sent.",
+        "telebirr": "Send to Telebirr 0920927761 and reply with the amount you sent.",
+        "cbe_bank": "Deposit to CBE Account 1000316113347 and reply with the amount you sent."
     }
 
     await query.answer()
@@ -373,102 +258,147 @@ async def handle_user_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_user or not update.message:
         return
 
-    telegram_id = str(update.effective_user.id)
+    telegram_id = update.effective_user.id
     text = update.message.text.strip()
 
-    with flask_app.app_context():
-        user = User.query.filter_by(telegram_id=telegram_id).first()
-        if not user:
-            await update.message.reply_text("❌ You must start the bot first using /start.")
-            return
+    user = await bot_db.get_user(telegram_id)
+    if not user:
+        await update.message.reply_text("❌ You must start the bot first using /start.")
+        return
 
-        if text.startswith("edit:"):
-            context.args = text.replace("edit:", "").strip()
-            await edit_cartela(update, context)
-            return
+    if text.startswith("edit:"):
+        context.args = text.replace("edit:", "").strip()
+        await edit_cartela(update, context)
+        return
 
-        if context.chat_data and "deposit_method" in context.chat_data:
-            method = context.chat_data["deposit_method"]
-            if not is_valid_tx_id(text):
-                await update.message.reply_text("❌ Invalid transaction ID. Please try again.")
+    if context.chat_data and "deposit_method" in context.chat_data:
+        if "deposit_amount" not in context.chat_data:
+            try:
+                amount = float(text)
+            except ValueError:
+                amount = 0
+            if amount <= 0:
+                await update.message.reply_text("❌ Please enter the amount you sent, e.g. 100.")
                 return
+            context.chat_data["deposit_amount"] = amount
+            await update.message.reply_text("🧾 Now reply with the transaction ID.")
+            return
 
-            tx = Transaction(
-                user_id=user.id,
-                type="deposit",
-                amount=0,
-                method=method,
-                status="pending",
-                reference=text
-            )
-            db.session.add(tx)
-            db.session.commit()
-            await update.message.reply_text("✅ Transaction received. Awaiting admin approval.")
+        if not is_valid_tx_id(text):
+            await update.message.reply_text("❌ Invalid transaction ID. Please try again.")
             return
 
-        try:
-            amount = int(text)
-            if amount <= 0 or amount > user.balance:
-                await update.message.reply_text("❌ Invalid amount or insufficient balance.")
-                return
+        await bot_db.create_deposit_request(user.id, context.chat_data.pop("deposit_method"), text,
+                                            context.chat_data.pop("deposit_amount"))
+        await update.message.reply_text("✅ Transaction received. Awaiting confirmation.")
+        return
+
+    try:
+        amount = int(text)
+    except ValueError:
+        await update.message.reply_text("❌ Please enter a valid number.")
+        return
 
-            tx = Transaction(
-                user_id=user.id,
-                type="withdraw",
-                amount=amount,
-                status="pending"
-            )
-            db.session.add(tx)
-            db.session.commit()
-            await update.message.reply_text(f"✅ Withdrawal request for {amount} birr submitted.")
-        except ValueError:
-            await update.message.reply_text("❌ Please enter a valid number.")
+    if not await bot_db.create_withdraw_request(user.id, amount):
+        await update.message.reply_text("❌ Invalid amount or insufficient balance.")
+        return
+    await update.message.reply_text(f"✅ Withdrawal request for {amount} birr submitted.")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     logging.error("Exception while handling an update:", exc_info=context.error)
     if isinstance(update, Update) and update.message:
         await update.message.reply_text("⚠️ Something went wrong. Please try again.")
 
+def build_application(bot=None) -> Application:
+    """
+    Makes the Telegram client with every handler attached. Called once by main(), so
+    importing this module needs no token and opens no connections. `bot` replaces the
+    HTTP client, e.g. benchmark.py's FakeBot.
+    """
+    builder = ApplicationBuilder().bot(bot) if bot is not None else ApplicationBuilder().token(BOT_TOKEN)
+    application = builder.concurrent_updates(True).build()
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("play", play_game))
+    application.add_handler(CommandHandler("auto", toggle_auto_mode))
+    application.add_handler(CommandHandler("sound", toggle_sound))
+    application.add_handler(CommandHandler("help", start))
+    application.add_handler(CommandHandler("lang", toggle_language))
+    application.add_handler(CommandHandler("preview", preview))
+    application.add_handler(CommandHandler("replay", replay))
+    application.add_handler(CommandHandler("remindme", remindme))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(CommandHandler("resume_broadcast", resume_broadcast))
+    application.add_handler(CommandHandler("joinlobby", join_lobby))
+    application.add_handler(CommandHandler("startjackpot", start_jackpot))
+    application.add_handler(CommandHandler("endjackpot", end_jackpot))
+    application.add_handler(CommandHandler("jackpot_leaderboard", jackpot_leaderboard))
+    application.add_handler(CommandHandler("referral_contest", referral_contest))
+
+    application.add_handler(CallbackQueryHandler(deposit_menu, pattern="deposit_menu"))
+    application.add_handler(CallbackQueryHandler(deposit_method, pattern="^deposit_(cbe_birr|telebirr|cbe_bank)$"))
+    application.add_handler(CallbackQueryHandler(withdraw, pattern="withdraw"))
+    application.add_handler(CallbackQueryHandler(toggle_language, pattern="toggle_lang"))
+
+    application.add_handler(MessageHandler(filters.TEXT, handle_user_input))
+    application.add_error_handler(error_handler)
+    metrics.instrument_handlers(application)
+    return application
+
 async def main():
-    telegram_app.add_handler(CommandHandler("start", start))
-    telegram_app.add_handler(CommandHandler("play", play_game))
-    telegram_app.add_handler(CommandHandler("auto", toggle_auto_mode))
-    telegram_app.add_handler(CommandHandler("sound", toggle_sound))
-    telegram_app.add_handler(CommandHandler("help", start))
-    telegram_app.add_handler(CommandHandler("stats", stats))
-    telegram_app.add_handler(CommandHandler("invite", invite))
-    telegram_app.add_handler(CommandHandler("lang", toggle_language))
-    telegram_app.add_handler(CommandHandler("leaderboard", leaderboard))
-    telegram_app.add_handler(CommandHandler("referral_leaderboard", referral_leaderboard))
-    telegram_app.add_handler(CommandHandler("history", history))
-    telegram_app.add_handler(CommandHandler("preview", preview))
-    telegram_app.add_handler(CommandHandler("replay", replay))
-    telegram_app.add_handler(CommandHandler("remindme", remindme))
-    telegram_app.add_handler(CommandHandler("broadcast", broadcast))
-    telegram_app.add_handler(CommandHandler("joinlobby", join_lobby))
-    telegram_app.add_handler(CommandHandler("startjackpot", start_jackpot))
-    telegram_app.add_handler(CommandHandler("endjackpot", end_jackpot))
-    telegram_app.add_handler(CommandHandler("jackpot_leaderboard", jackpot_leaderboard))
-    telegram_app.add_handler(CommandHandler("referral_contest", referral_contest))
-
-    telegram_app.add_handler(CallbackQueryHandler(deposit_menu, pattern="deposit_menu"))
-    telegram_app.add_handler(CallbackQueryHandler(deposit_method, pattern="^deposit_(cbe_birr|telebirr|cbe_bank)$"))
-    telegram_app.add_handler(CallbackQueryHandler(withdraw, pattern="withdraw"))
-    telegram_app.add_handler(CallbackQueryHandler(stats, pattern="stats"))
-    telegram_app.add_handler(CallbackQueryHandler(invite, pattern="invite"))
-    telegram_app.add_handler(CallbackQueryHandler(toggle_language, pattern="toggle_lang"))
-
-    telegram_app.add_handler(MessageHandler(filters.TEXT, handle_user_input))
-    telegram_app.add_error_handler(error_handler)
-
-    logging.info("✅ Arada Bingo Ethiopia bot is starting...")
+    if BOT_MODE == "webhook" and not (TELEGRAM_WEBHOOK_URL and TELEGRAM_WEBHOOK_SECRET):
+        # /webhook refuses every update without the secret, and admin commands trust the sender's id
+        raise RuntimeError("BOT_MODE=webhook needs TELEGRAM_WEBHOOK_URL and TELEGRAM_WEBHOOK_SECRET")
+
+    # 🗄️ Handlers reach the database through bot_db's own pool (DATABASE_URL, or the sqlite fallback)
+    bot_db.configure(os.getenv("DATABASE_URL") or "sqlite:///arada.db")
+    telegram_app = build_application()
+
+    # 📈 In polling mode the handlers run here, so this process serves its own /metrics
+    if METRICS_PORT and BOT_MODE != "webhook":
+        metrics.instrument_sql()
+        metrics.serve(METRICS_PORT)
+        if PROFILER:
+            metrics.profiler.start(PROFILER_INTERVAL)
+
+    logging.info(f"✅ Arada Bingo Ethiopia bot is starting ({BOT_MODE})...")
 
     await telegram_app.initialize()
-    await telegram_app.bot.delete_webhook(drop_pending_updates=True)
-    flask_app.app_context().push()
+    if BOT_MODE == "webhook":
+        await telegram_app.bot.set_webhook(
+            TELEGRAM_WEBHOOK_URL,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+        )
+    else:
+        await telegram_app.bot.delete_webhook(drop_pending_updates=True)
     await telegram_app.start()
-    await telegram_app.updater.start_polling()
-    await telegram_app.updater.wait_until_closed()
+
+    # 📬 Admin notifications queued by the web app go out through the broadcast rate limiter
+    engine = telegram_app.bot_data.setdefault("broadcaster", BroadcastEngine(telegram_app.bot))
+    outbox_worker = OutboxWorker(engine)
+    outbox_task = asyncio.create_task(outbox_worker.run())
+
+    # Run until SIGINT / SIGTERM, then stop polling, the application and the outbox in turn
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass    # no signal handlers on Windows or off the main thread; Ctrl+C still cancels us
+    try:
+        if BOT_MODE != "webhook":
+            await telegram_app.updater.start_polling()
+        await stopping.wait()
+    finally:
+        logging.info("🛑 Bot is stopping...")
+        if telegram_app.updater.running:
+            await telegram_app.updater.stop()
+        await telegram_app.stop()
+        outbox_worker.stop()
+        await outbox_task
+        await telegram_app.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,318 @@
+# bot_db.py
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+from models import User, Transaction, Game, GameParticipant, Lobby, ChatState
+import leaderboards
+import referral_stats
+import wallet
+
+T = TypeVar("T")
+
+# 🧵 Bot queries run here, never on the telegram event loop
+BOT_DB_WORKERS = int(os.getenv("BOT_DB_WORKERS", 8))
+
+_url: Optional[str] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_sessions: Optional[scoped_session] = None
+_lock = threading.Lock()
+
+def configure(url: str):
+    """
+    Points the bot's data layer at a database. Nothing connects until the first query.
+    """
+    global _url
+    _url = url
+
+def _session_factory() -> scoped_session:
+    global _executor, _sessions
+    if _sessions is None:
+        with _lock:
+            if _sessions is None:
+                url = _url or os.getenv("DATABASE_URL") or "sqlite:///arada.db"
+                engine = create_engine(
+                    url,
+                    pool_size=BOT_DB_WORKERS,
+                    max_overflow=0,
+                    pool_recycle=300,
+                    pool_pre_ping=True,
+                ) if not url.startswith("sqlite") else create_engine(url)
+                _executor = ThreadPoolExecutor(max_workers=BOT_DB_WORKERS, thread_name_prefix="bot-db")
+                # One session per executor thread, discarded after every unit of work
+                _sessions = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+    return _sessions
+
+def _unit_of_work(fn: Callable[..., T], args: tuple) -> T:
+    session = _session_factory()()
+    try:
+        result = fn(session, *args)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        _sessions.remove()
+
+async def run(fn: Callable[..., T], *args) -> T:
+    """
+    Runs fn(session, *args) on the bounded DB pool in its own transaction.
+    """
+    _session_factory()
+    return await asyncio.get_running_loop().run_in_executor(_executor, _unit_of_work, fn, args)
+
+# -------------------- USERS --------------------
+
+@dataclass(frozen=True)
+class UserRow:
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    balance: float
+    language: str
+    games_played: int
+    games_won: int
+
+def _user_row(user: User) -> UserRow:
+    return UserRow(
+        id=user.id,
+        telegram_id=int(user.telegram_id),
+        username=user.username,
+        balance=user.balance or 0.0,
+        language=user.language or "en",
+        games_played=user.games_played or 0,
+        games_won=user.games_won or 0,
+    )
+
+def _get_user(session: Session, telegram_id: int) -> Optional[UserRow]:
+    user = session.query(User).filter_by(telegram_id=telegram_id).first()
+    return _user_row(user) if user else None
+
+async def get_user(telegram_id: int) -> Optional[UserRow]:
+    return await run(_get_user, telegram_id)
+
+def _register_user(session: Session, telegram_id: int, username: Optional[str],
+                   referrer_telegram_id: Optional[int]) -> Tuple[UserRow, Optional[UserRow]]:
+    user = session.query(User).filter_by(telegram_id=telegram_id).first()
+    if user:
+        return _user_row(user), None
+
+    user = User(telegram_id=telegram_id, username=username, balance=0, language="en")
+    session.add(user)
+    milestone = None
+    if referrer_telegram_id and referrer_telegram_id != telegram_id:
+        referrer = session.query(User).filter_by(telegram_id=referrer_telegram_id).first()
+        if referrer:
+            user.referrer_id = referrer.id
+            referral_stats.record_referral(session, referrer.id)
+            active_refs = (
+                session.query(func.count(User.id))
+                .filter(User.referrer_id == referrer.id, User.games_played > 0)
+                .scalar()
+            )
+            if active_refs + 1 == 10:
+                milestone_tx = Transaction(
+                    user_id=referrer.id,
+                    type="referral_milestone",
+                    amount=50,
+                    status="approved",
+                    reason="Milestone: 10 active referrals"
+                )
+                session.add(milestone_tx)
+                session.flush()
+                wallet.credit(session, referrer.id, 50, "referral_bonus",
+                              reference=f"milestone:{referrer.id}", transaction_id=milestone_tx.id)
+                referral_stats.record_bonus(session, referrer.id, 50)
+                milestone = referrer
+    session.flush()
+    return _user_row(user), _user_row(milestone) if milestone else None
+
+async def register_user(telegram_id: int, username: Optional[str],
+                        referrer_telegram_id: Optional[int] = None) -> Tuple[UserRow, Optional[UserRow]]:
+    """
+    Returns the user and, when this sign-up completed the referrer's
+    10-active-referral milestone, the referrer who was just paid.
+    """
+    return await run(_register_user, telegram_id, username, referrer_telegram_id)
+
+def _get_cartela(session: Session, telegram_id: int):
+    user = session.query(User).filter_by(telegram_id=telegram_id).first()
+    return getattr(user, "cartela", None) if user else None
+
+async def get_cartela(telegram_id: int):
+    return await run(_get_cartela, telegram_id)
+
+def _set_cartela(session: Session, telegram_id: int, numbers: List[int]):
+    user = session.query(User).filter_by(telegram_id=telegram_id).first()
+    user.cartela = numbers
+
+async def set_cartela(telegram_id: int, numbers: List[int]):
+    await run(_set_cartela, telegram_id, numbers)
+
+# -------------------- TRANSACTIONS --------------------
+
+def _create_deposit_request(session: Session, user_id: int, method: str, reference: str, amount: float) -> int:
+    tx = Transaction(user_id=user_id, type="deposit", amount=amount, method=method, status="pending", reference=reference)
+    session.add(tx)
+    session.flush()
+    return tx.id
+
+async def create_deposit_request(user_id: int, method: str, reference: str, amount: float) -> int:
+    """
+    amount is what the user says they sent; reconciliation approves the claim only
+    when a bank receipt with the same reference shows that amount.
+    """
+    return await run(_create_deposit_request, user_id, method, reference, amount)
+
+def _create_withdraw_request(session: Session, user_id: int, amount: float) -> Optional[int]:
+    user = session.get(User, user_id)
+    if not user or amount <= 0 or amount > (user.balance or 0):
+        return None
+    tx = Transaction(user_id=user_id, type="withdraw", amount=amount, status="pending")
+    session.add(tx)
+    session.flush()
+    return tx.id
+
+async def create_withdraw_request(user_id: int, amount: float) -> Optional[int]:
+    """
+    Returns the new transaction id, or None when the balance doesn't cover it.
+    """
+    return await run(_create_withdraw_request, user_id, amount)
+
+def _jackpot_leaders(session: Session, limit: int) -> List[Tuple[str, float]]:
+    return [(row["username"], row["jackpot"]) for row in leaderboards.top(session, "jackpot", limit)]
+
+async def jackpot_leaders(limit: int = 5) -> List[Tuple[str, float]]:
+    return await run(_jackpot_leaders, limit)
+
+def _referral_contest(session: Session, limit: int) -> List[Tuple[str, int, float]]:
+    return [
+        (username, active, bonus)
+        for _, username, _, active, bonus in referral_stats.top_referrers(session, limit)
+    ]
+
+async def referral_contest(limit: int = 10) -> List[Tuple[str, int, float]]:
+    return await run(_referral_contest, limit)
+
+# -------------------- GAMES --------------------
+
+@dataclass(frozen=True)
+class GameResult:
+    game_id: int
+    won: bool
+
+def _last_game(session: Session, telegram_id: int) -> Optional[GameResult]:
+    user = session.query(User).filter_by(telegram_id=telegram_id).first()
+    if not user:
+        return None
+    game = (
+        session.query(Game)
+        .join(GameParticipant, GameParticipant.game_id == Game.id)
+        .filter(GameParticipant.user_id == user.id)
+        .order_by(Game.created_at.desc())
+        .first()
+    )
+    return GameResult(game_id=game.id, won=game.winner_id == user.id) if game else None
+
+async def last_game(telegram_id: int) -> Optional[GameResult]:
+    return await run(_last_game, telegram_id)
+
+# -------------------- LOBBIES --------------------
+
+@dataclass(frozen=True)
+class LobbyRow:
+    id: int
+    status: str
+    jackpot: float
+    players: Tuple[UserRow, ...]
+
+def _lobby_row(lobby: Lobby) -> LobbyRow:
+    return LobbyRow(
+        id=lobby.id,
+        status=lobby.status,
+        jackpot=lobby.jackpot or 0.0,
+        players=tuple(_user_row(u) for u in lobby.players),
+    )
+
+def _join_lobby(session: Session, telegram_id: int) -> Optional[LobbyRow]:
+    user = session.query(User).filter_by(telegram_id=telegram_id).first()
+    if not user:
+        return None
+    lobby = session.query(Lobby).filter_by(status="waiting").first()
+    if not lobby:
+        lobby = Lobby(status="waiting", jackpot=0)
+        session.add(lobby)
+    if user not in lobby.players:
+        lobby.players.append(user)
+    session.flush()
+    return _lobby_row(lobby)
+
+async def join_lobby(telegram_id: int) -> Optional[LobbyRow]:
+    return await run(_join_lobby, telegram_id)
+
+def _start_lobby(session: Session, telegram_id: int, stake: float) -> Optional[LobbyRow]:
+    lobby = (
+        session.query(Lobby)
+        .filter(Lobby.players.any(User.telegram_id == telegram_id), Lobby.status == "waiting")
+        .with_for_update()
+        .first()
+    )
+    if not lobby or len(lobby.players) < 2:
+        return None
+    lobby.status = "active"
+    lobby.jackpot = len(lobby.players) * stake
+    return _lobby_row(lobby)
+
+async def start_lobby(telegram_id: int, stake: float = 10) -> Optional[LobbyRow]:
+    """
+    Starts the waiting lobby the user is in; None if it has fewer than two players.
+    """
+    return await run(_start_lobby, telegram_id, stake)
+
+def _finish_lobby(session: Session, pick_winner: Callable[[list], User]) -> Optional[Tuple[LobbyRow, UserRow]]:
+    lobby = session.query(Lobby).filter_by(status="active").with_for_update().first()
+    if not lobby or not lobby.players:
+        return None
+    winner = pick_winner(lobby.players)
+    jackpot_tx = Transaction(
+        user_id=winner.id,
+        type="jackpot_win",
+        amount=lobby.jackpot,
+        status="approved",
+        reason=f"Jackpot win in lobby #{lobby.id}",
+        completed_at=datetime.utcnow()
+    )
+    session.add(jackpot_tx)
+    lobby.status = "completed"
+    session.flush()
+    wallet.credit(session, winner.id, lobby.jackpot, "jackpot_win",
+                  reference=f"lobby:{lobby.id}", transaction_id=jackpot_tx.id)
+    session.refresh(winner)
+    return _lobby_row(lobby), _user_row(winner)
+
+async def finish_lobby(pick_winner: Callable[[list], User]) -> Optional[Tuple[LobbyRow, UserRow]]:
+    return await run(_finish_lobby, pick_winner)
+
+# -------------------- CHAT STATE --------------------
+
+def _load_chat_state(session: Session, chat_id: int) -> dict:
+    row = session.get(ChatState, chat_id)
+    return json.loads(row.data) if row else {}
+
+async def load_chat_state(chat_id: int) -> dict:
+    return await run(_load_chat_state, chat_id)
+
+def _save_chat_state(session: Session, chat_id: int, data: dict):
+    session.merge(ChatState(chat_id=chat_id, data=json.dumps(data), updated_at=datetime.utcnow()))
+
+async def save_chat_state(chat_id: int, data: dict):
+    await run(_save_chat_state, chat_id, data)
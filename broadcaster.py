@@ -0,0 +1,200 @@
+# broadcaster.py
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, insert, update
+from sqlalchemy.orm import Session
+
+import bot_db
+from models import User, Broadcast, BroadcastDelivery
+
+# Telegram allows ~30 messages/s overall and ~1/s into the same chat
+GLOBAL_RATE = 25.0
+PER_CHAT_RATE = 1.0
+
+# -------------------- RATE LIMITING --------------------
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # Telegram's retry_after applies to the whole bot, so drain the bucket for that long
+        self.tokens = -seconds * self.rate
+
+class RateLimiter:
+    """
+    Global bucket plus a small LRU of per-chat buckets.
+    """
+
+    def __init__(self, rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_chats = max_chats
+        self.chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+    async def acquire(self, chat_id: int):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            bucket = self.chats[chat_id] = TokenBucket(self.per_chat_rate, 1)
+            if len(self.chats) > self.max_chats:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(chat_id)
+        await bucket.acquire()
+        await self.global_bucket.acquire()
+
+# -------------------- DELIVERY STATE --------------------
+
+@dataclass
+class BroadcastStats:
+    broadcast_id: int
+    sent: int = 0
+    failed: int = 0
+    finished: bool = False
+
+def _create(session: Session, text: str, created_by: Optional[int]) -> int:
+    broadcast = Broadcast(text=text, created_by=created_by, status="running", last_user_id=0, sent=0, failed=0)
+    session.add(broadcast)
+    session.flush()
+    return broadcast.id
+
+def _load(session: Session, broadcast_id: int) -> Optional[Tuple[str, int, int, int, str]]:
+    b = session.get(Broadcast, broadcast_id)
+    return (b.text, b.last_user_id or 0, b.sent or 0, b.failed or 0, b.status) if b else None
+
+def _next_recipients(session: Session, broadcast_id: int, after_id: int, limit: int) -> Tuple[int, List[Tuple[int, int]]]:
+    rows = (
+        session.query(User.id, User.telegram_id, BroadcastDelivery.id)
+        .outerjoin(BroadcastDelivery, and_(BroadcastDelivery.user_id == User.id,
+                                           BroadcastDelivery.broadcast_id == broadcast_id))
+        .filter(User.id > after_id)
+        .order_by(User.id)
+        .limit(limit)
+        .all()
+    )
+    last_id = rows[-1][0] if rows else after_id
+    return last_id, [(uid, int(tid)) for uid, tid, delivered in rows if delivered is None]
+
+def _record(session: Session, broadcast_id: int, last_user_id: int, results: List[Tuple[int, str, int, Optional[str]]]):
+    if results:
+        session.execute(insert(BroadcastDelivery), [
+            {"broadcast_id": broadcast_id, "user_id": uid, "status": status, "attempts": attempts, "error": error}
+            for uid, status, attempts, error in results
+        ])
+    sent = sum(1 for r in results if r[1] == "sent")
+    session.execute(
+        update(Broadcast).where(Broadcast.id == broadcast_id).values(
+            last_user_id=last_user_id,
+            sent=Broadcast.sent + sent,
+            failed=Broadcast.failed + (len(results) - sent),
+        )
+    )
+
+def _finish(session: Session, broadcast_id: int):
+    session.execute(
+        update(Broadcast).where(Broadcast.id == broadcast_id).values(status="completed", finished_at=datetime.utcnow())
+    )
+
+# -------------------- ENGINE --------------------
+
+Progress = Callable[[BroadcastStats], Awaitable[None]]
+
+class BroadcastEngine:
+    """
+    Streams recipients in keyset-paginated chunks and sends each chunk concurrently
+    under the rate limiter. Results are written per chunk, so an interrupted
+    broadcast resumes from its cursor; at most the chunk in flight is sent again.
+    Only `bot.send_message` is used, so any object with that coroutine will do.
+    """
+
+    def __init__(self, bot, limiter: Optional[RateLimiter] = None, chunk_size: int = 500,
+                 concurrency: int = 20, max_attempts: int = 3):
+        self.bot = bot
+        self.limiter = limiter or RateLimiter()
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+    async def send(self, chat_id: int, text: str) -> Tuple[str, int, Optional[str]]:
+        attempts = 0
+        while True:
+            attempts += 1
+            await self.limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return "sent", attempts, None
+            except Exception as e:
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is None or attempts >= self.max_attempts:
+                    return "failed", attempts, str(e)[:200]
+                seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                self.limiter.global_bucket.pause(seconds)
+                await asyncio.sleep(seconds)
+
+    async def send_many(self, messages: Iterable[Tuple[int, str]]) -> List[Tuple[str, int, Optional[str]]]:
+        """
+        Rate-limited fan-out without delivery tracking, for game notifications.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(chat_id: int, text: str):
+            async with semaphore:
+                return await self.send(chat_id, text)
+
+        return await asyncio.gather(*(one(chat_id, text) for chat_id, text in messages))
+
+    async def start(self, text: str, created_by: Optional[int] = None) -> int:
+        return await bot_db.run(_create, text, created_by)
+
+    async def run(self, broadcast_id: int, progress: Optional[Progress] = None) -> BroadcastStats:
+        state = await bot_db.run(_load, broadcast_id)
+        if state is None:
+            raise ValueError(f"Broadcast {broadcast_id} not found")
+        text, cursor, sent, failed, status = state
+        stats = BroadcastStats(broadcast_id, sent, failed, status == "completed")
+        message = f"📢 Announcement:\n{text}"
+
+        while not stats.finished:
+            last_id, recipients = await bot_db.run(_next_recipients, broadcast_id, cursor, self.chunk_size)
+            if last_id == cursor:
+                await bot_db.run(_finish, broadcast_id)
+                stats.finished = True
+                break
+
+            results = await self.send_many((telegram_id, message) for _, telegram_id in recipients)
+            rows = [(uid, status, attempts, error) for (uid, _), (status, attempts, error) in zip(recipients, results)]
+            await bot_db.run(_record, broadcast_id, last_id, rows)
+            for uid, status, _, error in rows:
+                if status == "sent":
+                    stats.sent += 1
+                else:
+                    stats.failed += 1
+                    logging.warning(f"Broadcast {broadcast_id}: failed to send to user {uid}: {error}")
+            cursor = last_id
+            if progress:
+                await progress(stats)
+
+        if progress:
+            await progress(stats)
+        return stats
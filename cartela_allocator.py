@@ -0,0 +1,160 @@
+# cartela_allocator.py
+import base64
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from config import CARTELA_SIZE, CARTELA_RESERVATION_SECONDS, CARTELA_MAX_RESERVATIONS
+
+# Which cartela numbers a room can still hand out. Free numbers sit in an array with
+# each number's position kept beside it, so taking a given number, picking a random
+# one and giving one back are all swap-with-last O(1) moves however full the room is.
+# A bitmap of free numbers is kept in step for the snapshot the selection page polls.
+
+class CartelaAllocator:
+    """
+    Numbers 1..size are free, reserved (held for a player who is still choosing,
+    until the reservation expires) or taken (on a board in the room). Each player
+    holds at most limit reservations at once.
+    Not thread-safe: the room serialises access.
+    """
+
+    def __init__(self, size: int = CARTELA_SIZE, ttl: float = CARTELA_RESERVATION_SECONDS,
+                 limit: int = CARTELA_MAX_RESERVATIONS, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.limit = limit
+        self.clock = clock
+        self._free = list(range(1, size + 1))
+        self._pos = list(range(-1, size))                   # _pos[n] = index of n in _free, -1 if not free
+        self._bits = bytearray(b"\xff" * (size // 8) + (bytes([(1 << size % 8) - 1]) if size % 8 else b""))
+        self._reserved: Dict[int, Tuple[Any, float]] = {}   # number -> (user_id, expires_at)
+        self._expiry: Deque[Tuple[float, int]] = deque()     # in expiry order, since ttl is fixed
+        self._held: Dict[Any, int] = {}                      # user_id -> numbers reserved
+        self.taken = 0
+
+    # -------------------- FREE LIST --------------------
+
+    def _remove_free(self, number: int):
+        i = self._pos[number]
+        last = self._free.pop()
+        if last != number:
+            self._free[i] = last
+            self._pos[last] = i
+        self._pos[number] = -1
+        self._bits[(number - 1) >> 3] &= ~(1 << ((number - 1) & 7))
+
+    def _add_free(self, number: int):
+        self._pos[number] = len(self._free)
+        self._free.append(number)
+        self._bits[(number - 1) >> 3] |= 1 << ((number - 1) & 7)
+
+    def _expire(self):
+        now = self.clock()
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, number = self._expiry.popleft()
+            held = self._reserved.get(number)
+            if held and held[1] == expires_at:
+                self._unreserve(number)
+                self._add_free(number)
+
+    def _unreserve(self, number: int) -> Any:
+        user_id = self._reserved.pop(number)[0]
+        if self._held[user_id] > 1:
+            self._held[user_id] -= 1
+        else:
+            del self._held[user_id]
+        return user_id
+
+    # -------------------- QUERIES --------------------
+
+    def in_range(self, number: int) -> bool:
+        return 1 <= number <= self.size
+
+    def available_to(self, number: int, user_id: Any = None) -> bool:
+        """
+        True if number is free, or reserved by user_id.
+        """
+        if not self.in_range(number):
+            return False
+        self._expire()
+        if self._pos[number] >= 0:
+            return True
+        held = self._reserved.get(number)
+        return held is not None and held[0] == user_id
+
+    def held_by(self, user_id: Any) -> int:
+        self._expire()
+        return self._held.get(user_id, 0)
+
+    def random_free(self) -> Optional[int]:
+        self._expire()
+        return self._free[random.randrange(len(self._free))] if self._free else None
+
+    def free_count(self) -> int:
+        self._expire()
+        return len(self._free)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        {"size", "free_count", "free"}: free is base64 of a bitmap, bit (n-1) set when
+        cartela n can be picked (lowest bit of each byte first).
+        """
+        self._expire()
+        return {
+            "size": self.size,
+            "free_count": len(self._free),
+            "free": base64.b64encode(bytes(self._bits)).decode("ascii"),
+        }
+
+    # -------------------- CHANGES --------------------
+
+    def reserve(self, number: int, user_id: Any) -> Optional[float]:
+        """
+        Holds number for user_id for ttl seconds (again from now if they already hold it).
+        Returns the expiry time, or None if someone else has it or user_id already
+        holds limit other numbers.
+        """
+        if not self.available_to(number, user_id):
+            return None
+        if self._pos[number] >= 0:
+            if self._held.get(user_id, 0) >= self.limit:
+                return None
+            self._remove_free(number)
+            self._held[user_id] = self._held.get(user_id, 0) + 1
+        expires_at = self.clock() + self.ttl
+        self._reserved[number] = (user_id, expires_at)
+        self._expiry.append((expires_at, number))
+        return expires_at
+
+    def cancel(self, number: int, user_id: Any) -> bool:
+        held = self._reserved.get(number)
+        if held is None or held[0] != user_id:
+            return False
+        self._unreserve(number)
+        self._add_free(number)
+        return True
+
+    def take(self, number: int):
+        """
+        Marks number as on a board, whatever state it was in. Rebuilding a room from
+        the database goes through here, so it never refuses.
+        """
+        if not self.in_range(number):
+            return
+        if self._pos[number] >= 0:
+            self._remove_free(number)
+        elif number in self._reserved:
+            self._unreserve(number)
+        else:
+            return                                          # already taken
+        self.taken += 1
+
+    def release(self, number: int):
+        """
+        Gives a taken number back, e.g. when a join is rolled back.
+        """
+        if self.in_range(number) and self._pos[number] < 0 and number not in self._reserved:
+            self._add_free(number)
+            self.taken -= 1
@@ -0,0 +1,77 @@
+# cartela_catalog.py
+import os
+import random
+import threading
+from types import MappingProxyType
+from typing import List, Mapping, Optional, Tuple
+
+from config import CARTELA_SIZE, CARTELA_FILE
+
+Cartela = Tuple[int, ...]
+
+_lock = threading.Lock()
+_boards: List[Cartela] = []
+_cells: List[Mapping[int, int]] = []
+
+# -------------------- LAYOUT --------------------
+
+def build_cartela(cartela_number: int) -> Cartela:
+    # A private Random gives the same layouts the old global reseed produced,
+    # without touching the RNG the number caller draws from.
+    rng = random.Random(cartela_number)
+    b = rng.sample(range(1, 16), 5)
+    i = rng.sample(range(16, 31), 5)
+    n = rng.sample(range(31, 46), 5)
+    g = rng.sample(range(46, 61), 5)
+    o = rng.sample(range(61, 76), 5)
+
+    board = []
+    for row in range(5):
+        board.extend([b[row], i[row], n[row], g[row], o[row]])
+    return tuple(board)
+
+def _index(board: Cartela) -> Mapping[int, int]:
+    return MappingProxyType({number: cell for cell, number in enumerate(board) if cell != 12})
+
+# -------------------- CATALOG --------------------
+
+def load(size: int = CARTELA_SIZE, path: Optional[str] = CARTELA_FILE):
+    boards = None
+    if path and os.path.exists(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) == size * 25:
+            boards = [tuple(data[k * 25:(k + 1) * 25]) for k in range(size)]
+    if boards is None:
+        boards = [build_cartela(k) for k in range(1, size + 1)]
+
+    global _boards, _cells
+    _cells = [_index(board) for board in boards]
+    _boards = boards
+
+def save(path: str):
+    _ensure_loaded()
+    with open(path, "wb") as f:
+        f.write(b"".join(bytes(board) for board in _boards))
+
+def _ensure_loaded():
+    if not _boards:
+        with _lock:
+            if not _boards:
+                load()
+
+def get_cartela(cartela_number: int) -> Cartela:
+    _ensure_loaded()
+    if 1 <= cartela_number <= len(_boards):
+        return _boards[cartela_number - 1]
+    return build_cartela(cartela_number)
+
+def get_cells(cartela_number: int) -> Mapping[int, int]:
+    _ensure_loaded()
+    if 1 <= cartela_number <= len(_boards):
+        return _cells[cartela_number - 1]
+    return _index(build_cartela(cartela_number))
+
+def size() -> int:
+    _ensure_loaded()
+    return len(_boards)
@@ -11,17 +11,45 @@ ADMIN_IDS = [int(id.strip()) for id in os.getenv("ADMIN_IDS", "").split(",") if
 
 # 🎮 Game Settings
 CARTELA_SIZE = int(os.getenv("CARTELA_SIZE", 100))  # Total numbers in Bingo
+CARTELA_FILE = os.getenv("CARTELA_FILE")  # Optional prebuilt catalog, 25 bytes per cartela
+CARTELA_RESERVATION_SECONDS = float(os.getenv("CARTELA_RESERVATION_SECONDS", 60))  # hold while a player picks
+CARTELA_MAX_RESERVATIONS = int(os.getenv("CARTELA_MAX_RESERVATIONS", 5))  # cartelas one player may hold per room at once
+WEBAPP_AUTH_MAX_AGE = float(os.getenv("WEBAPP_AUTH_MAX_AGE", 86400))       # seconds a Telegram WebApp login stays valid
 MIN_PLAYERS = int(os.getenv("MIN_PLAYERS", 2))
 GAME_PRICES = [10, 20, 30, 50, 100]  # ETB options
 MIN_GAMES_FOR_WITHDRAWAL = int(os.getenv("MIN_GAMES_FOR_WITHDRAWAL", 5))
 MIN_WINS_FOR_WITHDRAWAL = int(os.getenv("MIN_WINS_FOR_WITHDRAWAL", 1))
 REFERRAL_BONUS = int(os.getenv("REFERRAL_BONUS", 20))  # ETB bonus
+GAME_STORE = os.getenv("GAME_STORE", "sql")  # "sql" (shared, survives restarts) or "memory"
+ROOM_SHARDS = int(os.getenv("ROOM_SHARDS", 1))  # processes the rooms are split across, by game ID
+ROOM_SHARD = int(os.getenv("ROOM_SHARD", 0))    # this process's shard, 0..ROOM_SHARDS-1
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", 100))     # rows kept per global leaderboard
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL", 5))       # seconds a worker serves its copy before re-checking
+LEADERBOARD_REBUILD = float(os.getenv("LEADERBOARD_REBUILD", 600))  # seconds between full rebuilds by each worker; 0 = never
+
+# 🤖 Telegram Updates
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # "polling" (bot.py fetches updates) or "webhook" (web app's /webhook)
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")        # public https URL of /webhook
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")  # X-Telegram-Bot-Api-Secret-Token; required in webhook mode
+WEBHOOK_HANDLERS = int(os.getenv("WEBHOOK_HANDLERS", 16))       # updates handled at once per web worker
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", 60))  # a chat stays with one worker this long per update
+
+# 💳 Payment Webhooks
+CHAPA_WEBHOOK_SECRET = os.getenv("CHAPA_WEBHOOK_SECRET")  # HMAC key; unset disables /chapa/webhook
+SMS_WEBHOOK_SECRET = os.getenv("SMS_WEBHOOK_SECRET")      # X-Webhook-Secret expected from the Tasker phone; unset disables /webhook/deposit
+RECEIPT_MATCH_HOURS = float(os.getenv("RECEIPT_MATCH_HOURS", 24))  # unclaimed SMS receipts go to review after this
 
 # 🛡️ Admin Panel Credentials
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 
+# 📈 Metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")          # bearer token for /metrics; unset leaves it open and the profiler env-only
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))    # bot.py in polling mode serves /metrics here; 0 = off
+PROFILER = os.getenv("PROFILER") == "1"             # start the sampling profiler with the process
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", 0.01))  # seconds between stack samples
+
 # 🧠 Database Configuration
 SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL")
 SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -29,3 +57,4 @@ SQLALCHEMY_TRACK_MODIFICATIONS = False
 # 🌐 Flask Server Configuration
 FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
 FLASK_PORT = int(os.getenv("FLASK_PORT", 5000))
+ADMIN_PANEL_PREFIX = os.getenv("ADMIN_PANEL_PREFIX", "/panel")  # admin_panel's pages share /admin/* paths with routes/admin.py
@@ -0,0 +1,105 @@
+# dashboard_data.py
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import User, Game, Transaction
+import transaction_queries
+
+# Everything the admin dashboard shows comes from here: one aggregate query for the
+# counters and keyset pages for the lists, so a page load costs the same with a
+# hundred players or a hundred thousand.
+
+PAGE_SIZE = 50
+SUMMARY_TTL = 10.0                       # seconds the counters may lag behind
+
+WITHDRAW_TYPES = ("withdraw", "withdrawal")
+
+_summary_cache: Dict[str, Any] = {"at": 0.0, "data": None}
+
+Page = Tuple[List[Dict[str, Any]], Optional[int]]   # rows, cursor for the next page
+
+# -------------------- SUMMARY --------------------
+
+def _count(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+def _total(*criteria):
+    return select(func.coalesce(func.sum(Transaction.amount), 0)).where(*criteria).scalar_subquery()
+
+def summary(session: Session, max_age: float = SUMMARY_TTL) -> Dict[str, Any]:
+    """
+    Totals, running games and pending queues in a single round trip, cached for max_age seconds.
+    """
+    now = time.monotonic()
+    if _summary_cache["data"] is not None and now - _summary_cache["at"] < max_age:
+        return _summary_cache["data"]
+
+    pending_deposit = (Transaction.type == "deposit", Transaction.status == "pending")
+    pending_withdraw = (Transaction.type.in_(WITHDRAW_TYPES), Transaction.status == "pending")
+    row = session.execute(select(
+        _count(User).label("total_players"),
+        _count(Game, Game.status == "active").label("active_games"),
+        _count(Game, Game.status == "waiting").label("waiting_games"),
+        _count(Transaction, *pending_deposit).label("pending_deposits"),
+        _total(*pending_deposit).label("pending_deposit_total"),
+        _count(Transaction, *pending_withdraw).label("pending_withdrawals"),
+        _total(*pending_withdraw).label("pending_withdrawal_total"),
+        select(func.coalesce(func.sum(Game.commission), 0)).where(Game.status == "finished")
+            .scalar_subquery().label("commission_total"),
+    )).one()
+
+    data = dict(row._mapping)
+    _summary_cache.update(at=now, data=data)
+    return data
+
+def invalidate_summary():
+    _summary_cache["data"] = None
+
+# -------------------- LISTINGS --------------------
+
+def _page(rows: list, limit: int) -> Page:
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return [dict(r._mapping) for r in rows], (rows[-1].id if more else None)
+
+def players(session: Session, before: Optional[int] = None, q: Optional[str] = None,
+            limit: int = PAGE_SIZE) -> Page:
+    """
+    Newest players first. `q` is a username prefix, or an exact telegram ID when it is all digits.
+    """
+    stmt = select(User.id, User.username, User.telegram_id, User.balance,
+                  User.games_played, User.games_won, User.created_at)
+    if before:
+        stmt = stmt.where(User.id < before)
+    if q:
+        q = q.strip()
+        stmt = stmt.where(User.telegram_id == int(q) if q.isdigit() else User.username.like(f"{q}%"))
+    return _page(session.execute(stmt.order_by(User.id.desc()).limit(limit + 1)).all(), limit)
+
+def games(session: Session, before: Optional[int] = None, status: Optional[str] = None,
+          limit: int = PAGE_SIZE) -> Page:
+    stmt = select(Game.id, Game.status, Game.entry_price, Game.pool, Game.payout,
+                  Game.commission, Game.winner_id, Game.created_at, Game.finished_at)
+    if before:
+        stmt = stmt.where(Game.id < before)
+    if status:
+        stmt = stmt.where(Game.status == status)
+    return _page(session.execute(stmt.order_by(Game.id.desc()).limit(limit + 1)).all(), limit)
+
+def pending(session: Session, kind: str, cursor: Optional[str] = None,
+            limit: int = PAGE_SIZE) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Oldest pending deposits or withdrawals first, with the username joined in.
+    """
+    rows, cursor = transaction_queries.query(
+        session,
+        types=WITHDRAW_TYPES if kind == "withdraw" else kind,
+        status="pending",
+        cursor=cursor,
+        limit=limit,
+        oldest_first=True
+    )
+    return [transaction_queries.as_dict(r) for r in rows], cursor
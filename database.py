@@ -1,5 +1,6 @@
 import os
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
@@ -8,23 +9,34 @@ class Base(DeclarativeBase):
 db = SQLAlchemy(model_class=Base)
 
 def init_db(app):
-    db_uri = os.environ.get("DATABASE_URL")
+    """
+    Binds db to the app. Nothing connects until the first query, and the schema is
+    left alone: tables and columns are created by migrations.migrate().
+    """
+    db_uri = app.config.get("SQLALCHEMY_DATABASE_URI") or os.environ.get("DATABASE_URL")
     if not db_uri:
         raise RuntimeError("DATABASE_URL environment variable not set.")
 
-    print(f"Connecting to database: {db_uri}")
-
     app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
         "pool_recycle": 300,
         "pool_pre_ping": True,
-    }
+    })
 
     db.init_app(app)
-
     with app.app_context():
-        import models
-        db.create_all()
+        for engine in db.engines.values():
+            if engine.dialect.driver == "pysqlite":
+                _real_sqlite_transactions(engine)
+
+def _real_sqlite_transactions(engine):
+    # pysqlite only sends BEGIN before a write, so a SAVEPOINT opened first (wallet.apply
+    # opens one for every debit) became the transaction and releasing it committed. Start
+    # the transaction first, so savepoints roll back with it as they do on Postgres.
+    @event.listens_for(engine, "savepoint")
+    def _begin_first(connection, name):
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN")
 
 __all__ = ["db", "Base"]
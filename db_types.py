@@ -0,0 +1,77 @@
+# db_types.py
+import pickle
+from typing import Iterable, List, Optional
+
+from sqlalchemy import LargeBinary, cast, func, literal
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.sql.expression import ColumnElement, FunctionElement
+from sqlalchemy.types import Boolean, TypeDecorator
+
+# -------------------- PACKED NUMBER SEQUENCE --------------------
+
+def pack_numbers(numbers: Iterable[int]) -> bytes:
+    return bytes(numbers)
+
+def unpack_numbers(value: Optional[bytes]) -> List[int]:
+    if not value:
+        return []
+    value = bytes(value)
+    # Rows written by the old PickleType column start with the pickle PROTO opcode (0x80),
+    # which can never be a bingo number; they stay readable until migrate_number_columns runs.
+    if value[0] == 0x80:
+        return list(pickle.loads(value) or [])
+    return list(value)
+
+class NumberSequence(TypeDecorator):
+    """
+    Ordered list of bingo numbers (1..75) stored one byte per number.
+    Order is kept so called_numbers still replays in call order.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return pack_numbers(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return unpack_numbers(value)
+
+# In-place .append() on the list marks the row dirty
+PackedNumbers = MutableList.as_mutable(NumberSequence)
+
+# -------------------- SQL HELPERS --------------------
+
+def append_number(column, number: int) -> ColumnElement:
+    """
+    SQL expression for `column || <number>`, so a call or mark is a one-byte append.
+    """
+    tail = literal(bytes([number]), LargeBinary)
+    return cast(func.coalesce(column, literal(b"", LargeBinary)).op("||")(tail), LargeBinary)
+
+class number_in(FunctionElement):
+    """
+    SQL expression that is true when `number` is in a packed column, e.g.
+    Game.query.filter(number_in(Game.called_numbers, 7)).
+    """
+
+    type = Boolean()
+    inherit_cache = True
+
+    def __init__(self, column, number: int):
+        super().__init__(column, literal(bytes([number]), LargeBinary))
+
+@compiles(number_in)
+def _number_in_default(element, compiler, **kw):
+    column, needle = list(element.clauses)
+    return f"(instr({compiler.process(column, **kw)}, {compiler.process(needle, **kw)}) > 0)"
+
+@compiles(number_in, "postgresql")
+def _number_in_postgresql(element, compiler, **kw):
+    column, needle = list(element.clauses)
+    return f"(position({compiler.process(needle, **kw)} in {compiler.process(column, **kw)}) > 0)"
@@ -0,0 +1,159 @@
+# game_clock.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+class _Room:
+    __slots__ = ("interval", "callback", "deadline", "paused_left", "token")
+
+    def __init__(self, interval: float, callback: Callable[[], Any]):
+        self.interval = interval
+        self.callback = callback
+        self.deadline = 0.0
+        self.paused_left: Optional[float] = None
+        self.token = 0
+
+class GameClock:
+    """
+    One thread drives the call cadence of every room.
+    Rooms sit in a heap keyed by their next deadline; stale heap entries are
+    skipped by comparing a per-room token, so pause/resume/cancel never search the heap.
+    Tokens come from one counter for the whole clock, so a room scheduled again after
+    cancel never matches an entry left over from before.
+    A callback's non-None return value is published to every subscriber.
+    """
+
+    def __init__(self):
+        self._rooms: Dict[int, _Room] = {}
+        self._heap: List[Tuple[float, int, int, int]] = []
+        self._seq = itertools.count()
+        self._tokens = itertools.count(1)
+        self._cond = threading.Condition()
+        self._subscribers: List[Callable[[int, Any], None]] = []
+        self._thread: Optional[threading.Thread] = None
+
+    # -------------------- ROOMS --------------------
+
+    def schedule(self, room_id: int, interval: float, callback: Callable[[], Any]):
+        with self._cond:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = _Room(interval, callback)
+            room.interval = interval
+            room.callback = callback
+            room.paused_left = None
+            self._push(room_id, room, time.monotonic() + interval)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def set_interval(self, room_id: int, interval: float):
+        with self._cond:
+            room = self._rooms.get(room_id)
+            if room:
+                room.interval = interval
+
+    def pause(self, room_id: int):
+        with self._cond:
+            room = self._rooms.get(room_id)
+            if room and room.paused_left is None:
+                room.paused_left = max(0.0, room.deadline - time.monotonic())
+                room.token = next(self._tokens)
+
+    def resume(self, room_id: int):
+        with self._cond:
+            room = self._rooms.get(room_id)
+            if room and room.paused_left is not None:
+                left, room.paused_left = room.paused_left, None
+                self._push(room_id, room, time.monotonic() + left)
+                self._cond.notify()
+
+    def cancel(self, room_id: int):
+        with self._cond:
+            room = self._rooms.pop(room_id, None)
+            if room:
+                room.token = next(self._tokens)
+
+    def is_scheduled(self, room_id: int) -> bool:
+        return room_id in self._rooms
+
+    def backlog(self) -> int:
+        return len(self._rooms)
+
+    def overdue(self) -> Tuple[int, float]:
+        """
+        How many rooms' calls are past due, and how late the latest one is in seconds.
+        """
+        now = time.monotonic()
+        with self._cond:
+            late = [now - r.deadline for r in self._rooms.values() if r.paused_left is None and r.deadline < now]
+        return len(late), max(late, default=0.0)
+
+    def next_deadline(self, room_id: int) -> Optional[float]:
+        room = self._rooms.get(room_id)
+        if room is None or room.paused_left is not None:
+            return None
+        return room.deadline
+
+    # -------------------- EVENTS --------------------
+
+    def subscribe(self, fn: Callable[[int, Any], None]):
+        self._subscribers.append(fn)
+
+    def unsubscribe(self, fn: Callable[[int, Any], None]):
+        if fn in self._subscribers:
+            self._subscribers.remove(fn)
+
+    def publish(self, room_id: int, event: Any):
+        for fn in list(self._subscribers):
+            try:
+                fn(room_id, event)
+            except Exception as e:
+                logging.error(f"Game clock subscriber failed for room {room_id}: {e}")
+
+    # -------------------- LOOP --------------------
+
+    def _push(self, room_id: int, room: _Room, deadline: float):
+        room.token = next(self._tokens)
+        room.deadline = deadline
+        heapq.heappush(self._heap, (deadline, next(self._seq), room_id, room.token))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="game-clock", daemon=True)
+            self._thread.start()
+
+    def _next_due(self) -> Tuple[int, _Room]:
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, room_id, token = self._heap[0]
+                room = self._rooms.get(room_id)
+                if room is None or room.token != token:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                # Reschedule before running so the cadence doesn't drift with callback time
+                self._push(room_id, room, max(deadline + room.interval, time.monotonic()))
+                return room_id, room
+
+    def _run(self):
+        while True:
+            room_id, room = self._next_due()
+            try:
+                event = room.callback()
+            except Exception as e:
+                logging.error(f"Game clock callback failed for room {room_id}: {e}")
+                continue
+            if event is not None:
+                self.publish(room_id, event)
+
+clock = GameClock()
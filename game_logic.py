@@ -1,17 +1,35 @@
 # game_logic.py
+import heapq
 import random
-import threading
 import logging
+import threading
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Optional, Sequence, Tuple, Any
+import cartela_catalog
+from cartela_allocator import CartelaAllocator
+from game_clock import clock
+from bingo_bits import BitBoardEngine, marked_numbers
 
 class BingoGame:
+    """
+    One room. Every change must happen while holding self.lock (room_manager does this
+    for request threads, auto_call takes it for the game clock); readers that only need
+    the room's state use self.snapshot, which is swapped whole after each change.
+    """
+
     def __init__(self, game_id: int, entry_price: int = 10):
+        self.lock = threading.RLock()
         self.game_id = game_id
         self.entry_price = entry_price
         self.pool = 0
         self.players: Dict[int, List[dict]] = {}
+        self.cartelas = CartelaAllocator()             # free / reserved / taken cartela numbers
+        self.board_count = 0
         self.called_numbers: List[int] = []
+        self.called_set = set()
+        self.engine = BitBoardEngine()
+        self.winner_ids: List[int] = []
+        self.store = None                            # GameStore that persists deltas, if any
         self.status = "waiting"
         self.winner_id = None
         self.created_at = datetime.utcnow()
@@ -21,49 +39,42 @@ class BingoGame:
         self.max_players = 100
         self.call_interval = 3.5
         self.last_call_time = None
-        self.auto_call_timer = None
 
         self.player_modes: Dict[int, str] = {}       # "auto" or "manual"
         self.sound_enabled: Dict[int, bool] = {}     # True or False
         self.leaderboard: Dict[int, Dict[str, int]] = {}
         self.admin_earnings = 0
+        self.payout = 0                              # per winner
+        self.snapshot: Dict[str, Any] = {}
+        self.refresh_snapshot()
 
     # -------------------- BOARD GENERATION --------------------
 
-    def generate_board(self, cartela_number: int) -> List[int]:
-        random.seed(cartela_number)
-        b = random.sample(range(1, 16), 5)
-        i = random.sample(range(16, 31), 5)
-        n = random.sample(range(31, 46), 5)
-        g = random.sample(range(46, 61), 5)
-        o = random.sample(range(61, 76), 5)
-        random.seed()
-
-        board = []
-        for row in range(5):
-            board.extend([b[row], i[row], n[row], g[row], o[row]])
-        return board
+    def generate_board(self, cartela_number: int) -> Sequence[int]:
+        return cartela_catalog.get_cartela(cartela_number)
 
     # -------------------- PLAYER MANAGEMENT --------------------
 
-    def add_player(self, user_id: int, cartela_number: Optional[int] = None, mode: str = "auto") -> List[int]:
-        if user_id not in self.players:
-            self.players[user_id] = []
-
-        if len(self.players[user_id]) >= 5:
+    def add_player(self, user_id: int, cartela_number: Optional[int] = None, mode: str = "auto") -> Sequence[int]:
+        if len(self.players.get(user_id, [])) >= 5:
             return []
 
-        used_cartelas = {b['cartela_number'] for boards in self.players.values() for b in boards}
-        available = [n for n in range(1, 101) if n not in used_cartelas]
-        cartela_number = cartela_number or (random.choice(available) if available else 0)
-
-        board = self.generate_board(cartela_number)
-        self.players[user_id].append({
-            'board': board,
-            'marked': [board[12]],  # Free space
-            'cartela_number': cartela_number
-        })
-
+        if cartela_number:
+            if not self.cartelas.available_to(cartela_number, user_id):
+                return []
+        else:
+            cartela_number = self.cartelas.random_free()
+            if cartela_number is None:
+                return []
+
+        # A player's boards in one room share a mode
+        mode = self.player_modes.get(user_id, mode)
+        # The store takes the stake and commits it with the join before the board enters the
+        # room; either raising leaves the room as it was, so nobody plays without paying
+        if self.store:
+            self.store.take_stake(self, user_id, cartela_number)
+            self.store.record_join(self, user_id, cartela_number, mode)
+        entry = self.attach_board(user_id, cartela_number)
         self.pool += self.entry_price
         self.player_modes[user_id] = mode
         self.sound_enabled[user_id] = True
@@ -71,16 +82,60 @@ class BingoGame:
         if self.status == "waiting" and self.total_players() >= self.min_players:
             self.start_game()
 
-        return board
+        return entry['board']
+
+    def attach_board(self, user_id: int, cartela_number: int) -> Dict[str, Any]:
+        self.cartelas.take(cartela_number)
+        board = self.generate_board(cartela_number)
+        cells = cartela_catalog.get_cells(cartela_number)
+        entry = {
+            'board': board,
+            'cells': cells,
+            'board_id': self.engine.add_board(user_id, board, cells),  # Free space pre-marked
+            'cartela_number': cartela_number
+        }
+        self.players.setdefault(user_id, []).append(entry)
+        self.board_count += 1
+        return entry
 
     def total_players(self) -> int:
-        return sum(len(boards) for boards in self.players.values())
+        return self.board_count
 
     def toggle_sound(self, user_id: int, enabled: bool):
         self.sound_enabled[user_id] = enabled
 
-    def toggle_mode(self, user_id: int, mode: str):
+    def toggle_mode(self, user_id: int, mode: str) -> List[int]:
+        """
+        Switches all of the player's boards in this room. Returns [user_id] when switching
+        to auto completed one of them, which ends the game right away, as auto_daub would
+        have on the call itself.
+        """
+        if user_id not in self.players:
+            return []
         self.player_modes[user_id] = mode
+        if mode == "auto":
+            # Catch up on numbers called while the player was daubing by hand
+            for board in self.players[user_id]:
+                for number in self.called_numbers:
+                    cell = board['cells'].get(number)
+                    if cell is not None:
+                        self.engine.mark(board['board_id'], cell)
+        if self.store:
+            # One write for the mode and every mark so far, whichever mode made them
+            self.store.record_mode(self, user_id, mode)
+        if mode != "auto":
+            return []
+        win, _, _ = self.check_winner_pattern(user_id)
+        if win and self.status == "active":
+            self.end_game(user_id)
+            return [user_id]
+        return []
+
+    def marked_numbers(self, board: Dict[str, Any]) -> List[int]:
+        # A board's daubed numbers in call order
+        mask = self.engine.masks[board['board_id']]
+        cells = board['cells']
+        return [n for n in self.called_numbers if n in cells and mask >> cells[n] & 1]
 
     # -------------------- GAME FLOW --------------------
 
@@ -88,106 +143,172 @@ class BingoGame:
         if self.status != "waiting":
             return False
         self.status = "active"
-        self.call_number()
+        result = self.call_number()
+        if result:
+            clock.publish(self.game_id, {"type": "call", "game_id": self.game_id, **result})
         self.schedule_next_call()
         return True
 
     def schedule_next_call(self):
         if self.status == "active" and "auto" in self.player_modes.values():
-            self.auto_call_timer = threading.Timer(self.call_interval, self.auto_call)
-            self.auto_call_timer.start()
-
-    def auto_call(self):
-        if self.status != "active":
-            return
-        self.call_number()
-        self.schedule_next_call()
+            clock.schedule(self.game_id, self.call_interval, self.auto_call)
+
+    def pause_calls(self):
+        clock.pause(self.game_id)
+
+    def resume_calls(self):
+        clock.resume(self.game_id)
+
+    def auto_call(self) -> Optional[Dict[str, Any]]:
+        if self.store:
+            # Pick up joins, marks and finishes made by other workers before calling
+            self.store.get(self.game_id)
+        with self.lock:
+            if self.status != "active":
+                clock.cancel(self.game_id)
+                return None
+            result = self.call_number()
+            if self.status != "active":
+                clock.cancel(self.game_id)
+            self.refresh_snapshot()
+        if result is None:
+            return None
+        return {"type": "call", "game_id": self.game_id, **result}
 
     def call_number(self) -> Optional[Dict[str, Optional[str]]]:
-        available = [n for n in range(1, 76) if n not in self.called_numbers]
+        available = [n for n in range(1, 76) if n not in self.called_set]
         if not available:
-            self.status = "finished"
-            self.finished_at = datetime.utcnow()
+            self.finish()
             return None
 
         number = random.choice(available)
         self.called_numbers.append(number)
+        self.called_set.add(number)
         self.last_call_time = datetime.utcnow()
+        if self.store:
+            self.store.record_call(self, number)
+        winners = self.auto_daub(number)
 
         return {
             "formatted": self.format_number(number),
-            "audio": self.audio_filename(number)
+            "audio": self.audio_filename(number),
+            "winners": winners
         }
 
     def manual_call(self, number: int) -> bool:
-        if number in self.called_numbers or not (1 <= number <= 75):
+        if number in self.called_set or not (1 <= number <= 75):
             return False
         self.called_numbers.append(number)
+        self.called_set.add(number)
         self.last_call_time = datetime.utcnow()
+        if self.store:
+            self.store.record_call(self, number)
+        self.auto_daub(number)
         return True
 
+    def replay_call(self, number: int):
+        """
+        Applies a call that was already made and persisted elsewhere (another
+        worker, or before a restart) without recording it or settling the game again.
+        """
+        if number in self.called_set:
+            return
+        self.called_numbers.append(number)
+        self.called_set.add(number)
+        for board_id, cell in self.engine.boards_with(number):
+            if self.player_modes.get(self.engine.owners[board_id]) == "auto":
+                self.engine.mark(board_id, cell)
+
+    def auto_daub(self, number: int) -> List[int]:
+        """
+        Marks a freshly called number on every auto-mode board that holds it and
+        ends the game if any of them completed a pattern. All boards are settled
+        on the same call, so simultaneous winners share the payout.
+        """
+        winners: List[int] = []
+        for board_id, cell in self.engine.boards_with(number):
+            owner = self.engine.owners[board_id]
+            if self.player_modes.get(owner) != "auto":
+                continue
+            if self.engine.mark(board_id, cell) and owner not in winners:
+                winners.append(owner)
+        if winners and self.status == "active":
+            self.end_game(winners[0], tied_with=winners[1:])
+        return winners
+
     # -------------------- MARKING & WINNING --------------------
 
     def mark_number(self, user_id: int, number: int) -> bool:
-        if user_id not in self.players:
+        if user_id not in self.players or number not in self.called_set:
             return False
         updated = False
         for board in self.players[user_id]:
-            if number in board['board'] and number in self.called_numbers:
-                if number not in board['marked']:
-                    board['marked'].append(number)
-                    board['marked'].sort()
-                    updated = True
+            cell = board['cells'].get(number)
+            if cell is not None and not self.engine.masks[board['board_id']] >> cell & 1:
+                self.engine.mark(board['board_id'], cell)
+                updated = True
+        if updated and self.store:
+            self.store.record_mark(self, user_id, number)
         return updated
 
     def check_winner(self, user_id: int) -> Tuple[bool, str]:
-        if user_id not in self.players:
-            return False, "Player not in game"
+        win, message, _ = self.check_winner_pattern(user_id)
+        return win, message
 
-        for board in self.players[user_id]:
-            marked = set(board['marked'])
-            b = board['board']
-
-            # Rows
-            for i in range(0, 25, 5):
-                if all(b[i + j] in marked for j in range(5)):
-                    return True, "Winner - Row complete!"
-
-            # Columns
-            for i in range(5):
-                if all(b[i + j*5] in marked for j in range(5)):
-                    return True, "Winner - Column complete!"
-
-            # Diagonals
-            if all(b[i] in marked for i in [0, 6, 12, 18, 24]):
-                return True, "Winner - Diagonal complete!"
-            if all(b[i] in marked for i in [4, 8, 12, 16, 20]):
-                return True, "Winner - Diagonal complete!"
-
-            # Corners
-            if all(b[i] in marked for i in [0, 4, 20, 24]):
-                return True, "Winner - Corner complete!"
+    def check_winner_pattern(self, user_id: int) -> Tuple[bool, str, Optional[str]]:
+        if user_id not in self.players:
+            return False, "Player not in game", None
+        return self.engine.result([b['board_id'] for b in self.players[user_id]])
 
-        return False, "Keep playing"
+    def finish(self) -> bool:
+        """
+        Ends an active game without a winner; settlement refunds every board's stake.
+        """
+        if self.status != "active":
+            return False
+        self.status = "finished"
+        self.finished_at = datetime.utcnow()
+        clock.cancel(self.game_id)
+        if self.store:
+            self.store.record_finish(self)
+        return True
 
-    def end_game(self, winner_id: int):
+    def end_game(self, winner_id: int, tied_with: Optional[List[int]] = None):
         self.winner_id = winner_id
+        self.winner_ids = [winner_id] + [uid for uid in (tied_with or []) if uid != winner_id]
         self.status = "finished"
         self.finished_at = datetime.utcnow()
-        if self.auto_call_timer:
-            self.auto_call_timer.cancel()
+        clock.cancel(self.game_id)
 
         commission = int(self.pool * 0.20)
-        payout = self.pool - commission
-        self.admin_earnings = commission
+        payout = (self.pool - commission) // len(self.winner_ids)
+        self.admin_earnings = self.pool - payout * len(self.winner_ids)
+        self.payout = payout
+
+        for uid in self.winner_ids:
+            if uid not in self.leaderboard:
+                self.leaderboard[uid] = {"wins": 0, "earnings": 0}
+            self.leaderboard[uid]["wins"] += 1
+            self.leaderboard[uid]["earnings"] += payout
 
-        if winner_id not in self.leaderboard:
-            self.leaderboard[winner_id] = {"wins": 0, "earnings": 0}
-        self.leaderboard[winner_id]["wins"] += 1
-        self.leaderboard[winner_id]["earnings"] += payout
+        if self.store:
+            self.store.record_finish(self)
 
     # -------------------- UTILITIES --------------------
 
+    def refresh_snapshot(self):
+        # Called with the lock held; readers never lock, they just take the current dict
+        self.snapshot = {
+            "game_id": self.game_id,
+            "status": self.status,
+            "entry_price": self.entry_price,
+            "pool": self.pool,
+            "players": self.board_count,
+            "called": list(self.called_numbers),
+            "winners": list(self.winner_ids),
+            "payout": self.payout,
+        }
+
     @staticmethod
     def format_number(number: int) -> str:
         if 1 <= number <= 15: return f"B-{number}"
@@ -201,18 +322,18 @@ class BingoGame:
         return f"{BingoGame.format_number(number)}.mp3"
 
     def get_leaderboard(self, top_n: int = 10) -> List[Tuple[int, int, int]]:
-        sorted_lb = sorted(
+        best = heapq.nlargest(
+            top_n,
             self.leaderboard.items(),
-            key=lambda item: (item[1]["earnings"], item[1]["wins"]),
-            reverse=True
+            key=lambda item: (item[1]["earnings"], item[1]["wins"])
         )
-        return [(uid, data["wins"], data["earnings"]) for uid, data in sorted_lb[:top_n]]
+        return [(uid, data["wins"], data["earnings"]) for uid, data in best]
 
     def get_player_summary(self, user_id: int) -> List[Dict[str, Any]]:
         return [
             {
                 "cartela_number": b["cartela_number"],
-                "marked": b["marked"],
+                "marked": marked_numbers(b["board"], self.engine.masks[b["board_id"]]),
                 "mode": self.player_modes.get(user_id, "auto"),
                 "sound": self.sound_enabled.get(user_id, True)
             }
@@ -222,7 +343,7 @@ class BingoGame:
     def get_called_history(self) -> List[str]:
         return [self.format_number(n) for n in self.called_numbers]
 
-    def get_winner_board(self) -> Optional[List[int]]:
+    def get_winner_board(self) -> Optional[Sequence[int]]:
         if self.winner_id and self.winner_id in self.players:
             return self.players[self.winner_id][0]["board"]
         return None
@@ -230,16 +351,18 @@ class BingoGame:
     def is_ready(self) -> bool:
         return self.status == "waiting" and self.total_players() >= self.min_players
 
-        def reset_game(self):
+    def reset_game(self):
         self.status = "waiting"
         self.called_numbers.clear()
+        self.called_set.clear()
+        self.engine.reset()
         self.winner_id = None
+        self.winner_ids = []
         self.finished_at = None
         self.last_call_time = None
         self.admin_earnings = 0
-        if self.auto_call_timer:
-            self.auto_call_timer.cancel()
-            self.auto_call_timer = None
+        self.payout = 0
+        clock.cancel(self.game_id)
         logging.info(f"🔄 Game {self.game_id} has been reset.")
 
     def summary(self) -> Dict[str, Any]:
@@ -250,6 +373,7 @@ class BingoGame:
             "pool": self.pool,
             "called": len(self.called_numbers),
             "winner": self.winner_id,
+            "winners": self.winner_ids,
             "created_at": self.created_at.isoformat(),
             "finished_at": self.finished_at.isoformat() if self.finished_at else None,
             "admin_earnings": self.admin_earnings
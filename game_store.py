@@ -0,0 +1,355 @@
+# game_store.py
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from flask import has_app_context
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from models import User, Game, GameParticipant
+from game_logic import BingoGame
+from db_types import append_number
+from config import ROOM_SHARDS, ROOM_SHARD
+import settlement
+import wallet
+
+LOCK_STRIPES = 64     # rooms are created under one of these, picked by game ID, never a global lock
+
+class JoinNotRecorded(RuntimeError):
+    """
+    The join (and the stake taken for it) could not be committed; the room is unchanged.
+    """
+
+# -------------------- IN-PROCESS --------------------
+
+class InMemoryGameStore:
+    """
+    Keeps rooms in a dict for the life of the process.
+    BingoGame calls the record_* hooks after each change; here they are no-ops.
+    With ROOM_SHARDS > 1 each process hands out only the IDs of its own shard.
+    """
+
+    def __init__(self):
+        self.games: Dict[int, BingoGame] = {}
+        self._ids = itertools.count(ROOM_SHARD + 1, ROOM_SHARDS)
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def _stripe(self, game_id: int) -> threading.Lock:
+        return self._stripes[game_id % LOCK_STRIPES]
+
+    def create(self, entry_price: int = 10) -> BingoGame:
+        game = BingoGame(game_id=next(self._ids), entry_price=entry_price)
+        return self._track(game)
+
+    def get(self, game_id: int) -> Optional[BingoGame]:
+        return self.games.get(game_id)
+
+    def peek(self, game_id: int) -> Optional[Dict[str, Any]]:
+        game = self.games.get(game_id)
+        return game.snapshot if game else None
+
+    def list_open(self) -> List[Dict[str, Any]]:
+        # Snapshots, so listing never waits on (or reads half of) a room being changed
+        snapshots = [g.snapshot for g in list(self.games.values())]
+        return [
+            {"id": s["game_id"], "status": s["status"], "players": s["players"], "entry_price": s["entry_price"]}
+            for s in snapshots if s["status"] in ("waiting", "active")
+        ]
+
+    def _track(self, game: BingoGame) -> BingoGame:
+        game.store = self
+        self.games[game.game_id] = game
+        return game
+
+    def take_stake(self, game: BingoGame, user_id: int, cartela_number: int):
+        pass
+
+    def record_join(self, game: BingoGame, user_id: int, cartela_number: int, mode: str = "auto"):
+        pass
+
+    def record_call(self, game: BingoGame, number: int):
+        pass
+
+    def record_mark(self, game: BingoGame, user_id: int, number: int):
+        pass
+
+    def record_mode(self, game: BingoGame, user_id: int, mode: str):
+        pass
+
+    def record_finish(self, game: BingoGame):
+        pass
+
+# -------------------- SQL --------------------
+
+class SqlGameStore(InMemoryGameStore):
+    """
+    Persists rooms in the game / game_participant tables.
+    Every change is written as a small UPDATE or INSERT for that one delta; calls and
+    marks are one-byte appends to the packed number columns. Auto-mode marks
+    are never stored: they are replayed from the called numbers when a room is loaded.
+    A cached room is re-synced whenever its row's updated_at moves, so any worker
+    (or a restarted one) sees the same pool, players and calls; the game clock goes
+    through get() before each automatic call for the same reason. Writes change the
+    row relative to what is there (pool increments, call appends), never from memory.
+    With ROOM_SHARDS > 1 new rooms take the next ID of this process's shard rather
+    than the database's next one.
+    """
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self._synced: Dict[int, datetime] = {}
+        self._id_lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if has_app_context():
+            return fn(*args)
+        with self.app.app_context():
+            return fn(*args)
+
+    def create(self, entry_price: int = 10) -> BingoGame:
+        return self._run(self._create, entry_price)
+
+    def _create(self, entry_price: int) -> BingoGame:
+        if ROOM_SHARDS == 1:
+            row = Game(status="waiting", entry_price=entry_price, pool=0, called_numbers=[])
+            db.session.add(row)
+            db.session.commit()
+        else:
+            row = self._create_in_shard(entry_price)
+        self._synced[row.id] = row.updated_at
+        return self._track(BingoGame(game_id=row.id, entry_price=entry_price))
+
+    def _create_in_shard(self, entry_price: int, attempts: int = 5) -> Game:
+        # The database's next ID may belong to another shard, and a room this process
+        # can't serve is no use to it: take the first ID of our shard above the highest one
+        with self._id_lock:
+            for _ in range(attempts):
+                top = db.session.execute(select(func.max(Game.id))).scalar() or 0
+                game_id = top + 1 + (ROOM_SHARD - top) % ROOM_SHARDS
+                row = Game(id=game_id, status="waiting", entry_price=entry_price, pool=0, called_numbers=[])
+                db.session.add(row)
+                try:
+                    db.session.commit()
+                    return row
+                except IntegrityError:
+                    # Another process was started with the same ROOM_SHARD
+                    db.session.rollback()
+            raise RuntimeError(f"Could not find a free game ID in shard {ROOM_SHARD}")
+
+    def get(self, game_id: int) -> Optional[BingoGame]:
+        return self._run(self._get, game_id)
+
+    def _get(self, game_id: int) -> Optional[BingoGame]:
+        game = self.games.get(game_id)
+        created = False
+        if game is None:
+            row = db.session.get(Game, game_id)
+            if not row:
+                return None
+            with self._stripe(game_id):
+                game = self.games.get(game_id)
+                if game is None:
+                    game = self._track(BingoGame(game_id=row.id, entry_price=int(row.entry_price)))
+                    created = True
+        with game.lock:
+            # Read the row under the room lock, so a slower thread can't sync an older row over newer changes
+            row = db.session.execute(
+                select(Game).where(Game.id == game_id).execution_options(populate_existing=True)
+            ).scalar_one()
+            if created or self._synced.get(game_id) != row.updated_at:
+                self._sync(game, row)
+                game.refresh_snapshot()
+            # Nobody has called a number for a while: this worker takes over the room's clock
+            if created and game.status == "active" and datetime.utcnow() - row.updated_at > timedelta(seconds=2 * game.call_interval):
+                game.schedule_next_call()
+        return game
+
+    def peek(self, game_id: int) -> Optional[Dict[str, Any]]:
+        return self._run(self._peek, game_id)
+
+    def _peek(self, game_id: int) -> Optional[Dict[str, Any]]:
+        # A room's snapshot read straight from its row, for processes that don't hold
+        # rooms (the stream tier): the room is never loaded, so its clock is never taken
+        players = (
+            select(func.count(GameParticipant.id))
+            .where(GameParticipant.game_id == Game.id)
+            .scalar_subquery()
+        )
+        row = db.session.execute(
+            select(Game.status, Game.entry_price, Game.pool, Game.payout, Game.called_numbers,
+                   Game.winner_id, players)
+            .where(Game.id == game_id)
+        ).first()
+        if row is None:
+            return None
+        status, entry_price, pool, payout, called, winner_id, count = row
+        return {
+            "game_id": game_id,
+            "status": status,
+            "entry_price": int(entry_price),
+            "pool": int(pool or 0),
+            "players": count,
+            "called": list(called or []),
+            "winners": [winner_id] if winner_id else [],
+            "payout": int(payout or 0),
+        }
+
+    def list_open(self) -> List[Dict[str, Any]]:
+        return self._run(self._list_open)
+
+    def _list_open(self) -> List[Dict[str, Any]]:
+        players = (
+            db.session.query(GameParticipant.game_id, func.count(GameParticipant.id).label("players"))
+            .group_by(GameParticipant.game_id)
+            .subquery()
+        )
+        rows = (
+            db.session.query(Game.id, Game.status, Game.entry_price, func.coalesce(players.c.players, 0))
+            .outerjoin(players, players.c.game_id == Game.id)
+            .filter(Game.status.in_(("waiting", "active")))
+            .order_by(Game.id.desc())
+            .limit(50)
+            .all()
+        )
+        return [
+            {"id": gid, "status": status, "players": count, "entry_price": entry_price}
+            for gid, status, entry_price, count in rows
+        ]
+
+    def _sync(self, game: BingoGame, row: Game):
+        game.status = row.status
+        game.pool = int(row.pool or 0)
+        game.winner_id = row.winner_id
+        game.created_at = row.created_at or game.created_at
+        game.finished_at = row.finished_at
+
+        known = {b['cartela_number'] for boards in game.players.values() for b in boards}
+        participants = (
+            db.session.query(GameParticipant)
+            .filter(GameParticipant.game_id == row.id)
+            .order_by(GameParticipant.id)
+            .all()
+        )
+        for participant in participants:
+            game.player_modes[participant.user_id] = participant.play_mode or "auto"
+            game.sound_enabled.setdefault(participant.user_id, True)
+            if participant.cartela_number not in known:
+                game.attach_board(participant.user_id, participant.cartela_number)
+
+        # Calls first so auto boards pick them up, then the hand-daubed marks
+        for number in row.called_numbers or []:
+            game.replay_call(number)
+        for participant in participants:
+            for board in game.players.get(participant.user_id, []):
+                if board['cartela_number'] != participant.cartela_number:
+                    continue
+                for number in participant.marked_numbers or []:
+                    cell = board['cells'].get(number)
+                    if cell is not None:
+                        game.engine.mark(board['board_id'], cell)
+        self._synced[row.id] = row.updated_at
+
+    # -------------------- DELTAS --------------------
+
+    def _touch(self, game: BingoGame, **values):
+        now = datetime.utcnow()
+        stmt = update(Game).where(Game.id == game.game_id).values(updated_at=now, **values)
+        synced = self._synced.get(game.game_id)
+        # Still in step with the row only if nobody else changed it since our last sync;
+        # otherwise _synced stays behind, so the next get() reads what the other worker wrote
+        if synced is not None and db.session.execute(stmt.where(Game.updated_at == synced)).rowcount:
+            self._synced[game.game_id] = now
+        else:
+            db.session.execute(stmt)
+        db.session.commit()
+
+    def _write(self, fn, *args):
+        try:
+            self._run(fn, *args)
+        except Exception as e:
+            logging.error(f"Failed to persist game state: {e}")
+            self._run(db.session.rollback)
+
+    def take_stake(self, game: BingoGame, user_id: int, cartela_number: int):
+        """
+        Debits the board's entry price; it is committed together with the join by
+        record_join. Raises wallet.InsufficientFunds when the balance doesn't cover it.
+        """
+        if not self._run(wallet.debit, db.session, user_id, game.entry_price, "stake",
+                         f"game:{game.game_id}:{cartela_number}"):
+            raise wallet.InsufficientFunds(f"Balance doesn't cover the {game.entry_price} birr entry")
+
+    def record_join(self, game: BingoGame, user_id: int, cartela_number: int, mode: str = "auto"):
+        # Unlike the other deltas a join must land before the room shows it: it commits the stake
+        try:
+            self._run(self._record_join, game, user_id, cartela_number, mode)
+        except Exception as e:
+            logging.error(f"Failed to record join to game {game.game_id}: {e}")
+            self._run(db.session.rollback)
+            raise JoinNotRecorded("Could not save the join, please try again") from e
+
+    def _record_join(self, game: BingoGame, user_id: int, cartela_number: int, mode: str):
+        db.session.add(GameParticipant(
+            game_id=game.game_id,
+            user_id=user_id,
+            cartela_number=cartela_number,
+            marked_numbers=[],
+            play_mode=mode
+        ))
+        # An increment, not game.pool: another worker may be adding its own joins
+        self._touch(game, pool=Game.pool + game.entry_price)
+
+    def record_call(self, game: BingoGame, number: int):
+        self._write(self._record_call, game, number)
+
+    def _record_call(self, game: BingoGame, number: int):
+        # Starts a waiting game, but never reopens one another worker has finished
+        self._touch(game, called_numbers=append_number(Game.called_numbers, number),
+                    status=case((Game.status == "waiting", "active"), else_=Game.status))
+
+    def record_mark(self, game: BingoGame, user_id: int, number: int):
+        self._write(self._record_mark, game, user_id, number)
+
+    def _record_mark(self, game: BingoGame, user_id: int, number: int):
+        for board in game.players.get(user_id, []):
+            if number not in board['cells']:
+                continue
+            db.session.execute(
+                update(GameParticipant)
+                .where(GameParticipant.game_id == game.game_id,
+                       GameParticipant.cartela_number == board['cartela_number'])
+                .values(marked_numbers=append_number(GameParticipant.marked_numbers, number))
+            )
+        self._touch(game)
+
+    def record_mode(self, game: BingoGame, user_id: int, mode: str):
+        self._write(self._record_mode, game, user_id, mode)
+
+    def _record_mode(self, game: BingoGame, user_id: int, mode: str):
+        # Marks made in auto mode are otherwise only replayed from the calls while the
+        # board stays in auto, so the switch saves them all with the mode
+        for board in game.players.get(user_id, []):
+            db.session.execute(
+                update(GameParticipant)
+                .where(GameParticipant.game_id == game.game_id,
+                       GameParticipant.cartela_number == board['cartela_number'])
+                .values(play_mode=mode, marked_numbers=game.marked_numbers(board))
+            )
+        # The player's choice is also the mode of their next join
+        db.session.execute(update(User).where(User.id == user_id).values(play_mode=mode))
+        self._touch(game)
+
+    def record_finish(self, game: BingoGame):
+        self._write(self._record_finish, game)
+
+    def _record_finish(self, game: BingoGame):
+        # Another worker may have settled the same call already
+        if not settlement.settle(db.session, game):
+            db.session.rollback()
+            return
+        self._touch(game)
@@ -0,0 +1,419 @@
+# leaderboards.py
+import bisect
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import delete, event, func, or_, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import LEADERBOARD_SIZE, LEADERBOARD_TTL, LEADERBOARD_REBUILD
+from models import User, Transaction, LeaderboardSnapshot
+
+# Global leaderboards kept as the top LEADERBOARD_SIZE rows of each board, so no read
+# sorts the user or transaction table. wallet.py and settlement.py mark the users whose
+# balance / games / jackpot total changed; once that transaction has committed, a
+# background thread reads their current values back (one query per board kind),
+# applies them and saves changed boards as versioned snapshots in a transaction of
+# its own, so money transactions never queue on the shared snapshot rows.
+# Reads are served from memory and re-check the snapshot version at most every
+# LEADERBOARD_TTL seconds, so every worker and the bot see the same boards.
+# rebuild() recomputes any board from the database.
+
+Rank = Tuple[Any, ...]                  # the board's sort key, then -user_id to break ties
+
+@dataclass(frozen=True)
+class Board:
+    name: str
+    fields: Tuple[str, ...]             # sort key, best first: user columns, or "jackpot"
+    source: str                         # "user": columns of user; "jackpot": summed jackpot_win transactions
+
+    def key(self, row: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(row[f] for f in self.fields)
+
+BOARDS: Dict[str, Board] = {
+    "wins": Board("wins", ("games_won", "balance"), "user"),
+    "played": Board("played", ("games_played",), "user"),
+    "balance": Board("balance", ("balance",), "user"),
+    "jackpot": Board("jackpot", ("jackpot",), "jackpot"),
+}
+
+# -------------------- TOP-N --------------------
+
+class TopN:
+    """
+    The best `capacity` users of one board, in rank order. `floor` is the rank of the
+    best user known to be left out (None when nobody is), so a changed user is kept
+    while they rank above it and anyone who climbs above it is taken in. A member that
+    falls below the floor is dropped, since someone outside may now beat them; when
+    fewer than the rows asked for remain, the board needs a rebuild. Users with
+    nothing above zero are left off.
+    """
+
+    def __init__(self, capacity: int = LEADERBOARD_SIZE):
+        self.capacity = capacity
+        self.floor: Optional[Rank] = None
+        self._ranks: List[Rank] = []                      # ascending
+        self._rows: Dict[int, Tuple[Rank, Dict[str, Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def complete(self) -> bool:
+        return self.floor is None
+
+    def _discard(self, user_id: int):
+        held = self._rows.pop(user_id, None)
+        if held:
+            del self._ranks[bisect.bisect_left(self._ranks, held[0])]
+
+    def update(self, user_id: int, key: Tuple[Any, ...], row: Dict[str, Any]) -> bool:
+        """
+        Applies a user's current values. Returns True if the board changed.
+        """
+        before = (self._rows.get(user_id), self.floor)
+        self._discard(user_id)
+        rank = tuple(key) + (-user_id,)
+        if any(k > 0 for k in key) and (self.floor is None or rank > self.floor):
+            self._rows[user_id] = (rank, row)
+            bisect.insort(self._ranks, rank)
+            while len(self._ranks) > self.capacity:
+                lowest = self._ranks.pop(0)
+                del self._rows[-lowest[-1]]
+                self.floor = lowest if self.floor is None else max(self.floor, lowest)
+        # A user who climbs above the floor but not into the board still raises the floor
+        return before != (self._rows.get(user_id), self.floor)
+
+    def copy(self) -> "TopN":
+        other = TopN(self.capacity)
+        other.floor = self.floor
+        other._ranks = list(self._ranks)
+        other._rows = dict(self._rows)
+        return other
+
+    def top(self, limit: int) -> List[Dict[str, Any]]:
+        return [self._rows[-rank[-1]][1] for rank in reversed(self._ranks[-limit:])]
+
+    def dump(self) -> str:
+        return json.dumps({
+            "floor": self.floor,
+            "rows": [self._rows[-rank[-1]][1] for rank in reversed(self._ranks)],
+        })
+
+    @classmethod
+    def load(cls, data: str, board: Board, capacity: int = LEADERBOARD_SIZE) -> "TopN":
+        saved = json.loads(data)
+        top = cls(capacity)
+        top.floor = tuple(saved["floor"]) if saved["floor"] is not None else None
+        for row in saved["rows"]:
+            top.update(row["user_id"], board.key(row), row)
+        return top
+
+# -------------------- DATABASE --------------------
+
+def _user_rows(session: Session, board: Board, user_ids: Optional[Iterable[int]] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    if board.source == "jackpot":
+        total = func.sum(Transaction.amount)
+        stmt = (
+            select(User.id, User.username, total.label("jackpot"))
+            .join(Transaction, Transaction.user_id == User.id)
+            .where(Transaction.type == "jackpot_win")
+            .group_by(User.id, User.username)
+            .order_by(total.desc(), User.id)
+        )
+    else:
+        stmt = select(User.id, User.username, User.games_won, User.games_played, User.balance)
+        if user_ids is None:
+            columns = [getattr(User, f) for f in board.fields]
+            stmt = stmt.where(or_(*(c > 0 for c in columns))).order_by(*(c.desc() for c in columns), User.id)
+    if user_ids is not None:
+        stmt = stmt.where(User.id.in_(list(user_ids)))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    rows = []
+    for r in session.execute(stmt):
+        row = {"user_id": r.id, "username": r.username}
+        if board.source == "jackpot":
+            row["jackpot"] = float(r.jackpot or 0)
+        else:
+            row.update(games_won=r.games_won or 0, games_played=r.games_played or 0, balance=float(r.balance or 0))
+        rows.append(row)
+    return rows
+
+def _save(session: Session, name: str, top: TopN, version: Optional[int]) -> Optional[int]:
+    """
+    Writes the snapshot if it is still at `version` (None: not saved yet). Returns the
+    new version, or None if another process got there first.
+    """
+    snapshots = LeaderboardSnapshot.__table__
+    if version is None:
+        savepoint = session.begin_nested()
+        try:
+            session.execute(snapshots.insert().values(name=name, version=1, data=top.dump()))
+            savepoint.commit()
+            return 1
+        except IntegrityError:
+            savepoint.rollback()
+            return None
+    written = session.execute(
+        update(snapshots)
+        .where(snapshots.c.name == name, snapshots.c.version == version)
+        .values(version=version + 1, data=top.dump())
+    ).rowcount
+    return version + 1 if written else None
+
+def _saved(session: Session, names: Sequence[str], with_data: bool = True) -> Dict[str, Tuple[int, Optional[str]]]:
+    snapshots = LeaderboardSnapshot.__table__
+    columns = (snapshots.c.name, snapshots.c.version) + ((snapshots.c.data,) if with_data else ())
+    return {
+        r.name: (r.version, r.data if with_data else None)
+        for r in session.execute(select(*columns).where(snapshots.c.name.in_(list(names))))
+    }
+
+def rebuild(session: Session, names: Optional[Sequence[str]] = None) -> Dict[str, int]:
+    """
+    Recomputes boards from user / transaction (all of them by default) and saves them.
+    Returns how many rows each board now holds. The caller commits.
+    """
+    counts = {}
+    saved = _saved(session, names or list(BOARDS), with_data=False)
+    for name in names or list(BOARDS):
+        board = BOARDS[name]
+        rows = _user_rows(session, board, limit=LEADERBOARD_SIZE + 1)
+        top = TopN()
+        for row in rows:
+            top.update(row["user_id"], board.key(row), row)
+        version = saved.get(name, (None, None))[0]
+        new_version = _save(session, name, top, version)
+        if new_version is None:
+            # Saved by someone else meanwhile; a fresh rebuild is at least as current
+            version = _saved(session, [name], with_data=False)[name][0]
+            new_version = _save(session, name, top, version)
+        _cache.pending(session)[name] = (top, new_version) if new_version else None
+        counts[name] = len(top)
+    return counts
+
+# -------------------- CACHE --------------------
+
+class _Cache:
+    """
+    Each process's boards, keyed by database URL and board name: (TopN, version, checked_at).
+    Boards built inside a transaction wait in session.info until it commits.
+    """
+
+    def __init__(self):
+        self.boards: Dict[Tuple[str, str], Tuple[TopN, int, float]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def db_key(session: Session) -> str:
+        return str(session.get_bind().url)
+
+    def get(self, session: Session, name: str) -> Optional[Tuple[TopN, int, float]]:
+        return self.boards.get((self.db_key(session), name))
+
+    def put(self, session: Session, name: str, top: TopN, version: int):
+        with self.lock:
+            self.boards[(self.db_key(session), name)] = (top, version, time.monotonic())
+
+    def drop(self, session: Session, name: str):
+        with self.lock:
+            self.boards.pop((self.db_key(session), name), None)
+
+    @staticmethod
+    def pending(session: Session) -> Dict[str, Optional[Tuple[TopN, int]]]:
+        return session.info.setdefault("leaderboards_pending", {})
+
+_cache = _Cache()
+
+# -------------------- CHANGES --------------------
+
+def touch(session: Session, user_ids: Iterable[int], names: Sequence[str] = ("wins", "balance")):
+    """
+    Marks users whose standing on `names` may have changed; their boards are updated
+    shortly after the session commits. Called by wallet.py and settlement.py.
+    """
+    dirty: Dict[str, Set[int]] = session.info.setdefault("leaderboards_dirty", {})
+    for name in names:
+        dirty.setdefault(name, set()).update(user_ids)
+
+def _load(session: Session, name: str, version: int) -> TopN:
+    cached = _cache.get(session, name)
+    if cached and cached[1] == version:
+        return cached[0]
+    return TopN.load(_saved(session, [name])[name][1], BOARDS[name])
+
+def _apply(session: Session, dirty: Dict[str, Set[int]], attempts: int = 3):
+    versions = {name: v for name, (v, _) in _saved(session, list(dirty), with_data=False).items()}
+    dirty = {name: ids for name, ids in dirty.items() if name in versions}   # never built: the first read builds it
+    fetched: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for source in {BOARDS[name].source for name in dirty}:
+        wanted = set().union(*(ids for name, ids in dirty.items() if BOARDS[name].source == source))
+        board = next(b for b in BOARDS.values() if b.source == source)
+        fetched[source] = {r["user_id"]: r for r in _user_rows(session, board, wanted)}
+
+    for name, user_ids in dirty.items():
+        board = BOARDS[name]
+        rows = fetched[board.source]
+        version = versions[name]
+        for _ in range(attempts):
+            top = _load(session, name, version).copy()   # swapped in only after commit
+            changed = False
+            for user_id in user_ids:
+                row = rows.get(user_id) or {"user_id": user_id, "username": None, **{f: 0 for f in board.fields}}
+                changed = top.update(user_id, board.key(row), row) or changed
+            if not changed:
+                break
+            # Values are read, not added, so redoing this on a newer snapshot is safe
+            new_version = _save(session, name, top, version)
+            if new_version is not None:
+                _cache.pending(session)[name] = (top, new_version)
+                break
+            version = _saved(session, [name], with_data=False)[name][0]
+        else:
+            raise RuntimeError(f"leaderboard {name} kept changing under us")
+
+class _Applier:
+    """
+    Background thread that folds committed changes into the boards in transactions of
+    its own, so a money transaction never reads or writes the snapshot rows. Changes
+    committed while a pass runs are merged into the next one. When idle it rebuilds
+    every board each LEADERBOARD_REBUILD seconds, which also repairs changes lost to a
+    process exit between a commit and its pass.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Engine, Dict[str, Set[int]]] = {}
+        self._engines: Set[Engine] = set()
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, engine: Engine, dirty: Dict[str, Set[int]]):
+        with self._cond:
+            merged = self._pending.setdefault(engine, {})
+            for name, user_ids in dirty.items():
+                merged.setdefault(name, set()).update(user_ids)
+            self._engines.add(engine)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="leaderboards", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every change submitted so far is on the boards. False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def _run(self):
+        rebuilt_at = time.monotonic()
+        while True:
+            with self._cond:
+                due = rebuilt_at + LEADERBOARD_REBUILD - time.monotonic() if LEADERBOARD_REBUILD else None
+                if not self._pending and (due is None or due > 0):
+                    self._cond.wait(due)
+                if self._pending:
+                    engine, dirty = self._pending.popitem()
+                    work = lambda session: _apply(session, dirty)
+                else:
+                    engine, dirty = None, None
+                self._busy = True
+            try:
+                if engine is not None:
+                    self._pass(engine, work, dirty)
+                elif LEADERBOARD_REBUILD and time.monotonic() - rebuilt_at >= LEADERBOARD_REBUILD:
+                    rebuilt_at = time.monotonic()
+                    for engine in list(self._engines):
+                        self._pass(engine, rebuild, BOARDS)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _pass(engine: Engine, work, names: Iterable[str]):
+        with Session(engine) as session:
+            try:
+                work(session)
+                session.commit()
+                return
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Leaderboard update failed, boards will be rebuilt: {e}")
+            try:
+                # Without the snapshot, the next read rebuilds the board from the database
+                session.execute(delete(LeaderboardSnapshot).where(LeaderboardSnapshot.name.in_(list(names))))
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logging.error(f"Could not discard leaderboard snapshots: {e}")
+            for name in names:
+                _cache.drop(session, name)
+
+_applier = _Applier()
+
+def flush(timeout: Optional[float] = None) -> bool:
+    """
+    Waits for the background pass to put every committed change on the boards.
+    """
+    return _applier.flush(timeout)
+
+@event.listens_for(Session, "after_commit")
+def _install(session: Session):
+    if session.in_nested_transaction():
+        return                          # a savepoint; the boards wait for the real commit
+    pending = session.info.pop("leaderboards_pending", None)
+    for name, built in (pending or {}).items():
+        if built is None:
+            _cache.drop(session, name)
+        else:
+            _cache.put(session, name, *built)
+    dirty = session.info.pop("leaderboards_dirty", None)
+    if dirty:
+        _applier.submit(session.get_bind(), dirty)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget(session: Session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop("leaderboards_dirty", None)
+        session.info.pop("leaderboards_pending", None)
+
+# -------------------- READS --------------------
+
+def top(session: Session, name: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    The best `limit` rows of a board, as dicts with user_id, username and the board's
+    values. Served from memory; at most every LEADERBOARD_TTL seconds the snapshot
+    version is checked, and a board that was never built (or ran short) is rebuilt,
+    in which case the caller should commit.
+    """
+    limit = min(limit, LEADERBOARD_SIZE)
+    cached = _cache.get(session, name)
+    if cached and time.monotonic() - cached[2] < LEADERBOARD_TTL:
+        board = cached[0]
+        if len(board) >= limit or board.complete:
+            return board.top(limit)
+
+    saved = _saved(session, [name], with_data=False).get(name)
+    board = _load(session, name, saved[0]) if saved else None
+    if board is not None and (len(board) >= limit or board.complete):
+        _cache.put(session, name, board, saved[0])
+        return board.top(limit)
+
+    rebuild(session, [name])
+    built = _cache.pending(session).get(name)
+    if built:
+        return built[0].top(limit)
+    # Someone else saved it while we were building; theirs is as good
+    saved = _saved(session, [name])[name]
+    return TopN.load(saved[1], BOARDS[name]).top(limit)
@@ -0,0 +1,235 @@
+# live_hub.py
+import json
+import logging
+import select
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import text
+
+IDLE_SECONDS = 3600     # a channel nobody published to or waited on for this long is dropped
+NOTIFY_CHANNEL = "live_hub"
+NOTIFY_LIMIT = 7900     # Postgres refuses NOTIFY payloads of 8000 bytes or more
+
+class Channel:
+    """
+    Sequence-numbered ring buffer of already-serialized events for one game (or the lobby).
+    Every event is encoded once on publish; subscribers and long-pollers only copy strings.
+    """
+
+    def __init__(self, maxlen: int = 256):
+        self.events: deque = deque(maxlen=maxlen)    # (seq, json, sse frame)
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.touched = time.monotonic()
+        self.closed = False
+
+    def publish(self, event: Dict[str, Any]) -> int:
+        with self.cond:
+            self.touched = time.monotonic()
+            self.seq += 1
+            payload = json.dumps({"seq": self.seq, **event}, default=str)
+            frame = f"id: {self.seq}\nevent: {event.get('type', 'message')}\ndata: {payload}\n\n"
+            self.events.append((self.seq, payload, frame))
+            self.cond.notify_all()
+            return self.seq
+
+    def since(self, seq: int) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        """
+        Events after `seq`. [(seq, None, None)] means the client must resync: it is ahead
+        of this channel (a restart, or another worker's channel) or fell out of the buffer.
+        """
+        if seq > self.seq or (self.events and seq < self.events[0][0] - 1):
+            return [(self.seq, None, None)]
+        if seq == self.seq:
+            return []
+        return list(self.events)[seq - self.events[0][0] + 1:]
+
+    def wait(self, seq: int, timeout: float) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        with self.cond:
+            self.touched = time.monotonic()
+            if seq == self.seq and not self.closed:
+                self.cond.wait(timeout)
+            return self.since(seq)
+
+    def close(self):
+        # Streams end once they have sent what was published before this
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class LiveHub:
+    """
+    Channels by game id (and "lobby"). `snapshot(key)` gives the full state sent with a
+    resync, so a client that can't be caught up from the buffer is not left guessing.
+    With a `bus`, publish and discard go out to every process (this one included) and
+    come back through deliver / drop, so a stream served anywhere sees every room.
+    """
+
+    def __init__(self, snapshot: Optional[Callable[[Hashable], Any]] = None):
+        self.channels: Dict[Hashable, Channel] = {}
+        self.snapshot = snapshot
+        self.bus: Optional["PgBus"] = None
+        self._lock = threading.Lock()
+
+    def channel(self, key: Hashable) -> Channel:
+        channel = self.channels.get(key)
+        if channel is None:
+            with self._lock:
+                self._prune()
+                channel = self.channels.setdefault(key, Channel())
+        return channel
+
+    def _prune(self):
+        # Rooms that finished without a winner (or in another worker) are never discarded
+        cutoff = time.monotonic() - IDLE_SECONDS
+        for key in [k for k, c in self.channels.items() if c.touched < cutoff]:
+            self.channels.pop(key).close()
+
+    def publish(self, key: Hashable, event: Dict[str, Any]):
+        if self.bus is None or not self.bus.send({"k": key, "e": event}):
+            self.deliver(key, event)
+
+    def deliver(self, key: Hashable, event: Dict[str, Any]) -> int:
+        return self.channel(key).publish(event)
+
+    def discard(self, key: Hashable):
+        if self.bus is None or not self.bus.send({"k": key, "discard": True}):
+            self.drop(key)
+
+    def drop(self, key: Hashable):
+        with self._lock:
+            channel = self.channels.pop(key, None)
+        if channel is not None:
+            channel.close()
+
+    def reset(self):
+        # Events may have been missed: end every stream, so clients reconnect and resync
+        with self._lock:
+            channels, self.channels = list(self.channels.values()), {}
+        for channel in channels:
+            channel.close()
+
+    def _resolve(self, key: Hashable, events: List[Tuple[int, Optional[str], Optional[str]]]) -> List[Tuple[int, str, str]]:
+        # Built here rather than in Channel.since: the snapshot may take the room's lock,
+        # which publishers hold while they take the channel's
+        if not events or events[0][1] is not None:
+            return events
+        seq = events[0][0]
+        state = self.snapshot(key) if self.snapshot else None
+        payload = json.dumps({"seq": seq, "type": "resync", "state": state}, default=str)
+        return [(seq, payload, f"id: {seq}\nevent: resync\ndata: {payload}\n\n")]
+
+    def poll(self, key: Hashable, since: int, timeout: float = 25.0) -> Tuple[int, str]:
+        """
+        Long-poll fallback: blocks until there is something newer than `since`.
+        Returns the last sequence number and a JSON array of the events.
+        """
+        channel = self.channel(key)
+        events = self._resolve(key, channel.wait(since, timeout))
+        last = events[-1][0] if events else max(since, 0)
+        return last, "[" + ",".join(payload for _, payload, _ in events) + "]"
+
+    def stream(self, key: Hashable, since: int = 0, heartbeat: float = 15.0) -> Iterator[str]:
+        channel = self.channel(key)
+        if since <= 0:
+            since = channel.seq
+        yield "retry: 3000\n\n"
+        while True:
+            events = self._resolve(key, channel.wait(since, heartbeat))
+            for seq, _, frame in events:
+                since = seq
+                yield frame
+            if channel.closed and since >= channel.seq:
+                return
+            if not events:
+                yield ": ping\n\n"
+
+class PgBus:
+    """
+    Carries a hub's events between processes over Postgres LISTEN/NOTIFY. send() issues
+    a NOTIFY; one listener thread per process hands every notification to the hub, in the
+    order Postgres delivers them, which is the same in every process. A notification too
+    big for NOTIFY, or one that can't be sent, is delivered in this process only.
+    """
+
+    def __init__(self, engine, hub: LiveHub, ping: float = 30.0):
+        self.engine = engine
+        self.hub = hub
+        self.ping = ping
+        self.listening = False
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name="live-hub-bus", daemon=True)
+                self._thread.start()
+
+    def send(self, message: Dict[str, Any]) -> bool:
+        """
+        True if the message will come back through this process's listener.
+        """
+        payload = json.dumps(message, default=str)
+        if len(payload.encode()) > NOTIFY_LIMIT:
+            logging.warning(f"Live event for {message['k']} is {len(payload)} bytes, too big to share; delivered here only")
+            return False
+        try:
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                             {"channel": NOTIFY_CHANNEL, "payload": payload})
+        except Exception as e:
+            logging.error(f"Could not share live event for {message['k']}: {e}")
+            return False
+        # Sent before our LISTEN was in place: it won't come back here
+        return self.listening
+
+    def _listen(self):
+        lost = False
+        while True:
+            raw = None
+            try:
+                conn = self.engine.raw_connection()
+                conn.detach()           # kept for good, and never handed back in LISTEN state
+                raw = conn.dbapi_connection
+                raw.autocommit = True
+                with raw.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                self.listening = True
+                if lost:
+                    self.hub.reset()
+                self._receive(raw)
+            except Exception as e:
+                logging.error(f"Live event listener lost its connection: {e}")
+            self.listening = False
+            lost = True
+            if raw is not None:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+            time.sleep(1)
+
+    def _receive(self, raw):
+        while True:
+            if not select.select([raw], [], [], self.ping)[0]:
+                with raw.cursor() as cursor:    # idle: make sure the connection is still there
+                    cursor.execute("SELECT 1")
+            raw.poll()
+            while raw.notifies:
+                self._dispatch(raw.notifies.pop(0).payload)
+
+    def _dispatch(self, payload: str):
+        try:
+            message = json.loads(payload)
+            if message.get("discard"):
+                self.hub.drop(message["k"])
+            else:
+                self.hub.deliver(message["k"], message["e"])
+        except Exception as e:
+            logging.error(f"Bad live event on {NOTIFY_CHANNEL}: {e}")
+
+hub = LiveHub()
@@ -1,7 +1,5 @@
 import os
 import asyncio
-from app import app
-from bot import main as bot_main
 from multiprocessing import Process
 import signal
 import sys
@@ -10,14 +8,20 @@ def signal_handler(sig, frame):
     print('Shutting down gracefully...')
     sys.exit(0)
 
-def run_flask():
+def run_migrations():
+    # Once per start, before any worker forks; workers themselves never touch the schema
+    from app_factory import create_app
+    import migrations
+    with create_app({"START_WORKERS": False}).app_context():
+        migrations.migrate()
+
+def serve(options, config=None):
     # Use gunicorn configuration
     from gunicorn.app.base import BaseApplication
 
     class FlaskApplication(BaseApplication):
-        def __init__(self, app, options=None):
+        def __init__(self, options=None):
             self.options = options or {}
-            self.application = app
             super().__init__()
 
         def load_config(self):
@@ -25,16 +29,59 @@ def run_flask():
                 self.cfg.set(key.lower(), value)
 
         def load(self):
-            return self.application
+            # Called in each worker, so background workers start after the fork
+            from app_factory import create_app
+            return create_app(config)
+
+    FlaskApplication(options).run()
 
-    options = {
+def check_workers():
+    # A room lives in the one process that owns it (its clock, its lock, its live channel),
+    # so the game API runs in one worker. Scale out by shard instead: one main.py per
+    # ROOM_SHARD, and STREAM_PORT for the live streams.
+    workers = int(os.getenv('WEB_CONCURRENCY', 1))
+    if workers > 1:
+        sys.exit(f"WEB_CONCURRENCY={workers} is not supported: run one process per shard "
+                 f"(ROOM_SHARDS=N ROOM_SHARD=k) and serve streams with STREAM_PORT")
+
+def run_flask():
+    # /events long-polls for up to 25s and, without a stream tier, game and lobby streams
+    # hold a thread each for as long as the page is open, so requests get a thread pool
+    serve({
         'bind': '0.0.0.0:5000',
         'workers': 1,
-        'reload': True
-    }
-    FlaskApplication(app, options).run()
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('WEB_THREADS', 32)),
+    })
+
+def _green_psycopg(server, worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+def run_streams(port):
+    # Streams and long polls only wait, so they are served by gevent workers: a held
+    # connection costs a greenlet, not a thread. These workers own no rooms; they read
+    # snapshots from the database and get every room's events over LISTEN/NOTIFY.
+    serve({
+        'bind': f'0.0.0.0:{port}',
+        'workers': int(os.getenv('STREAM_WORKERS', 1)),
+        'worker_class': 'gevent',
+        'worker_connections': int(os.getenv('STREAM_CONNECTIONS', 1000)),
+        'post_fork': _green_psycopg,
+    }, {"START_WORKERS": False, "LIVE_BUS": True, "OWN_ROOMS": False})
+
+def stream_port():
+    port = os.getenv('STREAM_PORT')
+    if not port:
+        return None
+    from sqlalchemy.engine import make_url
+    if make_url(os.getenv('DATABASE_URL', 'sqlite://')).get_backend_name() != 'postgresql':
+        print("STREAM_PORT needs a Postgres DATABASE_URL (events are shared with LISTEN/NOTIFY); streams stay on the web workers")
+        return None
+    return int(port)
 
 def run_bot():
+    from bot import main as bot_main
     asyncio.run(bot_main())
 
 if __name__ == "__main__":
@@ -42,10 +89,18 @@ if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    check_workers()
+    run_migrations()
+
     # Start Flask in a separate process
     flask_process = Process(target=run_flask)
     flask_process.start()
 
+    port = stream_port()
+    stream_process = Process(target=run_streams, args=(port,)) if port else None
+    if stream_process:
+        stream_process.start()
+
     try:
         # Run the bot in the main process
         run_bot()
@@ -55,7 +110,8 @@ if __name__ == "__main__":
         print(f"Error: {e}")
     finally:
         # Cleanup
-        if flask_process.is_alive():
-            flask_process.terminate()
-            flask_process.join()
+        for process in (flask_process, stream_process):
+            if process and process.is_alive():
+                process.terminate()
+                process.join()
         sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,386 @@
+# metrics.py
+import bisect
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from config import PROFILER, PROFILER_INTERVAL
+
+# In-process instrumentation, served as Prometheus text at /metrics (and, for a bot
+# running in polling mode, on METRICS_PORT). Request and handler timings, SQL per
+# request and room gauges are kept here; nothing is pushed anywhere. Each process
+# (each gunicorn worker) has its own numbers, so scrape every worker or sum them.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+LabelValues = Tuple[str, ...]
+
+class Family(NamedTuple):
+    """
+    One metric as a collector reports it: samples are (labels, value).
+    """
+    name: str
+    kind: str                                      # "gauge" or "counter"
+    help: str
+    samples: List[Tuple[Dict[str, Any], float]]
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+# -------------------- METRICS --------------------
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._lines())
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _lines(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in sorted(self._values.items())]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[LabelValues, List[float]] = {}   # per-bucket counts, then +Inf, sum
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[bisect.bisect_left(self.buckets, value)] += 1
+            row[-1] += value
+
+    def count(self, **labels) -> int:
+        row = self._values.get(self._key(labels))
+        return sum(row[:-1]) if row else 0
+
+    def _lines(self) -> List[str]:
+        lines = []
+        for key, row in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(row[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Registry:
+    """
+    Metrics updated as things happen, plus collectors asked for gauges at scrape time.
+    Collectors are kept by name, so registering again (a second app in the same
+    process) replaces the old one.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[Family]]] = {}
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def collector(self, name: str, fn: Callable[[], Iterable[Family]]):
+        self._collectors[name] = fn
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for name, fn in list(self._collectors.items()):
+            try:
+                families = list(fn())
+            except Exception as e:
+                logging.error(f"Metrics collector {name} failed: {e}")
+                continue
+            for family in families:
+                lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+                for labels, value in family.samples:
+                    lines.append(f"{family.name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "Time to answer a request.",
+                                  ("route", "method", "status"))
+HTTP_SQL_QUERIES = REGISTRY.histogram("http_request_sql_queries", "SQL statements run while answering a request.",
+                                      ("route",), QUERY_BUCKETS)
+HTTP_SQL_SECONDS = REGISTRY.histogram("http_request_sql_seconds", "Time spent in SQL while answering a request.",
+                                      ("route",))
+SQL_QUERIES = REGISTRY.counter("sql_queries_total", "SQL statements run, in requests or in the background.",
+                               ("source",))
+SQL_SECONDS = REGISTRY.counter("sql_query_seconds_total", "Time spent in SQL, in requests or in the background.",
+                               ("source",))
+BOT_LATENCY = REGISTRY.histogram("bot_handler_duration_seconds", "Time a Telegram handler took.", ("handler",))
+BOT_ERRORS = REGISTRY.counter("bot_handler_errors_total", "Telegram handlers that raised.", ("handler",))
+
+# -------------------- SQL --------------------
+
+_request = threading.local()       # [queries, seconds] while a request is being answered on this thread
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_started"] = time.perf_counter()
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop("metrics_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    totals = getattr(_request, "sql", None)
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += elapsed
+    source = "request" if totals is not None else "background"
+    SQL_QUERIES.inc(source=source)
+    SQL_SECONDS.inc(elapsed, source=source)
+
+def instrument_sql():
+    """
+    Times every statement on every engine (the app's and bot_db's). Safe to call again.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor):
+        event.listen(Engine, "before_cursor_execute", _before_cursor)
+        event.listen(Engine, "after_cursor_execute", _after_cursor)
+
+# -------------------- FLASK --------------------
+
+def init_app(app):
+    """
+    Times every request by route template (so /game/7/join and /game/8/join are one
+    series) along with its SQL. Streamed responses (the SSE routes) are left out,
+    since their duration is how long the client stayed connected.
+    """
+    from flask import g, request
+
+    instrument_sql()
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        _request.sql = [0, 0.0]
+
+    @app.after_request
+    def _note_status(response):
+        g.metrics_status = response.status_code
+        g.metrics_streamed = response.is_streamed and response.mimetype == "text/event-stream"
+        return response
+
+    @app.teardown_request
+    def _record(exc):
+        started = g.pop("metrics_started", None)
+        totals, _request.sql = getattr(_request, "sql", None), None
+        if started is None or g.pop("metrics_streamed", False):
+            return
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        status = g.pop("metrics_status", 500)
+        HTTP_LATENCY.observe(time.perf_counter() - started, route=route, method=request.method, status=status)
+        if totals is not None:
+            HTTP_SQL_QUERIES.observe(totals[0], route=route)
+            HTTP_SQL_SECONDS.observe(totals[1], route=route)
+
+    if PROFILER:
+        profiler.start(PROFILER_INTERVAL)
+
+# -------------------- TELEGRAM --------------------
+
+def instrument_handlers(application):
+    """
+    Wraps every handler callback of a telegram Application so its time and
+    failures are recorded under the callback's name.
+    """
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not getattr(handler.callback, "metrics_wrapped", False):
+                handler.callback = _timed_handler(handler.callback)
+
+def _timed_handler(callback):
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def timed(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            BOT_ERRORS.inc(handler=name)
+            raise
+        finally:
+            BOT_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+    timed.metrics_wrapped = True
+    return timed
+
+# -------------------- SAMPLING PROFILER --------------------
+
+class SamplingProfiler:
+    """
+    Off unless started. While running, a thread looks at every other thread's stack
+    every `interval` seconds and counts the stacks it sees, so the cost is a fixed
+    number of samples per second however busy the process is.
+    collapsed() is in the "a;b;c count" format flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, max_stacks: int = 5000, max_depth: int = 64):
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.interval = 0.01
+        self.samples = 0
+        self._stacks: Tally = Tally()
+        self._leaves: Tally = Tally()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01):
+        with self._lock:
+            self.interval = max(interval, 0.001)
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        logging.info(f"🔬 Sampling profiler on, every {self.interval * 1000:.0f} ms")
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join()
+            logging.info("🔬 Sampling profiler off")
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._leaves.clear()
+            self.samples = 0
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    key = ";".join(reversed(stack))
+                    if key in self._stacks or len(self._stacks) < self.max_stacks:
+                        self._stacks[key] += 1
+                    self._leaves[stack[0]] += 1
+                    self.samples += 1
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def top(self, n: int = 20) -> List[Tuple[str, int]]:
+        with self._lock:
+            return self._leaves.most_common(n)
+
+profiler = SamplingProfiler()
+
+def _profiler_families() -> List[Family]:
+    return [
+        Family("profiler_running", "gauge", "1 while the sampling profiler is on.",
+               [({}, 1 if profiler.running else 0)]),
+        Family("profiler_samples_total", "counter", "Thread stacks sampled, by innermost function (top 20).",
+               [({"function": fn}, count) for fn, count in profiler.top(20)]),
+    ]
+
+REGISTRY.collector("profiler", _profiler_families)
+
+# -------------------- STANDALONE --------------------
+
+def serve(port: int, host: str = "0.0.0.0"):
+    """
+    Serves /metrics from a background thread, for processes without a web app
+    (bot.py in polling mode, on METRICS_PORT).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"📈 Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,158 @@
+# migrations.py
+import logging
+
+from sqlalchemy import LargeBinary, column, inspect, select, table, text, update
+
+from database import db
+from db_types import pack_numbers, unpack_numbers
+
+# The only place the schema changes. Run once per deploy, before the web workers and
+# the bot start:  python migrations.py  (or  flask --app app_factory migrate).
+
+# -------------------- TABLES --------------------
+
+def create_tables():
+    """
+    Creates tables declared in models.py that the database does not have yet.
+    Existing tables are left as they are; the functions below add new columns.
+    """
+    import models  # noqa: F401  (registers every table on db.metadata)
+    db.create_all()
+
+# -------------------- PICKLE -> PACKED NUMBERS --------------------
+
+# Raw views of the columns, so values are read and written as plain bytes
+_PACKED_COLUMNS = [
+    table("game", column("id"), column("called_numbers", LargeBinary)),
+    table("game_participant", column("id"), column("marked_numbers", LargeBinary)),
+]
+
+def migrate_number_columns(batch_size: int = 500) -> int:
+    """
+    Rewrites called_numbers / marked_numbers rows still holding pickled lists
+    into the packed one-byte-per-number form. Safe to run more than once.
+    """
+    converted = 0
+    for t in _PACKED_COLUMNS:
+        id_col, data_col = list(t.columns)
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(id_col, data_col).where(id_col > last_id).order_by(id_col).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row_id, raw in rows:
+                if raw and bytes(raw)[0] == 0x80:
+                    db.session.execute(
+                        update(t).where(id_col == row_id).values({data_col.name: pack_numbers(unpack_numbers(raw))})
+                    )
+                    converted += 1
+            last_id = rows[-1][0]
+            db.session.commit()
+    logging.info(f"Packed {converted} pickled number lists")
+    return converted
+
+# -------------------- WALLET CENTS --------------------
+
+def migrate_wallet() -> bool:
+    """
+    Adds user.balance_cents to databases created before the wallet ledger
+    and fills it from the float balance. Returns True if the column was added.
+    """
+    columns = {c["name"] for c in inspect(db.engine).get_columns("user")}
+    if "balance_cents" in columns:
+        return False
+    db.session.execute(text('ALTER TABLE "user" ADD COLUMN balance_cents BIGINT NOT NULL DEFAULT 0'))
+    db.session.execute(text('UPDATE "user" SET balance_cents = CAST(ROUND(COALESCE(balance, 0) * 100) AS BIGINT)'))
+    db.session.commit()
+    logging.info("Added user.balance_cents")
+    return True
+
+# -------------------- GAME SETTLEMENT --------------------
+
+def migrate_settlement() -> bool:
+    """
+    Adds game.settled_at and marks games finished before settlement existed as
+    settled, so they are never paid again. Returns True if the column was added.
+    """
+    columns = {c["name"] for c in inspect(db.engine).get_columns("game")}
+    if "settled_at" in columns:
+        return False
+    db.session.execute(text("ALTER TABLE game ADD COLUMN settled_at TIMESTAMP"))
+    db.session.execute(text("UPDATE game SET settled_at = finished_at WHERE status = 'finished'"))
+    db.session.commit()
+    logging.info("Added game.settled_at")
+    return True
+
+# -------------------- SMS RECEIPTS --------------------
+
+def migrate_payment_event_phone() -> bool:
+    """
+    Adds payment_event.phone to inboxes created before SMS reconciliation.
+    Returns True if the column was added.
+    """
+    columns = {c["name"] for c in inspect(db.engine).get_columns("payment_event")}
+    if "phone" in columns:
+        return False
+    db.session.execute(text("ALTER TABLE payment_event ADD COLUMN phone VARCHAR(20)"))
+    db.session.commit()
+    logging.info("Added payment_event.phone")
+    return True
+
+# -------------------- PLAY MODE --------------------
+
+def migrate_participant_mode() -> bool:
+    """
+    Adds game_participant.play_mode, filled from the player's saved preference that
+    rooms used before the mode was kept per game. Returns True if the column was added.
+    """
+    columns = {c["name"] for c in inspect(db.engine).get_columns("game_participant")}
+    if "play_mode" in columns:
+        return False
+    db.session.execute(text("ALTER TABLE game_participant ADD COLUMN play_mode VARCHAR(10) DEFAULT 'auto'"))
+    db.session.execute(text(
+        'UPDATE game_participant SET play_mode = COALESCE('
+        '(SELECT play_mode FROM "user" WHERE "user".id = game_participant.user_id), \'auto\')'
+    ))
+    db.session.commit()
+    logging.info("Added game_participant.play_mode")
+    return True
+
+# -------------------- INDEXES --------------------
+
+def create_indexes() -> int:
+    """
+    create_all() skips indexes on tables that already exist; this adds any declared
+    in models.py that the database is missing. Returns how many were created.
+    """
+    created = 0
+    for t in db.metadata.sorted_tables:
+        existing = {ix["name"] for ix in inspect(db.engine).get_indexes(t.name)}
+        for index in t.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created += 1
+    logging.info(f"Created {created} missing indexes")
+    return created
+
+# -------------------- ALL --------------------
+
+def migrate():
+    """
+    Brings any database, empty or from an older release, up to models.py. Every step
+    checks before it changes anything, so running it again is harmless.
+    """
+    create_tables()
+    migrate_wallet()
+    migrate_settlement()
+    migrate_payment_event_phone()
+    migrate_participant_mode()
+    migrate_number_columns()
+    create_indexes()
+
+if __name__ == "__main__":
+    from app_factory import create_app
+    logging.basicConfig(level=logging.INFO)
+    with create_app({"START_WORKERS": False}).app_context():
+        migrate()
@@ -1,7 +1,6 @@
 from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
-
-db = SQLAlchemy()
+from database import db
+from db_types import PackedNumbers
 
 # -------------------- USER MODEL --------------------
 
@@ -10,7 +9,8 @@ class User(db.Model):
     telegram_id = db.Column(db.BigInteger, unique=True, nullable=False, index=True)
     username = db.Column(db.String(64))
     phone = db.Column(db.String(20))
-    balance = db.Column(db.Float, default=0.0)
+    balance = db.Column(db.Float, default=0.0)                        # mirror of balance_cents, in birr
+    balance_cents = db.Column(db.BigInteger, default=0, nullable=False)  # authoritative; change via wallet.py
     games_played = db.Column(db.Integer, default=0)
     games_won = db.Column(db.Integer, default=0)
     sound_enabled = db.Column(db.Boolean, default=True)
@@ -18,7 +18,7 @@ class User(db.Model):
     language = db.Column(db.String(10), default="en")
     is_admin = db.Column(db.Boolean, default=False)
 
-    referrer_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), nullable=True)
+    referrer_id = db.Column(db.BigInteger, db.ForeignKey('user.id'), nullable=True, index=True)
     referred_users = db.relationship('User', backref=db.backref('referrer', remote_side=[id]), lazy=True)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -39,12 +39,13 @@ class Game(db.Model):
     pool = db.Column(db.Float, default=0.0)
     payout = db.Column(db.Float, default=0.0)
     commission = db.Column(db.Float, default=0.0)
-    called_numbers = db.Column(db.PickleType)
+    called_numbers = db.Column(PackedNumbers)       # call order, one byte per number
 
     winner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     finished_at = db.Column(db.DateTime)
+    settled_at = db.Column(db.DateTime)              # set once by settlement.settle
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
@@ -59,7 +60,8 @@ class GameParticipant(db.Model):
 
     cartela_number = db.Column(db.Integer, nullable=False)
     cartela_count = db.Column(db.Integer, default=1)
-    marked_numbers = db.Column(db.PickleType)
+    marked_numbers = db.Column(PackedNumbers)       # hand-daubed numbers, and every mark as of the last mode switch
+    play_mode = db.Column(db.String(10), default="auto")   # "auto" or "manual", for all of the player's boards here
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -97,6 +99,48 @@ class Transaction(db.Model):
     completed_at = db.Column(db.DateTime)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# -------------------- WALLET LEDGER MODEL --------------------
+
+class WalletEntry(db.Model):
+    # Append-only: one row per balance change, amounts in cents
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    reference = db.Column(db.String(100))
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'reference', name='unique_wallet_reference'),
+    )
+
+# -------------------- PAYMENT WEBHOOK INBOX MODEL --------------------
+
+class PaymentEvent(db.Model):
+    # Append-only: every verified webhook delivery, at most once per (provider, reference)
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    provider = db.Column(db.String(20), nullable=False)                 # chapa, ...
+    reference = db.Column(db.String(100), nullable=False)               # provider's transaction reference
+    payload = db.Column(db.Text, nullable=False)                        # raw body as received
+    telegram_id = db.Column(db.BigInteger)
+    amount = db.Column(db.Float)
+    phone = db.Column(db.String(20))                                    # payer, for SMS receipts
+
+    # received -> applied / ignored for provider webhooks; unmatched -> matched / review for SMS receipts
+    status = db.Column(db.String(20), default="received", nullable=False)
+    error = db.Column(db.String(200))
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
+
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'reference', name='unique_payment_event'),
+        db.Index('ix_payment_event_status', 'status', 'id'),
+    )
+
 # -------------------- SCHEDULED GAME MODEL --------------------
 
 class ScheduledGame(db.Model):
@@ -110,7 +154,122 @@ class ScheduledGame(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# -------------------- JACKPOT LOBBY MODEL --------------------
+
+lobby_players = db.Table(
+    'lobby_players',
+    db.Column('lobby_id', db.Integer, db.ForeignKey('lobby.id'), primary_key=True),
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+)
+
+class Lobby(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), default="waiting", index=True)   # waiting, active, completed
+    jackpot = db.Column(db.Float, default=0.0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    players = db.relationship('User', secondary=lobby_players, lazy='selectin')
+
+# -------------------- BROADCAST MODELS --------------------
+
+class Broadcast(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="running", index=True)   # running, completed
+    created_by = db.Column(db.BigInteger)                                # admin telegram ID
+
+    last_user_id = db.Column(db.Integer, default=0)                      # keyset cursor over user.id
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class BroadcastDelivery(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('broadcast.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)                    # sent, failed
+    attempts = db.Column(db.Integer, default=1)
+    error = db.Column(db.String(200))
+
+    __table_args__ = (
+        db.UniqueConstraint('broadcast_id', 'user_id', name='unique_delivery_per_broadcast'),
+    )
+
+class Notification(db.Model):
+    # Outbox row: written in the same transaction as the admin action, sent later by outbox.OutboxWorker
+    id = db.Column(db.Integer, primary_key=True)
+    telegram_id = db.Column(db.BigInteger, nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="pending", nullable=False)  # pending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    error = db.Column(db.String(200))
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_notification_due', 'status', 'next_attempt_at', 'id'),
+    )
+
+# -------------------- REFERRAL SUMMARY MODEL --------------------
+
+class ReferralStat(db.Model):
+    # One row per referrer, kept current by referral_stats so leaderboards never scan user/transaction
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    referrals = db.Column(db.Integer, default=0, nullable=False)
+    active_referrals = db.Column(db.Integer, default=0, nullable=False)
+    bonus_total = db.Column(db.Float, default=0.0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_referral_stat_active', 'active_referrals', 'user_id'),
+        db.Index('ix_referral_stat_referrals', 'referrals', 'user_id'),
+    )
+
+# -------------------- BOT CHAT STATE MODEL --------------------
+
+class ChatState(db.Model):
+    # The bot's per-chat context.chat_data (deposit method, language, toggles) as JSON, so
+    # every web worker taking webhook updates sees the same conversation state
+    chat_id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    data = db.Column(db.Text, nullable=False, default="{}")
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class TelegramUpdate(db.Model):
+    # Webhook inbox: every update Telegram delivers, once per update_id. Any web worker may
+    # take one, but only the oldest open update of a lane (chat) that nobody is handling,
+    # so a chat's updates run one at a time and in order across all processes
+    update_id = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    lane = db.Column(db.BigInteger, nullable=False)                     # chat id, else user id, else -update_id
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default="queued", nullable=False)  # queued -> handling -> done
+    lease_until = db.Column(db.DateTime)                                # a handler that dies frees the lane after this
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_telegram_update_status', 'status', 'update_id'),
+        db.Index('ix_telegram_update_lane', 'lane', 'status'),
+    )
+
+class LeaderboardSnapshot(db.Model):
+    # The top of one leaderboard as JSON (see leaderboards.py). version goes up on every
+    # write, so a process can tell its in-memory copy is stale with one primary-key read
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    data = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # -------------------- INDEXES --------------------
 
 db.Index('ix_game_created_at', Game.created_at)
 db.Index('ix_transaction_created_at', Transaction.created_at)
+db.Index('ix_user_username', User.username)           # admin search is a prefix match
+db.Index('ix_transaction_type_status_created', Transaction.type, Transaction.status, Transaction.created_at)
+db.Index('ix_transaction_type_status_completed', Transaction.type, Transaction.status, Transaction.completed_at)
+db.Index('ix_transaction_method_reference', Transaction.method, Transaction.reference)
@@ -0,0 +1,126 @@
+# outbox.py
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+
+import bot_db
+from broadcaster import BroadcastEngine
+from models import Notification
+
+# Admin actions never talk to Telegram themselves: they add a notification row in the
+# same transaction as the approval, and one long-lived worker in the bot process sends
+# the rows in batches through the shared rate limiter.
+
+LEASE = timedelta(minutes=5)            # a claimed row becomes due again if the worker dies mid-batch
+MAX_ATTEMPTS = 5
+
+_table = Notification.__table__
+
+# -------------------- ENQUEUE --------------------
+
+def enqueue(session: Session, telegram_id, text: str):
+    """
+    Queues one message. Nothing is sent unless the caller's transaction commits.
+    """
+    session.add(Notification(telegram_id=int(telegram_id), text=text))
+
+def enqueue_many(session: Session, messages: Iterable[Tuple[int, str]]) -> int:
+    rows = [{"telegram_id": int(tid), "text": text, "status": "pending", "attempts": 0,
+             "next_attempt_at": datetime.utcnow()} for tid, text in messages]
+    if rows:
+        session.execute(insert(Notification), rows)
+    return len(rows)
+
+# -------------------- WORKER STATE --------------------
+
+def _claim(session: Session, limit: int) -> List[Tuple[int, int, str, int]]:
+    now = datetime.utcnow()
+    rows = session.execute(
+        select(Notification.id, Notification.telegram_id, Notification.text, Notification.attempts)
+        .where(Notification.status == "pending", Notification.next_attempt_at <= now)
+        .order_by(Notification.next_attempt_at, Notification.id)
+        .limit(limit)
+    ).all()
+    if rows:
+        session.execute(
+            update(Notification).where(Notification.id.in_([r.id for r in rows])).values(next_attempt_at=now + LEASE)
+        )
+    return [tuple(r) for r in rows]
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+def _record(session: Session, sent: List[int], failed: List[Tuple[int, int, str]], max_attempts: int):
+    now = datetime.utcnow()
+    if sent:
+        session.execute(
+            update(Notification).where(Notification.id.in_(sent))
+            .values(status="sent", sent_at=now, attempts=Notification.attempts + 1)
+        )
+    if failed:
+        session.execute(
+            update(_table)
+            .where(_table.c.id == bindparam("nid"))
+            .values(status=bindparam("new_status"), attempts=bindparam("new_attempts"),
+                    next_attempt_at=bindparam("due"), error=bindparam("err")),
+            [
+                {"nid": nid, "new_attempts": attempts,
+                 "new_status": "failed" if attempts >= max_attempts else "pending",
+                 "due": now + _backoff(attempts), "err": error}
+                for nid, attempts, error in failed
+            ]
+        )
+
+# -------------------- WORKER --------------------
+
+class OutboxWorker:
+    """
+    Drains the outbox forever: claims up to batch_size due rows, sends them
+    concurrently through a BroadcastEngine (so the global and per-chat limits are
+    shared with broadcasts), then writes the results in two statements. Failed
+    messages back off exponentially and give up after max_attempts.
+    """
+
+    def __init__(self, engine: BroadcastEngine, batch_size: int = 100, idle_interval: float = 1.0,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self.max_attempts = max_attempts
+        self._stopping = asyncio.Event()
+
+    async def drain_once(self) -> int:
+        batch = await bot_db.run(_claim, self.batch_size)
+        if not batch:
+            return 0
+        results = await self.engine.send_many((tid, text) for _, tid, text, _ in batch)
+        sent, failed = [], []
+        for (nid, tid, _, attempts), (status, _, error) in zip(batch, results):
+            if status == "sent":
+                sent.append(nid)
+            else:
+                failed.append((nid, attempts + 1, error))
+                logging.warning(f"Notification {nid} to {tid} failed (attempt {attempts + 1}): {error}")
+        await bot_db.run(_record, sent, failed, self.max_attempts)
+        return len(batch)
+
+    async def run(self):
+        logging.info("📬 Notification outbox worker started")
+        while not self._stopping.is_set():
+            try:
+                count = await self.drain_once()
+            except Exception as e:
+                logging.error(f"Notification outbox error: {e}")
+                count = 0
+            if count < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.idle_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stop(self):
+        self._stopping.set()
@@ -0,0 +1,242 @@
+# payment_inbox.py
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import CHAPA_WEBHOOK_SECRET
+from database import db
+from models import User, Transaction, WalletEntry, PaymentEvent
+import outbox
+import wallet
+
+# Payment webhooks are only verified and written to the payment_event inbox while the
+# provider waits; (provider, reference) is unique, so redeliveries stop at the INSERT.
+# InboxWorker credits the received events in batches: one user lookup, one bulk insert
+# of transactions, one batched wallet pass.
+
+BATCH_SIZE = 500
+
+class InvalidEvent(ValueError):
+    pass
+
+@dataclass(frozen=True)
+class ParsedEvent:
+    reference: str
+    telegram_id: Optional[int]
+    amount: float
+
+@dataclass(frozen=True)
+class Provider:
+    secret: Optional[str]
+    signature_headers: Tuple[str, ...]
+    parse: Callable[[dict], Optional[ParsedEvent]]    # None: valid, but nothing to credit
+
+# -------------------- PROVIDERS --------------------
+
+def _parse_chapa(body: dict) -> Optional[ParsedEvent]:
+    if body.get("status", "success") != "success":
+        return None
+    tx_ref = body.get("tx_ref")
+    try:
+        amount = float(body.get("amount"))
+    except (TypeError, ValueError):
+        raise InvalidEvent("amount is missing or not a number")
+    if not tx_ref or amount <= 0:
+        raise InvalidEvent("tx_ref and a positive amount are required")
+    telegram_id = (body.get("custom_data") or {}).get("telegram_id")
+    return ParsedEvent(str(tx_ref), int(telegram_id) if telegram_id else None, amount)
+
+PROVIDERS: Dict[str, Provider] = {
+    "chapa": Provider(CHAPA_WEBHOOK_SECRET, ("Chapa-Signature", "X-Chapa-Signature"), _parse_chapa),
+}
+
+def verify(provider: Provider, raw: bytes, headers: Mapping[str, str]) -> bool:
+    # Unsigned events are never accepted; the route answers 404 for a provider without a secret
+    if not provider.secret:
+        return False
+    expected = hmac.new(provider.secret.encode(), raw, hashlib.sha256).hexdigest()
+    return any(hmac.compare_digest(expected, headers.get(h, "")) for h in provider.signature_headers)
+
+def parse(provider: Provider, raw: bytes) -> Optional[ParsedEvent]:
+    try:
+        body = json.loads(raw or b"{}")
+    except ValueError:
+        raise InvalidEvent("body is not JSON")
+    if not isinstance(body, dict):
+        raise InvalidEvent("body must be a JSON object")
+    return provider.parse(body)
+
+# -------------------- INTAKE --------------------
+
+def record(session: Session, provider_name: str, raw: bytes, event: ParsedEvent,
+           status: str = "received", phone: Optional[str] = None) -> bool:
+    """
+    Appends the event to the inbox. Returns False if (provider, reference) was already
+    recorded. The caller commits.
+    """
+    values = dict(
+        provider=provider_name,
+        reference=event.reference,
+        payload=raw.decode("utf-8", "replace"),
+        telegram_id=event.telegram_id,
+        amount=event.amount,
+        phone=phone,
+        status=status,
+        received_at=datetime.utcnow(),
+    )
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        module = postgresql if dialect == "postgresql" else sqlite
+        stmt = module.insert(PaymentEvent).values(**values).on_conflict_do_nothing(
+            index_elements=["provider", "reference"]
+        )
+        return session.execute(stmt).rowcount == 1
+    savepoint = session.begin_nested()
+    try:
+        session.execute(insert(PaymentEvent).values(**values))
+        savepoint.commit()
+        return True
+    except IntegrityError:
+        savepoint.rollback()
+        return False
+
+# -------------------- PROCESSING --------------------
+
+def _skip(event: PaymentEvent, reason: str, now: datetime):
+    event.status = "ignored"
+    event.error = reason
+    event.processed_at = now
+
+def process_batch(session: Session, limit: int = BATCH_SIZE) -> int:
+    """
+    Credits up to `limit` received events and returns how many were handled. Events for
+    unknown users or for references the ledger already holds are marked ignored.
+    The caller commits.
+    """
+    stmt = select(PaymentEvent).where(PaymentEvent.status == "received").order_by(PaymentEvent.id).limit(limit)
+    if session.get_bind().dialect.name == "postgresql":
+        stmt = stmt.with_for_update(skip_locked=True)
+    events = session.execute(stmt).scalars().all()
+    if not events:
+        return 0
+
+    now = datetime.utcnow()
+    users = dict(session.execute(
+        select(User.telegram_id, User.id).where(User.telegram_id.in_({e.telegram_id for e in events if e.telegram_id}))
+    ).all())
+    credited = set(session.execute(
+        select(WalletEntry.reference).where(
+            WalletEntry.kind == "deposit",
+            WalletEntry.reference.in_([f"{e.provider}:{e.reference}" for e in events])
+        )
+    ).scalars())
+
+    to_apply = []
+    for event in events:
+        if event.telegram_id not in users:
+            _skip(event, "user_not_found", now)
+        elif f"{event.provider}:{event.reference}" in credited:
+            _skip(event, "already_credited", now)
+        else:
+            to_apply.append(event)
+
+    if to_apply:
+        txs = [
+            Transaction(
+                user_id=users[e.telegram_id],
+                type="deposit",
+                amount=e.amount,
+                status="approved",
+                method=e.provider,
+                reference=e.reference,
+                completed_at=now
+            )
+            for e in to_apply
+        ]
+        session.add_all(txs)
+        session.flush()
+        wallet.apply_many(session, [
+            wallet.Entry(tx.user_id, tx.amount, "deposit", f"{e.provider}:{e.reference}", tx.id)
+            for e, tx in zip(to_apply, txs)
+        ])
+        for e, tx in zip(to_apply, txs):
+            e.status = "applied"
+            e.transaction_id = tx.id
+            e.processed_at = now
+        outbox.enqueue_many(session, [
+            (e.telegram_id, f"💰 Deposit of {e.amount} birr received via {e.provider}.") for e in to_apply
+        ])
+
+    session.flush()
+    return len(events)
+
+# -------------------- WORKER --------------------
+
+class InboxWorker:
+    """
+    Background thread that drains the inbox. It polls every `interval` seconds and
+    is woken early by the webhook after each new event.
+    """
+
+    def __init__(self, app, interval: float = 2.0, batch_size: int = BATCH_SIZE,
+                 jobs: Tuple[Callable[[Session, int], int], ...] = (process_batch,)):
+        self.app = app
+        self.jobs = jobs
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="payment-inbox", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def drain(self) -> int:
+        handled = 0
+        with self.app.app_context():
+            for job in self.jobs:
+                while True:
+                    try:
+                        count = job(db.session, self.batch_size)
+                        db.session.commit()
+                    except Exception as e:
+                        db.session.rollback()
+                        logging.error(f"Payment inbox {job.__name__} failed: {e}")
+                        break
+                    handled += count
+                    if count < self.batch_size:
+                        break
+        return handled
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.drain()
+
+_worker: Optional[InboxWorker] = None
+
+def start_worker(app, jobs: Tuple[Callable[[Session, int], int], ...] = (process_batch,)) -> InboxWorker:
+    global _worker
+    if _worker is None:
+        _worker = InboxWorker(app, jobs=jobs)
+        _worker.start()
+    return _worker
+
+def wake_worker():
+    if _worker is not None:
+        _worker.wake()
@@ -0,0 +1,320 @@
+# reconciliation.py
+import hashlib
+import re
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from config import RECEIPT_MATCH_HOURS
+from models import User, Transaction, PaymentEvent
+from payment_inbox import InvalidEvent, ParsedEvent, record
+import outbox
+import wallet
+
+# Matches money that actually arrived (CBE Birr / Telebirr SMS forwarded by Tasker, or a
+# webhook carrying the same fields) against the deposit claims users send the bot
+# (pending Transaction rows holding the transaction ID they typed). Receipts sit in the
+# payment_event inbox as "unmatched"; every pass builds a hash index of the pending
+# claims, approves exact matches in one batch and parks ambiguous receipts as "review".
+# Only a claim that states the amount paid (the bot asks for it before the transaction
+# ID) is approved without an admin; receipts still unclaimed after RECEIPT_MATCH_HOURS
+# go to review as well.
+
+METHODS = ("cbe_birr", "telebirr", "cbe_bank")
+AUTO_APPROVER = "reconciliation"
+
+@dataclass(frozen=True)
+class Receipt:
+    method: Optional[str]
+    reference: Optional[str]
+    amount: float
+    phone: Optional[str]
+
+# -------------------- PARSING --------------------
+
+_AMOUNT = re.compile(r"(?:ETB|Br\.?|Birr)\s*([\d,]+(?:\.\d+)?)|([\d,]+(?:\.\d+)?)\s*(?:ETB|Br\b|Birr)", re.I)
+_REFERENCE = re.compile(
+    r"(?:transaction (?:number|id)|txn ?id|trans(?:action)? ?no\.?|ref(?:erence)?(?: no\.?)?)\s*(?:is|:)?\s*([A-Z0-9]{6,})",
+    re.I
+)
+_PHONE = re.compile(r"(?:\+?251|\b0)(9\d{8})\b")
+
+def normalize_reference(reference: Optional[str]) -> Optional[str]:
+    reference = re.sub(r"\s+", "", reference or "").upper()
+    return reference or None
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    match = _PHONE.search(re.sub(r"[\s-]", "", str(phone or "")))
+    return f"0{match.group(1)}" if match else None
+
+def detect_method(text: str) -> Optional[str]:
+    lowered = text.lower()
+    if "telebirr" in lowered:
+        return "telebirr"
+    if "cbe birr" in lowered or "cbebirr" in lowered:
+        return "cbe_birr"
+    if "cbe" in lowered or "commercial bank" in lowered:
+        return "cbe_bank"
+    return None
+
+def parse_sms(text: str, method: Optional[str] = None) -> Receipt:
+    """
+    Pulls amount, transaction reference and payer phone out of a bank SMS.
+    Raises InvalidEvent when no amount can be found.
+    """
+    amount_match = _AMOUNT.search(text)
+    if not amount_match:
+        raise InvalidEvent("no amount in SMS")
+    amount = float((amount_match.group(1) or amount_match.group(2)).replace(",", ""))
+    ref_match = _REFERENCE.search(text)
+    phone_match = _PHONE.search(text)
+    return Receipt(
+        method=method or detect_method(text),
+        reference=normalize_reference(ref_match.group(1)) if ref_match else None,
+        amount=amount,
+        phone=f"0{phone_match.group(1)}" if phone_match else None,
+    )
+
+def parse_payload(body: Dict[str, Any]) -> Receipt:
+    """
+    Tasker / webhook body: {"amount", "phone"} plus optional "sms", "method", "reference".
+    Fields given explicitly win over what the SMS text says.
+    """
+    method = body.get("method") if body.get("method") in METHODS else None
+    parsed = parse_sms(body["sms"], method) if body.get("sms") else None
+    try:
+        amount = float(body["amount"]) if body.get("amount") is not None else parsed.amount
+    except (TypeError, ValueError, AttributeError):
+        raise InvalidEvent("amount is missing or not a number")
+    if amount <= 0:
+        raise InvalidEvent("amount must be positive")
+    return Receipt(
+        method=method or (parsed.method if parsed else None),
+        reference=normalize_reference(body.get("reference")) or (parsed.reference if parsed else None),
+        amount=amount,
+        phone=normalize_phone(body.get("phone")) or (parsed.phone if parsed else None),
+    )
+
+def record_receipt(session: Session, raw: bytes, receipt: Receipt, sms: Optional[str] = None) -> bool:
+    """
+    Queues a receipt for matching. The same SMS forwarded twice is recorded once; a bare
+    {amount, phone} post has nothing to tell a resend from a second payment, so each is kept.
+    """
+    if receipt.reference:
+        reference = receipt.reference
+    elif sms:
+        reference = "sms:" + hashlib.sha256(sms.encode()).hexdigest()[:32]
+    else:
+        reference = "sms:" + uuid.uuid4().hex
+    return record(
+        session,
+        receipt.method or "sms",
+        raw,
+        ParsedEvent(reference, None, receipt.amount),
+        status="unmatched",
+        phone=receipt.phone
+    )
+
+# -------------------- INDEX --------------------
+
+@dataclass(frozen=True)
+class Claim:
+    tx_id: int
+    user_id: int
+    telegram_id: int
+    method: Optional[str]
+    reference: Optional[str]
+    phone: Optional[str]
+    amount: float
+
+class ClaimIndex:
+    """
+    Pending deposit claims hashed by (method, reference) and by payer phone.
+    Claims are removed as they match, so two receipts never take the same claim.
+    """
+
+    def __init__(self, claims: List[Claim]):
+        self.by_reference: Dict[Tuple[Optional[str], str], List[Claim]] = defaultdict(list)
+        self.by_phone: Dict[str, List[Claim]] = defaultdict(list)
+        for claim in claims:
+            if claim.reference:
+                self.by_reference[(claim.method, claim.reference)].append(claim)
+            if claim.phone:
+                self.by_phone[claim.phone].append(claim)
+
+    def remove(self, claim: Claim):
+        if claim.reference:
+            self.by_reference[(claim.method, claim.reference)].remove(claim)
+        if claim.phone:
+            self.by_phone[claim.phone].remove(claim)
+
+    def match(self, receipt: Receipt) -> Tuple[Optional[Claim], Optional[str]]:
+        """
+        (claim, None) for an exact match, (None, reason) when a person should look,
+        (None, None) when nothing claims this receipt yet.
+        """
+        if receipt.reference:
+            methods = (receipt.method,) if receipt.method else METHODS
+            found = [c for m in methods for c in self.by_reference.get((m, receipt.reference), ())]
+            if len(found) > 1:
+                return None, "duplicate_reference"
+            if found:
+                claim = found[0]
+                if not claim.amount:
+                    return None, "amount_unconfirmed"     # the receipt alone must not decide what is credited
+                if abs(claim.amount - receipt.amount) > 0.005:
+                    return None, "amount_mismatch"
+                return claim, None
+
+        if receipt.phone:
+            found = [c for c in self.by_phone.get(receipt.phone, ())
+                     if not receipt.method or c.method == receipt.method]
+            if len(found) > 1:
+                return None, "several_claims_for_phone"
+            if found:
+                claim = found[0]
+                if claim.amount and abs(claim.amount - receipt.amount) < 0.005:
+                    return claim, None
+                return None, "phone_match_only"
+        return None, None
+
+def _load_claims(session: Session, tx_id: Optional[int] = None) -> List[Claim]:
+    stmt = (
+        select(Transaction.id, Transaction.user_id, User.telegram_id, Transaction.method,
+               Transaction.reference, Transaction.deposit_phone, User.phone, Transaction.amount)
+        .join(User, User.id == Transaction.user_id)
+        .where(Transaction.type == "deposit", Transaction.status == "pending")
+    )
+    if tx_id is not None:
+        stmt = stmt.where(Transaction.id == tx_id)
+    rows = session.execute(stmt).all()
+    return [
+        Claim(r.id, r.user_id, int(r.telegram_id), r.method, normalize_reference(r.reference),
+              normalize_phone(r.deposit_phone or r.phone), r.amount or 0.0)
+        for r in rows
+    ]
+
+# -------------------- MATCHING --------------------
+
+_events = PaymentEvent.__table__
+_transactions = Transaction.__table__
+
+def _approve(session: Session, pairs: List[Tuple[Any, Claim]], now: datetime):
+    session.execute(
+        update(_transactions)
+        .where(_transactions.c.id == bindparam("tid"), _transactions.c.status == "pending")
+        .values(status="approved", amount=bindparam("paid"), transaction_id=bindparam("ref"),
+                sms_text=bindparam("sms"), approved_by=AUTO_APPROVER, completed_at=now),
+        [
+            {"tid": c.tx_id, "paid": e.amount, "sms": e.payload,
+             "ref": None if e.reference.startswith("sms:") else e.reference}
+            for e, c in pairs
+        ]
+    )
+    wallet.apply_many(session, [
+        wallet.Entry(c.user_id, e.amount, "deposit", f"tx:{c.tx_id}", c.tx_id) for e, c in pairs
+    ])
+    session.execute(
+        update(_events)
+        .where(_events.c.id == bindparam("eid"))
+        .values(status="matched", transaction_id=bindparam("tid"), processed_at=now, error=None),
+        [{"eid": e.id, "tid": c.tx_id} for e, c in pairs]
+    )
+    outbox.enqueue_many(session, [
+        (c.telegram_id, f"✅ Your deposit of {e.amount} birr was confirmed.") for e, c in pairs
+    ])
+
+_cursor = 0     # highest receipt id looked at by the last pass; passes walk the queue from here
+
+def reconcile_batch(session: Session, limit: int = 500) -> int:
+    """
+    One pass over up to `limit` unmatched receipts, continuing after the ones the last
+    pass looked at so a backlog of unclaimed receipts can't hide newer ones. Returns how
+    many were resolved (approved or sent to review); receipts nobody has claimed yet stay
+    for a later pass until they are RECEIPT_MATCH_HOURS old. The caller commits.
+    """
+    global _cursor
+    now = datetime.utcnow()
+    expired = session.execute(
+        update(_events)
+        .where(_events.c.status == "unmatched", _events.c.received_at < now - timedelta(hours=RECEIPT_MATCH_HOURS))
+        .values(status="review", error="unclaimed")
+    ).rowcount
+
+    stmt = (
+        select(_events.c.id, _events.c.provider, _events.c.reference, _events.c.amount,
+               _events.c.phone, _events.c.payload)
+        .where(_events.c.status == "unmatched")
+        .order_by(_events.c.id)
+        .limit(limit)
+    )
+    receipts = session.execute(stmt.where(_events.c.id > _cursor)).all()
+    # A short page means the end of the queue: the next pass starts again from the oldest
+    _cursor = receipts[-1].id if len(receipts) == limit else 0
+    if not receipts:
+        return expired
+
+    index = ClaimIndex(_load_claims(session))
+    matched: List[Tuple[Any, Claim]] = []
+    review: List[Dict[str, Any]] = []
+    for event in receipts:
+        receipt = Receipt(
+            method=event.provider if event.provider in METHODS else None,
+            reference=None if event.reference.startswith("sms:") else event.reference,
+            amount=event.amount,
+            phone=event.phone,
+        )
+        claim, reason = index.match(receipt)
+        if claim:
+            index.remove(claim)
+            matched.append((event, claim))
+        elif reason:
+            review.append({"eid": event.id, "reason": reason})
+
+    if matched:
+        _approve(session, matched, now)
+    if review:
+        session.execute(
+            update(_events).where(_events.c.id == bindparam("eid")).values(status="review", error=bindparam("reason")),
+            review
+        )
+    return expired + len(matched) + len(review)
+
+# -------------------- REVIEW QUEUE --------------------
+
+def review_queue(session: Session, limit: int = 50) -> List[Dict[str, Any]]:
+    return [
+        dict(r._mapping) for r in session.execute(
+            select(_events.c.id, _events.c.provider, _events.c.reference, _events.c.amount,
+                   _events.c.phone, _events.c.error.label("reason"), _events.c.payload, _events.c.received_at)
+            .where(_events.c.status == "review")
+            .order_by(_events.c.id)
+            .limit(limit)
+        )
+    ]
+
+def resolve(session: Session, event_id: int, tx_id: Optional[int]) -> bool:
+    """
+    An admin's decision on a review item: match it to pending deposit tx_id, or
+    dismiss it when tx_id is None. Returns False if either side is no longer open.
+    """
+    event = session.execute(
+        select(_events.c.id, _events.c.reference, _events.c.amount, _events.c.payload)
+        .where(_events.c.id == event_id, _events.c.status.in_(("review", "unmatched")))
+    ).first()
+    if event is None:
+        return False
+    if tx_id is None:
+        session.execute(update(_events).where(_events.c.id == event_id)
+                        .values(status="ignored", processed_at=datetime.utcnow()))
+        return True
+    claims = _load_claims(session, tx_id)
+    if not claims:
+        return False
+    _approve(session, [(event, claims[0])], datetime.utcnow())
+    return True
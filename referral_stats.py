@@ -0,0 +1,115 @@
+# referral_stats.py
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import case, delete, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import User, Transaction, ReferralStat
+
+BONUS_TYPES = ("referral_bonus", "referral_milestone")
+
+# -------------------- MAINTENANCE --------------------
+
+def _bump(session: Session, user_id: int, **deltas):
+    # Two /start's of one referrer may both find no row; the insert adds to whichever
+    # lands first instead of failing on its key and rolling back the caller
+    values = {name: getattr(ReferralStat, name) + delta for name, delta in deltas.items()}
+    row = {"user_id": user_id, "referrals": 0, "active_referrals": 0, "bonus_total": 0.0}
+    row.update(deltas)
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        module = postgresql if dialect == "postgresql" else sqlite
+        session.execute(
+            module.insert(ReferralStat).values(**row)
+            .on_conflict_do_update(index_elements=["user_id"], set_={**values, "updated_at": datetime.utcnow()})
+        )
+        return
+    stmt = update(ReferralStat).where(ReferralStat.user_id == user_id).values(**values)
+    if session.execute(stmt).rowcount:
+        return
+    savepoint = session.begin_nested()
+    try:
+        session.execute(insert(ReferralStat).values(**row))
+        savepoint.commit()
+    except IntegrityError:
+        savepoint.rollback()
+        session.execute(stmt)
+
+def record_referral(session: Session, referrer_id: int):
+    _bump(session, referrer_id, referrals=1)
+
+def record_first_game(session: Session, referrer_id: Optional[int], count: int = 1):
+    """
+    Call when a referred user's games_played goes from 0 to 1; `count` such users at once.
+    """
+    if referrer_id:
+        _bump(session, referrer_id, active_referrals=count)
+
+def record_bonus(session: Session, user_id: int, amount: float):
+    _bump(session, user_id, bonus_total=amount)
+
+def rebuild(session: Session) -> int:
+    """
+    Recomputes every row from user / transaction with two grouped queries.
+    """
+    referred = (
+        session.query(
+            User.referrer_id,
+            func.count(User.id),
+            func.sum(case((User.games_played > 0, 1), else_=0)),
+        )
+        .filter(User.referrer_id.isnot(None))
+        .group_by(User.referrer_id)
+        .all()
+    )
+    bonuses = dict(
+        session.query(Transaction.user_id, func.sum(Transaction.amount))
+        .filter(Transaction.type.in_(BONUS_TYPES))
+        .group_by(Transaction.user_id)
+        .all()
+    )
+
+    rows: Dict[int, dict] = {}
+    for referrer_id, count, active in referred:
+        rows[referrer_id] = {"user_id": referrer_id, "referrals": count, "active_referrals": int(active or 0), "bonus_total": 0.0}
+    for user_id, total in bonuses.items():
+        rows.setdefault(user_id, {"user_id": user_id, "referrals": 0, "active_referrals": 0, "bonus_total": 0.0})
+        rows[user_id]["bonus_total"] = float(total or 0)
+
+    session.execute(delete(ReferralStat))
+    if rows:
+        session.execute(insert(ReferralStat), list(rows.values()))
+    return len(rows)
+
+# -------------------- READS --------------------
+
+def top_referrers(session: Session, limit: int = 10, by: str = "active_referrals") -> List[Tuple[int, str, int, int, float]]:
+    """
+    (user_id, username, referrals, active_referrals, bonus_total), best first.
+    Reads walk the summary index, so cost depends on `limit`, not on the user count.
+    """
+    if session.query(ReferralStat.user_id).first() is None:
+        rebuild(session)
+    order = getattr(ReferralStat, by)
+    return [
+        tuple(row) for row in
+        session.query(ReferralStat.user_id, User.username, ReferralStat.referrals,
+                      ReferralStat.active_referrals, ReferralStat.bonus_total)
+        .join(User, User.id == ReferralStat.user_id)
+        .filter(order > 0)
+        .order_by(order.desc(), ReferralStat.user_id)
+        .limit(limit)
+        .all()
+    ]
+
+def invited_usernames(session: Session, referrer_ids: List[int]) -> Dict[int, List[str]]:
+    invited: Dict[int, List[str]] = {uid: [] for uid in referrer_ids}
+    if referrer_ids:
+        for referrer_id, username in (
+            session.query(User.referrer_id, User.username).filter(User.referrer_id.in_(referrer_ids)).order_by(User.id)
+        ):
+            invited[referrer_id].append(username)
+    return invited
@@ -0,0 +1,105 @@
+# room_manager.py
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import ROOM_SHARDS, ROOM_SHARD
+from game_clock import clock
+from game_logic import BingoGame
+from metrics import Family
+
+# Request threads reach a room only through here. Each room has its own lock (the game
+# clock takes the same one for auto calls), so rooms never wait on each other, and
+# status polls read the room's last snapshot without locking at all.
+#
+# Rooms are split across processes by game ID: with ROOM_SHARDS = N, process k (ROOM_SHARD)
+# owns the rooms whose (game_id - 1) % N == k, and the load balancer sends /game/<id>/...
+# there. A room asked of the wrong process answers 421 with X-Game-Shard instead of
+# being loaded twice. A process built with own_rooms=False (the stream tier) holds no
+# rooms at all: it reads snapshots from the database and answers 421 for everything else.
+
+class WrongShard(Exception):
+    def __init__(self, game_id: int):
+        super().__init__(f"Game {game_id} belongs to shard {shard_of(game_id)}")
+        self.game_id = game_id
+        self.shard = shard_of(game_id)
+
+def shard_of(game_id: int) -> int:
+    return (int(game_id) - 1) % ROOM_SHARDS
+
+def owns(game_id: int) -> bool:
+    return shard_of(game_id) == ROOM_SHARD
+
+class RoomManager:
+    def __init__(self, store, own_rooms: bool = True):
+        self.store = store
+        self.own_rooms = own_rooms
+
+    def create(self, entry_price: int = 10) -> BingoGame:
+        return self.store.create(entry_price)
+
+    @contextmanager
+    def room(self, game_id: int) -> Iterator[Optional[BingoGame]]:
+        """
+        with rooms.room(game_id) as game: ...  holds the room's lock for the block and
+        refreshes its snapshot afterwards. game is None if the room doesn't exist.
+        """
+        if not (self.own_rooms and owns(game_id)):
+            raise WrongShard(game_id)
+        game = self.store.get(game_id)
+        if game is None:
+            yield None
+            return
+        with game.lock:
+            try:
+                yield game
+            finally:
+                game.refresh_snapshot()
+
+    def snapshot(self, game_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Status, pool, players, calls and winners as of the last change, read without a lock.
+        """
+        if not self.own_rooms:
+            return self.store.peek(game_id)
+        # The owner's room is the room: every change to it is made here, under its lock
+        game = self.store.games.get(game_id) if owns(game_id) else None
+        if game is not None:
+            return game.snapshot
+        with self.room(game_id) as game:
+            return game.snapshot if game else None
+
+    def metrics(self) -> List[Family]:
+        """
+        Gauges for /metrics from the rooms this process holds, read from snapshots.
+        Call lag is how far past call_interval a room's next call is overdue.
+        """
+        now = datetime.utcnow()
+        statuses = Counter()
+        players, pool, lag = [], [], []
+        for game in list(self.store.games.values()):
+            snapshot = game.snapshot
+            statuses[snapshot["status"]] += 1
+            if snapshot["status"] not in ("waiting", "active"):
+                continue
+            labels = {"game_id": snapshot["game_id"]}
+            players.append((labels, snapshot["players"]))
+            pool.append((labels, snapshot["pool"]))
+            if snapshot["status"] == "active" and game.last_call_time:
+                behind = (now - game.last_call_time).total_seconds() - game.call_interval
+                lag.append((labels, max(0.0, behind)))
+        overdue, latest = clock.overdue()
+        return [
+            Family("game_rooms", "gauge", "Rooms held by this process, by status.",
+                   [({"status": s}, n) for s, n in sorted(statuses.items())]),
+            Family("game_room_players", "gauge", "Boards in an open room.", players),
+            Family("game_room_pool_birr", "gauge", "Prize pool of an open room.", pool),
+            Family("game_room_call_lag_seconds", "gauge", "Time an active room's next call is overdue.", lag),
+            Family("game_clock_scheduled_rooms", "gauge", "Rooms with auto calls on the game clock.",
+                   [({}, clock.backlog())]),
+            Family("game_clock_overdue_rooms", "gauge", "Rooms whose auto call is past due (timer backlog).",
+                   [({}, overdue)]),
+            Family("game_clock_max_lateness_seconds", "gauge", "How late the most overdue auto call is.",
+                   [({}, latest)]),
+        ]
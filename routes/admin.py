@@ -1,25 +1,42 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session
+from flask import Blueprint, render_template, request, redirect, url_for, session, jsonify
+from sqlalchemy.exc import IntegrityError
 from models import db, Transaction, User, Game
-from telegram import Bot
-from utils.notify_user import notify_user
-import os
-import asyncio
+import leaderboards
+import referral_stats
+import wallet
+import transaction_queries
+import outbox
+import transaction_review
+import reconciliation
+import app as game_api
+from room_manager import WrongShard
 
 admin_bp = Blueprint("admin", __name__)
-bot = Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"))
 
 # -------------------- DASHBOARD --------------------
 
 @admin_bp.route("/admin/dashboard")
 def admin_dashboard():
-    pending_withdrawals = Transaction.query.filter_by(type="withdraw", status="pending").all()
-    pending_deposits = Transaction.query.filter_by(type="deposit", status="pending").all()
+    # Each pending list pages on its own cursor; the links carry the other list's along
+    withdrawals_cursor = request.args.get("withdrawals_cursor")
+    deposits_cursor = request.args.get("deposits_cursor")
+    try:
+        pending_withdrawals, next_withdrawals = transaction_queries.query(
+            db.session, types="withdraw", status="pending", oldest_first=True, cursor=withdrawals_cursor)
+        pending_deposits, next_deposits = transaction_queries.query(
+            db.session, types="deposit", status="pending", oldest_first=True, cursor=deposits_cursor)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
     games = Game.query.order_by(Game.created_at.desc()).limit(10).all()
     players = User.query.order_by(User.created_at.desc()).limit(10).all()
     return render_template(
         "admin_dashboard.html",
         pending_withdrawals=pending_withdrawals,
         pending_deposits=pending_deposits,
+        withdrawals_cursor=withdrawals_cursor,
+        deposits_cursor=deposits_cursor,
+        next_withdrawals=next_withdrawals,
+        next_deposits=next_deposits,
         games=games,
         players=players
     )
@@ -38,14 +55,14 @@ def approve_withdrawal():
     user = User.query.get(user_id)
     admin = User.query.get(admin_id)
 
-    if tx and tx.status == "pending":
+    if tx and tx.status == "pending" and wallet.debit(
+            db.session, user.id, amount, "withdraw", reference=f"tx:{tx.id}", transaction_id=tx.id):
         tx.status = "approved"
         tx.completed_at = db.func.now()
         tx.approved_by = admin.telegram_id if admin else "unknown"
         tx.approval_note = note
-        user.balance -= amount
+        outbox.enqueue(db.session, user.telegram_id, f"✅ Your withdrawal of {amount} birr has been approved.")
         db.session.commit()
-        asyncio.run(notify_user(bot, user.telegram_id, f"✅ Your withdrawal of {amount} birr has been approved."))
 
     return redirect(url_for("admin.admin_dashboard"))
 
@@ -60,30 +77,81 @@ def approve_deposit():
     tx = Transaction.query.get(tx_id)
     user = User.query.get(user_id)
 
-    if tx and tx.status == "pending":
+    if tx and tx.status == "pending" and wallet.credit(
+            db.session, user.id, amount, "deposit", reference=f"tx:{tx.id}", transaction_id=tx.id):
         tx.status = "approved"
         tx.completed_at = db.func.now()
-        user.balance += amount
-        db.session.commit()
 
         message = (
             f"💰 Deposit confirmed!\n"
             f"Your balance is now {user.balance} birr.\n\n"
             f"እባኮትን የተሰጠውን ቀሪ ገንዘብ በተጫወት ለመጠቀም ዝግጁ ይሁኑ።"
         )
-        asyncio.run(notify_user(bot, user.telegram_id, message))
+        outbox.enqueue(db.session, user.telegram_id, message)
+        db.session.commit()
 
     return redirect(url_for("admin.admin_dashboard"))
 
+# -------------------- BULK REVIEW --------------------
+
+def _bulk(action):
+    payload = request.get_json(silent=True) or {}
+    admin = User.query.get(session.get("admin_id"))
+    by = str(admin.telegram_id) if admin else "unknown"
+    try:
+        ids = transaction_review.ids_from_payload(db.session, payload)
+        if action == "approve":
+            results = transaction_review.approve_many(db.session, ids, by, payload.get("note", ""),
+                                                      transaction_review.amounts_from_payload(payload))
+        else:
+            results = transaction_review.reject_many(db.session, ids, by, payload.get("reason") or "No reason provided")
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except IntegrityError:
+        # Another admin approved some of these at the same time; nothing from this batch was applied
+        db.session.rollback()
+        return jsonify({"error": "Batch conflicted with another approval, please retry"}), 409
+    return jsonify({"results": results})
+
+@admin_bp.route("/admin/bulk/approve", methods=["POST"])
+def bulk_approve():
+    return _bulk("approve")
+
+@admin_bp.route("/admin/bulk/reject", methods=["POST"])
+def bulk_reject():
+    return _bulk("reject")
+
+# -------------------- RECONCILIATION REVIEW --------------------
+
+@admin_bp.route("/admin/reconciliation/review")
+def reconciliation_review():
+    return jsonify(reconciliation.review_queue(db.session, request.args.get("limit", 50, type=int)))
+
+@admin_bp.route("/admin/reconciliation/resolve", methods=["POST"])
+def reconciliation_resolve():
+    # {"event_id": 12, "tx_id": 345} matches the receipt to that deposit; {"event_id": 12} dismisses it
+    payload = request.get_json(silent=True) or {}
+    if not reconciliation.resolve(db.session, int(payload.get("event_id", 0)), payload.get("tx_id")):
+        db.session.rollback()
+        return jsonify({"error": "Receipt or deposit is no longer open"}), 409
+    db.session.commit()
+    return jsonify({"status": "resolved"})
+
 # -------------------- START GAME --------------------
 
 @admin_bp.route("/start_game", methods=["POST"])
 def start_game():
-    game_id = request.form.get("game_id")
-    game = Game.query.get(game_id)
-    if game and game.status == "waiting":
-        game.status = "active"
-        db.session.commit()
+    # Through the room, so the first call is made and the game clock takes over
+    game_id = request.form.get("game_id", type=int)
+    if game_id is not None:
+        try:
+            with game_api.rooms.room(game_id) as game:
+                if game:
+                    game.start_game()
+        except WrongShard as e:
+            return jsonify({"error": str(e), "shard": e.shard}), 421
     return redirect(url_for("admin.admin_dashboard"))
 
 # -------------------- LOGOUT --------------------
@@ -114,7 +182,9 @@ def require_admin_login():
         "/start_game",
         "/admin/leaderboard",
         "/admin/referrals",
-        "/admin/audit"
+        "/admin/audit",
+        "/admin/bulk",
+        "/admin/reconciliation"
     ]
     if request.path.startswith(tuple(protected_paths)):
         if "admin_id" not in session:
@@ -124,32 +194,36 @@ def require_admin_login():
 
 @admin_bp.route("/admin/leaderboard")
 def leaderboard():
-    top_winners = User.query.order_by(User.games_won.desc()).limit(10).all()
-    most_active = User.query.order_by(User.games_played.desc()).limit(10).all()
-    richest = User.query.order_by(User.balance.desc()).limit(10).all()
+    top_winners = leaderboards.top(db.session, "wins", 10)
+    most_active = leaderboards.top(db.session, "played", 10)
+    richest = leaderboards.top(db.session, "balance", 10)
+    db.session.commit()
     return render_template("leaderboard.html", top_winners=top_winners, most_active=most_active, richest=richest)
 
+@admin_bp.route("/admin/leaderboard/rebuild", methods=["POST"])
+def rebuild_leaderboards():
+    # Recomputes every global leaderboard from user / transaction, e.g. after a manual data fix
+    counts = leaderboards.rebuild(db.session)
+    db.session.commit()
+    return jsonify({"rebuilt": counts})
+
 # -------------------- REFERRAL LEADERBOARD --------------------
 
 @admin_bp.route("/admin/referrals")
 def referral_leaderboard():
-    top_referrers = (
-        User.query
-        .filter(User.referred_users.any())
-        .order_by(db.func.count(User.referred_users).desc())
-        .limit(10)
-        .all()
-    )
-
-    referral_data = []
-    for user in top_referrers:
-        invited = [u.username for u in user.referred_users]
-        referral_data.append({
-            "username": user.username,
-            "count": len(invited),
-            "bonus": len(invited) * 5,
-            "invited": invited
-        })
+    top_referrers = referral_stats.top_referrers(db.session, 10, by="referrals")
+    invited = referral_stats.invited_usernames(db.session, [row[0] for row in top_referrers])
+    db.session.commit()
+
+    referral_data = [
+        {
+            "username": username,
+            "count": referrals,
+            "bonus": bonus,
+            "invited": invited[user_id]
+        }
+        for user_id, username, referrals, _, bonus in top_referrers
+    ]
 
     return render_template("referral_leaderboard.html", referral_data=referral_data)
 
@@ -157,8 +231,14 @@ def referral_leaderboard():
 
 @admin_bp.route("/admin/audit")
 def audit_trail():
-    approved_tx = Transaction.query.filter_by(type="withdraw", status="approved").order_by(Transaction.completed_at.desc()).limit(50).all()
-    return render_template("audit_trail.html", approved_tx=approved_tx)
+    approved_tx, cursor = transaction_queries.query(
+        db.session,
+        types="withdraw",
+        status="approved",
+        sort="completed_at",
+        cursor=request.args.get("cursor")
+    )
+    return render_template("audit_trail.html", approved_tx=approved_tx, next_cursor=cursor)
 
 # -------------------- ONE-TIME ADMIN SETUP --------------------
 
@@ -0,0 +1,26 @@
+import random
+from flask import Blueprint, request, jsonify, render_template
+from models import db, User
+
+# Pages the bot's WebApp buttons open
+cartela_bp = Blueprint("cartela", __name__)
+
+@cartela_bp.route("/cartela", methods=["GET", "POST"])
+def cartela():
+    telegram_id = request.args.get("id")
+    user = User.query.filter_by(telegram_id=telegram_id).first()
+    if request.method == "GET":
+        return jsonify({
+            "cartela": user.cartela,
+            "bonus": [random.randint(1, 90) for _ in range(5)],
+            "winner": str(user.telegram_id) if user.games_won > 0 else None
+        })
+    else:
+        new_cartela = request.json.get("cartela")
+        user.cartela = new_cartela
+        db.session.commit()
+        return jsonify({"status": "updated"})
+
+@cartela_bp.route("/cartela-editor")
+def cartela_editor():
+    return render_template("cartela.html", game_id="12345", entry_price=10, player_count=5, pool=50, sound_enabled=True, play_mode="jackpot")
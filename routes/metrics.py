@@ -0,0 +1,43 @@
+import hmac
+from flask import Blueprint, Response, request, jsonify
+from config import METRICS_TOKEN
+import metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+# Scraped by Prometheus (or read with curl). With METRICS_TOKEN set, every route here
+# wants "Authorization: Bearer <token>"; the profiler can only be switched at runtime then.
+
+@metrics_bp.before_request
+def require_token():
+    if METRICS_TOKEN:
+        given = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(given, METRICS_TOKEN):
+            return jsonify({"error": "invalid token"}), 401
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@metrics_bp.route("/metrics/profile", methods=["GET"])
+def profile():
+    # Collapsed stacks ("a;b;c count"), for flamegraph.pl or speedscope
+    return Response(metrics.profiler.collapsed(), mimetype="text/plain")
+
+@metrics_bp.route("/metrics/profiler", methods=["POST"])
+def toggle_profiler():
+    # {"enabled": true, "interval": 0.01, "reset": true}
+    if not METRICS_TOKEN:
+        return jsonify({"error": "set METRICS_TOKEN to switch the profiler at runtime (or start with PROFILER=1)"}), 403
+    data = request.get_json(silent=True) or {}
+    if data.get("reset"):
+        metrics.profiler.reset()
+    if data.get("enabled"):
+        metrics.profiler.start(float(data.get("interval", metrics.profiler.interval)))
+    elif "enabled" in data:
+        metrics.profiler.stop()
+    return jsonify({
+        "running": metrics.profiler.running,
+        "interval": metrics.profiler.interval,
+        "samples": metrics.profiler.samples
+    })
@@ -1,27 +1,77 @@
+import hmac
 from flask import Blueprint, request, jsonify
-from models import User, Transaction
+from config import SMS_WEBHOOK_SECRET
 from database import db
+import payment_inbox
+import reconciliation
 
 payment_bp = Blueprint("payment", __name__)
 
-@payment_bp.route("/chapa/webhook", methods=["POST"])
-def chapa_webhook():
-    data = request.json
-    tx_ref = data.get("tx_ref")
-    telegram_id = data.get("custom_data", {}).get("telegram_id")
-    amount = float(data.get("amount"))
-
-    user = User.query.filter_by(telegram_id=telegram_id).first()
-    if user:
-        user.balance += amount
-        db.session.add(Transaction(
-            user_id=user.id,
-            type="deposit",
-            amount=amount,
-            status="approved",
-            reference=tx_ref,
-            method="chapa"
-        ))
-        db.session.commit()
-        return jsonify({"status": "success"})
-    return jsonify({"status": "user_not_found"})
+# The inbox worker credits recorded events in the background of whichever app serves these routes
+@payment_bp.record_once
+def _start_inbox_worker(state):
+    if state.app.config.get("START_WORKERS", True):
+        payment_inbox.start_worker(state.app, jobs=(payment_inbox.process_batch, reconciliation.reconcile_batch))
+
+@payment_bp.route("/<provider>/webhook", methods=["POST"])
+def payment_webhook(provider):
+    # Only verify and record here; crediting happens in payment_inbox.InboxWorker
+    spec = payment_inbox.PROVIDERS.get(provider)
+    if spec is None:
+        return jsonify({"status": "unknown_provider"}), 404
+    # Events turn into balance, so a provider only has a webhook once its secret is configured
+    if not spec.secret:
+        return jsonify({"status": "disabled"}), 404
+
+    raw = request.get_data(cache=False)
+    if not payment_inbox.verify(spec, raw, request.headers):
+        return jsonify({"status": "invalid_signature"}), 401
+    try:
+        event = payment_inbox.parse(spec, raw)
+    except payment_inbox.InvalidEvent as e:
+        return jsonify({"status": "invalid", "error": str(e)}), 400
+    if event is None:
+        return jsonify({"status": "ignored"})
+
+    if not payment_inbox.record(db.session, provider, raw, event):
+        db.session.rollback()
+        return jsonify({"status": "duplicate"})
+    db.session.commit()
+    payment_inbox.wake_worker()
+    return jsonify({"status": "accepted"})
+
+# -------------------- SMS RECEIPTS (Tasker) --------------------
+
+def _sms_receipt():
+    # Receipts turn into balance, so these routes only exist once a secret is configured
+    if not SMS_WEBHOOK_SECRET:
+        return None, (jsonify({"status": "disabled"}), 404)
+    if not hmac.compare_digest(request.headers.get("X-Webhook-Secret", ""), SMS_WEBHOOK_SECRET):
+        return None, (jsonify({"status": "invalid_secret"}), 401)
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return None, (jsonify({"status": "invalid", "error": "body must be a JSON object"}), 400)
+    try:
+        return reconciliation.parse_payload(body), None
+    except payment_inbox.InvalidEvent as e:
+        return None, (jsonify({"status": "invalid", "error": str(e)}), 400)
+
+@payment_bp.route("/webhook/test", methods=["POST"])
+def sms_webhook_test():
+    receipt, error = _sms_receipt()
+    if error:
+        return error
+    return jsonify({"status": "valid", "parsed": receipt.__dict__})
+
+@payment_bp.route("/webhook/deposit", methods=["POST"])
+def sms_webhook_deposit():
+    # Recorded as an unmatched receipt; reconciliation pairs it with the user's deposit claim
+    receipt, error = _sms_receipt()
+    if error:
+        return error
+    if not reconciliation.record_receipt(db.session, request.get_data(), receipt, request.json.get("sms")):
+        db.session.rollback()
+        return jsonify({"status": "duplicate"})
+    db.session.commit()
+    payment_inbox.wake_worker()
+    return jsonify({"status": "accepted"})
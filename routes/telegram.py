@@ -0,0 +1,34 @@
+import hmac
+from flask import Blueprint, request, jsonify
+from config import BOT_MODE, TELEGRAM_WEBHOOK_SECRET
+from database import db
+import bot_db
+import telegram_intake
+
+telegram_bp = Blueprint("telegram", __name__)
+
+# Handlers run in this process in webhook mode, on the same database as the web app
+@telegram_bp.record_once
+def _configure_bot_db(state):
+    bot_db.configure(state.app.config["SQLALCHEMY_DATABASE_URI"])
+
+@telegram_bp.route("/webhook", methods=["POST"])
+def telegram_webhook():
+    # Only check and record here; some worker's telegram_intake handles it after we answer.
+    # Admin commands trust the sender's user id, so without a secret nothing is accepted
+    if BOT_MODE != "webhook" or not TELEGRAM_WEBHOOK_SECRET:
+        return jsonify({"status": "disabled"}), 404
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, TELEGRAM_WEBHOOK_SECRET):
+        return jsonify({"status": "invalid_secret"}), 401
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict) or not isinstance(update.get("update_id"), int):
+        return jsonify({"status": "invalid"}), 400
+
+    intake = telegram_intake.get_intake()
+    if not telegram_intake.record(db.session, update):
+        db.session.rollback()
+        return jsonify({"status": "duplicate"})
+    db.session.commit()
+    intake.wake()
+    return jsonify({"status": "accepted"})
@@ -1,15 +1,16 @@
 import requests
 import os
 
-# Load bot token and webhook URL from environment variables
+# Load bot token, webhook URL and secret from environment variables
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-WEBHOOK_URL = os.getenv("WEBAPP_URL", "https://arada-bingo-dv-oxct.onrender.com/webhook")
+WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "https://arada-bingo-dv-oxct.onrender.com/webhook")
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")  # sent back in X-Telegram-Bot-Api-Secret-Token
 
-# Set the webhook
-response = requests.post(
-    f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook",
-    data={"url": WEBHOOK_URL}
-)
+# Set the webhook (served by the web app's /webhook when BOT_MODE=webhook)
+data = {"url": WEBHOOK_URL, "max_connections": os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")}
+if WEBHOOK_SECRET:
+    data["secret_token"] = WEBHOOK_SECRET
+response = requests.post(f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook", data=data)
 
 # Print the result
 print("Webhook setup response:")
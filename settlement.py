@@ -0,0 +1,109 @@
+# settlement.py
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import User, Game, GameParticipant
+from game_logic import BingoGame
+import leaderboards
+import referral_stats
+import wallet
+
+# Writes a finished game back in one transaction with a fixed number of statements,
+# whatever the player count: claim the game row, insert missing participants, one
+# batched wallet pass for the payouts, one executemany for the user counters. Stakes
+# are not taken here: the store debits each board's entry price when the player joins
+# (SqlGameStore.take_stake), refusing the join if the balance is short, so no balance
+# goes below zero. A game that ends without a winner (all numbers called, or finished
+# from the admin panel) gives every board its stake back instead of paying out.
+
+_users = User.__table__
+
+def settle(session: Session, game: BingoGame) -> bool:
+    """
+    Persists a finished game: the game row (pool, winner, payout, commission), every
+    participant, the winners' credit (or each board's refund when nobody won) and
+    games_played / games_won. Keyed by game ID:
+    returns False without touching anything if the game was already settled, so a
+    retry after a crash never pays twice. The caller commits.
+    """
+    now = datetime.utcnow()
+    values = dict(
+        status=game.status,
+        pool=game.pool,
+        winner_id=game.winner_id,
+        payout=game.payout,
+        commission=game.admin_earnings,
+        finished_at=game.finished_at or now,
+        settled_at=now,
+    )
+    claimed = session.execute(
+        update(Game).where(Game.id == game.game_id, Game.settled_at.is_(None)).values(**values)
+    ).rowcount
+    if not claimed:
+        if session.execute(select(Game.id).where(Game.id == game.game_id)).first() is not None:
+            return False
+        # Rooms kept only in memory have no row yet
+        session.execute(insert(Game).values(
+            id=game.game_id,
+            entry_price=game.entry_price,
+            called_numbers=list(game.called_numbers),
+            created_at=game.created_at,
+            **values
+        ))
+
+    _insert_participants(session, game)
+
+    user_ids = list(game.players)
+    if not user_ids:
+        return True
+
+    if game.winner_ids:
+        wallet.apply_many(session, [
+            wallet.Entry(uid, game.payout, "payout", f"game:{game.game_id}:{uid}") for uid in game.winner_ids
+        ])
+    else:
+        # Same reference as the stake it returns, so a board is never refunded twice
+        wallet.apply_many(session, [
+            wallet.Entry(uid, game.entry_price, "refund", f"game:{game.game_id}:{b['cartela_number']}")
+            for uid, boards in game.players.items()
+            for b in boards
+        ])
+
+    first_timers = session.execute(
+        select(User.referrer_id).where(
+            User.id.in_(user_ids),
+            User.referrer_id.isnot(None),
+            (User.games_played == 0) | User.games_played.is_(None),
+        )
+    ).scalars().all()
+
+    winners = set(game.winner_ids)
+    session.execute(
+        update(_users)
+        .where(_users.c.id == bindparam("uid"))
+        .values(
+            games_played=func.coalesce(_users.c.games_played, 0) + 1,
+            games_won=func.coalesce(_users.c.games_won, 0) + bindparam("won"),
+        ),
+        [{"uid": uid, "won": int(uid in winners)} for uid in user_ids]
+    )
+    for referrer_id, count in Counter(first_timers).items():
+        referral_stats.record_first_game(session, referrer_id, count)
+    leaderboards.touch(session, user_ids, ("wins", "played"))
+    return True
+
+def _insert_participants(session: Session, game: BingoGame):
+    stored = set(session.execute(
+        select(GameParticipant.cartela_number).where(GameParticipant.game_id == game.game_id)
+    ).scalars())
+    rows = [
+        {"game_id": game.game_id, "user_id": uid, "cartela_number": b["cartela_number"], "marked_numbers": []}
+        for uid, boards in game.players.items()
+        for b in boards
+        if b["cartela_number"] not in stored
+    ]
+    if rows:
+        session.execute(insert(GameParticipant), rows)
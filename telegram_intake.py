@@ -0,0 +1,244 @@
+# telegram_intake.py
+import asyncio
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import and_, delete, exists, func, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from config import WEBHOOK_HANDLERS, WEBHOOK_LEASE_SECONDS
+from models import TelegramUpdate
+import bot_db
+
+# Webhook mode: Telegram POSTs each update to the web app, which only checks the secret,
+# writes the update to the telegram_update inbox and answers 200. Every web worker runs
+# the bot's Application on a private event loop and takes updates from the shared inbox,
+# so any number of web processes can accept webhooks. A worker takes only the oldest
+# open update of a chat that no other worker is handling, and holds that chat under a
+# lease until it is done, so a chat's messages are handled one at a time and in the order
+# they came whichever process received them. Redeliveries stop at the update_id key.
+
+POLL_SECONDS = 1.0          # an idle worker checks for updates other workers received this often
+KEEP_DONE = timedelta(days=1)
+
+# -------------------- INBOX --------------------
+
+_updates = TelegramUpdate.__table__
+
+def lane_of(data: Dict[str, Any]) -> int:
+    """
+    The chat an update belongs to (else its sender), from the raw JSON; updates with
+    neither get a lane of their own.
+    """
+    for body in data.values():
+        if isinstance(body, dict):
+            chat = body.get("chat") or (body.get("message") or {}).get("chat")
+            if chat:
+                return int(chat["id"])
+            user = body.get("from") or body.get("user")
+            if user:
+                return int(user["id"])
+    return -int(data["update_id"])
+
+def record(session: Session, data: Dict[str, Any]) -> bool:
+    """
+    Queues an update. Returns False if its update_id was already recorded. The caller commits.
+    """
+    values = dict(
+        update_id=data["update_id"],
+        lane=lane_of(data),
+        payload=json.dumps(data),
+        status="queued",
+        received_at=datetime.utcnow(),
+    )
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        module = postgresql if dialect == "postgresql" else sqlite
+        stmt = module.insert(TelegramUpdate).values(**values).on_conflict_do_nothing(index_elements=["update_id"])
+        return session.execute(stmt).rowcount == 1
+    savepoint = session.begin_nested()
+    try:
+        session.execute(insert(TelegramUpdate).values(**values))
+        savepoint.commit()
+        return True
+    except IntegrityError:
+        savepoint.rollback()
+        return False
+
+def claim(session: Session, lease: float = WEBHOOK_LEASE_SECONDS) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """
+    Takes the oldest open update of a lane nobody holds and leases it to the caller.
+    Returns (update_id, update) or None when there is nothing to take.
+    """
+    now = datetime.utcnow()
+    held = aliased(TelegramUpdate)
+    takeable = or_(_updates.c.status == "queued",
+                   and_(_updates.c.status == "handling", _updates.c.lease_until <= now))
+    busy_lanes = select(held.lane).where(held.status == "handling", held.lease_until > now)
+    heads = session.execute(
+        select(_updates.c.lane, func.min(_updates.c.update_id))
+        .where(takeable, _updates.c.lane.not_in(busy_lanes))
+        .group_by(_updates.c.lane)
+        .order_by(func.min(_updates.c.update_id))
+        .limit(10)
+    ).all()
+    for lane, update_id in heads:
+        # Another worker may have taken this lane since the read; the row only moves if not
+        taken = session.execute(
+            update(_updates)
+            .where(_updates.c.update_id == update_id, takeable,
+                   ~exists().where(held.lane == lane, held.status == "handling", held.lease_until > now))
+            .values(status="handling", lease_until=now + timedelta(seconds=lease))
+        ).rowcount
+        if taken:
+            payload = session.execute(select(_updates.c.payload).where(_updates.c.update_id == update_id)).scalar()
+            return update_id, json.loads(payload)
+    return None
+
+def finish(session: Session, update_id: int):
+    session.execute(
+        update(_updates).where(_updates.c.update_id == update_id)
+        .values(status="done", lease_until=None, processed_at=datetime.utcnow())
+    )
+
+def prune(session: Session) -> int:
+    # Done updates are kept a day, long enough to recognise Telegram's redeliveries
+    return session.execute(
+        delete(_updates).where(_updates.c.status == "done", _updates.c.processed_at < datetime.utcnow() - KEEP_DONE)
+    ).rowcount
+
+# -------------------- HANDLERS --------------------
+
+class WebhookIntake:
+    """
+    Owns this worker's Application and its event loop thread. One dispatcher task claims
+    updates from the inbox while fewer than `workers` are being handled; wake() is called
+    from request threads after recording an update so it is picked up at once.
+    """
+
+    def __init__(self, build_application: Callable[[], Any], workers: int = WEBHOOK_HANDLERS,
+                 lease: float = WEBHOOK_LEASE_SECONDS):
+        self.build_application = build_application
+        self.workers = workers
+        self.lease = lease
+        self.application = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pruned_at = 0.0
+
+    def start(self):
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), name="telegram-intake", daemon=True).start()
+        ready.wait()
+
+    def _run(self, ready: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._startup())
+        except Exception as e:
+            logging.error(f"Telegram webhook intake failed to start: {e}")
+            return
+        finally:
+            ready.set()
+        self._loop.run_forever()
+
+    async def _startup(self):
+        self.application = self.build_application()
+        await self.application.initialize()
+        await self.application.start()
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.workers)
+        asyncio.create_task(self._dispatch())
+        logging.info(f"📥 Telegram webhook intake ready ({self.workers} handlers)")
+
+    @property
+    def running(self) -> bool:
+        return self._slots is not None
+
+    def wake(self):
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _dispatch(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                claimed = await bot_db.run(claim, self.lease)
+            except Exception as e:
+                logging.error(f"Telegram inbox claim failed: {e}")
+                claimed = None
+            if claimed is None:
+                self._slots.release()
+                await self._idle()
+                continue
+            asyncio.create_task(self._handle_claimed(*claimed))
+
+    async def _idle(self):
+        if time.monotonic() - self._pruned_at > 3600:
+            self._pruned_at = time.monotonic()
+            try:
+                await bot_db.run(prune)
+            except Exception as e:
+                logging.error(f"Telegram inbox prune failed: {e}")
+        try:
+            await asyncio.wait_for(self._wake.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _handle_claimed(self, update_id: int, data: Dict[str, Any]):
+        from telegram import Update
+
+        try:
+            await self._handle(Update.de_json(data, self.application.bot))
+        except Exception as e:
+            logging.error(f"Update handler failed for update {update_id}: {e}")
+        finally:
+            try:
+                await bot_db.run(finish, update_id)
+            except Exception as e:
+                logging.error(f"Could not mark update {update_id} done: {e}")
+            self._slots.release()
+            self._wake.set()                # the chat's next update can be taken now
+
+    async def _handle(self, update):
+        # chat_data is reloaded and saved around every update, so whichever worker gets
+        # a chat's next message continues the same conversation
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        if chat_id is None:
+            await self.application.process_update(update)
+            return
+        state = await bot_db.load_chat_state(chat_id)
+        chat_data = self.application.chat_data[chat_id]
+        chat_data.clear()
+        chat_data.update(state)
+        await self.application.process_update(update)
+        if dict(chat_data) != state:
+            await bot_db.save_chat_state(chat_id, dict(chat_data))
+
+_intake: Optional[WebhookIntake] = None
+_lock = threading.Lock()
+
+def get_intake() -> WebhookIntake:
+    """
+    The worker's intake, started on the first webhook request so web workers that
+    never receive an update never import telegram or call getMe.
+    """
+    global _intake
+    if _intake is None:
+        with _lock:
+            if _intake is None:
+                from bot import build_application
+                intake = WebhookIntake(build_application)
+                intake.start()
+                if not intake.running:
+                    raise RuntimeError("Telegram application failed to start")
+                _intake = intake
+    return _intake
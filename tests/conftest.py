@@ -0,0 +1,49 @@
+# tests/conftest.py
+import os
+
+import pytest
+
+# Read by config at import time
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:test")
+os.environ.setdefault("GAME_STORE", "sql")
+
+from app_factory import create_app
+from database import db
+from models import User
+import migrations
+import wallet
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    The web app on a throwaway SQLite file, migrated, with its app context pushed.
+    """
+    app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}", "START_WORKERS": False})
+    with app.app_context():
+        migrations.migrate()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def session(app):
+    return db.session
+
+@pytest.fixture
+def make_user(session):
+    """
+    make_user(balance) -> users.id, the balance credited as a deposit.
+    """
+    made = []
+
+    def make(balance: float = 0) -> int:
+        user = User(telegram_id=str(1000 + len(made)), username=f"player{len(made)}")
+        session.add(user)
+        session.commit()
+        if balance:
+            assert wallet.credit(session, user.id, balance, "deposit", f"seed:{user.id}")
+            session.commit()
+        made.append(user.id)
+        return user.id
+
+    return make
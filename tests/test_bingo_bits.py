@@ -0,0 +1,75 @@
+# tests/test_bingo_bits.py
+import random
+
+import pytest
+
+from bingo_bits import FREE_CELL, BitBoardEngine, cell_index, marked_numbers, winning_pattern
+import cartela_catalog
+
+def old_check_winner(board, marked):
+    # BingoGame.check_winner before the bitmask engine, for one board
+    for i in range(0, 25, 5):
+        if all(board[i + j] in marked for j in range(5)):
+            return True, "Winner - Row complete!"
+    for i in range(5):
+        if all(board[i + j * 5] in marked for j in range(5)):
+            return True, "Winner - Column complete!"
+    if all(board[i] in marked for i in [0, 6, 12, 18, 24]):
+        return True, "Winner - Diagonal complete!"
+    if all(board[i] in marked for i in [4, 8, 12, 16, 20]):
+        return True, "Winner - Diagonal complete!"
+    if all(board[i] in marked for i in [0, 4, 20, 24]):
+        return True, "Winner - Corner complete!"
+    return False, "Keep playing"
+
+@pytest.mark.parametrize("seed", range(200))
+def test_engine_agrees_with_the_old_checker(seed):
+    rng = random.Random(seed)
+    board = cartela_catalog.get_cartela(rng.randint(1, 100))
+    calls = list(range(1, 76))
+    rng.shuffle(calls)
+
+    engine = BitBoardEngine()
+    board_id = engine.add_board(7, board)
+    cells = cell_index(board)
+    marked = {board[FREE_CELL]}         # the old boards started with the free space daubed
+    for number in calls:
+        if number not in cells:
+            continue
+        marked.add(number)
+        engine.mark(board_id, cells[number])
+        win, message, _ = engine.result([board_id])
+        assert (win, message) == old_check_winner(board, marked)
+        if win:
+            return
+    pytest.fail("every number was called without a win")
+
+def test_only_the_first_pattern_is_kept():
+    board = cartela_catalog.get_cartela(1)
+    engine = BitBoardEngine()
+    board_id = engine.add_board(7, board)
+    for cell in (0, 4, 20, 24):                 # corners first
+        engine.mark(board_id, cell)
+    for cell in (1, 2, 3):                      # then the top row through two of them
+        engine.mark(board_id, cell)
+    assert engine.result([board_id]) == (True, "Winner - Corner complete!", "corner")
+    assert winning_pattern(engine.masks[board_id]) == "row"
+
+def test_marking_twice_changes_nothing():
+    board = cartela_catalog.get_cartela(5)
+    engine = BitBoardEngine()
+    board_id = engine.add_board(7, board)
+    assert engine.mark(board_id, 0) is None
+    mask = engine.masks[board_id]
+    assert engine.mark(board_id, 0) is None
+    assert engine.masks[board_id] == mask
+    assert marked_numbers(board, mask) == sorted([board[0], board[FREE_CELL]])
+
+def test_a_call_reaches_only_the_boards_holding_it():
+    engine = BitBoardEngine()
+    boards = [cartela_catalog.get_cartela(n) for n in (1, 2, 3)]
+    for owner, board in enumerate(boards):
+        engine.add_board(owner, board)
+    for number in range(1, 76):
+        holders = {board_id for board_id, _ in engine.boards_with(number)}
+        assert holders == {i for i, board in enumerate(boards) if number in cell_index(board)}
@@ -0,0 +1,53 @@
+# tests/test_reconciliation.py
+from reconciliation import Claim, ClaimIndex, Receipt
+
+def claim(tx_id, method="telebirr", reference=None, phone=None, amount=100.0):
+    return Claim(tx_id=tx_id, user_id=tx_id, telegram_id=1000 + tx_id, method=method,
+                 reference=reference, phone=phone, amount=amount)
+
+def test_reference_and_amount_match():
+    wanted = claim(1, reference="ABC123XYZ")
+    index = ClaimIndex([wanted, claim(2, reference="OTHER0001")])
+    assert index.match(Receipt("telebirr", "ABC123XYZ", 100.0, None)) == (wanted, None)
+
+def test_reference_without_method_searches_every_method():
+    wanted = claim(1, method="cbe_birr", reference="ABC123XYZ")
+    assert ClaimIndex([wanted]).match(Receipt(None, "ABC123XYZ", 100.0, None)) == (wanted, None)
+
+def test_reference_of_another_method_does_not_match():
+    index = ClaimIndex([claim(1, method="cbe_birr", reference="ABC123XYZ")])
+    assert index.match(Receipt("telebirr", "ABC123XYZ", 100.0, None)) == (None, None)
+
+def test_amount_decides_nothing_on_its_own():
+    index = ClaimIndex([claim(1, reference="ABC123XYZ", amount=150.0)])
+    assert index.match(Receipt("telebirr", "ABC123XYZ", 100.0, None)) == (None, "amount_mismatch")
+
+    index = ClaimIndex([claim(1, reference="ABC123XYZ", amount=0)])
+    assert index.match(Receipt("telebirr", "ABC123XYZ", 100.0, None)) == (None, "amount_unconfirmed")
+
+def test_duplicate_reference_goes_to_review():
+    index = ClaimIndex([claim(1, reference="ABC123XYZ"), claim(2, reference="ABC123XYZ")])
+    assert index.match(Receipt("telebirr", "ABC123XYZ", 100.0, None)) == (None, "duplicate_reference")
+
+def test_phone_match():
+    wanted = claim(1, phone="0911223344")
+    index = ClaimIndex([wanted])
+    assert index.match(Receipt("telebirr", None, 100.0, "0911223344")) == (wanted, None)
+    assert index.match(Receipt("telebirr", None, 90.0, "0911223344")) == (None, "phone_match_only")
+    assert index.match(Receipt("cbe_birr", None, 100.0, "0911223344")) == (None, None)
+
+def test_several_claims_for_one_phone_go_to_review():
+    index = ClaimIndex([claim(1, phone="0911223344"), claim(2, phone="0911223344")])
+    assert index.match(Receipt(None, None, 100.0, "0911223344")) == (None, "several_claims_for_phone")
+
+def test_a_matched_claim_is_taken_once():
+    wanted = claim(1, reference="ABC123XYZ", phone="0911223344")
+    index = ClaimIndex([wanted])
+    found, _ = index.match(Receipt("telebirr", "ABC123XYZ", 100.0, None))
+    index.remove(found)
+    assert index.match(Receipt("telebirr", "ABC123XYZ", 100.0, None)) == (None, None)
+    assert index.match(Receipt("telebirr", None, 100.0, "0911223344")) == (None, None)
+
+def test_unknown_receipt_waits():
+    index = ClaimIndex([claim(1, reference="ABC123XYZ")])
+    assert index.match(Receipt("telebirr", "ZZZ999ZZZ", 100.0, "0900000000")) == (None, None)
@@ -0,0 +1,98 @@
+# tests/test_settlement.py
+import pytest
+from sqlalchemy import func, select
+
+from game_logic import BingoGame
+from models import Game, User, WalletEntry
+import settlement
+import wallet
+
+def active_room(game_id, boards, entry_price=10):
+    # An in-memory room past its first call, one board per (user_id, cartela_number), stakes paid
+    game = BingoGame(game_id=game_id, entry_price=entry_price)
+    for user_id, cartela_number in boards:
+        game.attach_board(user_id, cartela_number)
+        game.pool += entry_price
+    game.status = "active"
+    return game
+
+def pay_stakes(session, game):
+    for user_id, boards in game.players.items():
+        for board in boards:
+            assert wallet.debit(session, user_id, game.entry_price, "stake", f"game:{game.game_id}:{board['cartela_number']}")
+    session.commit()
+
+def counters(session, user_id):
+    user = session.get(User, user_id, populate_existing=True)
+    return user.games_played, user.games_won
+
+def test_settle_pays_once(session, make_user):
+    a, b = make_user(100), make_user(100)
+    game = active_room(1, [(a, 1), (b, 2)])
+    pay_stakes(session, game)
+    game.end_game(a)
+
+    assert settlement.settle(session, game)
+    session.commit()
+    assert not settlement.settle(session, game)
+    session.commit()
+
+    # 20 birr pool, 20% commission
+    assert wallet.balance(session, a) == 106
+    assert wallet.balance(session, b) == 90
+    row = session.get(Game, 1, populate_existing=True)
+    assert (row.status, row.winner_id, row.payout, row.commission) == ("finished", a, 16, 4)
+    assert row.settled_at is not None
+    assert counters(session, a) == (1, 1)
+    assert counters(session, b) == (1, 0)
+
+def test_tied_winners_share_the_payout(session, make_user):
+    a, b, c = make_user(100), make_user(100), make_user(100)
+    game = active_room(2, [(a, 1), (b, 2), (c, 3)])
+    pay_stakes(session, game)
+    game.end_game(a, tied_with=[b])
+
+    assert settlement.settle(session, game)
+    session.commit()
+
+    # 30 birr pool: 6 commission, 12 each, nothing lost to rounding
+    assert game.payout == 12 and game.admin_earnings == 6
+    assert [wallet.balance(session, u) for u in (a, b, c)] == [102, 102, 90]
+
+def test_winnerless_game_refunds_every_board(session, make_user):
+    a, b = make_user(100), make_user(100)
+    game = active_room(3, [(a, 1), (a, 4), (b, 2)])
+    pay_stakes(session, game)
+    assert wallet.balance(session, a) == 80
+    assert game.finish()
+
+    assert settlement.settle(session, game)
+    session.commit()
+    assert not settlement.settle(session, game)
+    session.commit()
+
+    assert wallet.balance(session, a) == 100
+    assert wallet.balance(session, b) == 100
+    refunds = session.execute(select(func.count()).where(WalletEntry.kind == "refund")).scalar()
+    assert refunds == 3
+    row = session.get(Game, 3, populate_existing=True)
+    assert row.winner_id is None and row.payout == 0
+    assert counters(session, a) == (1, 0)
+
+def test_finished_room_refunds_through_the_store(app, session, make_user):
+    import app as game_api
+
+    a, b = make_user(100), make_user(5)
+    game = game_api.rooms.create(10)
+    with game_api.rooms.room(game.game_id) as room:
+        room.min_players = 3            # the joins alone don't start it
+        room.add_player(a, 1)
+        with pytest.raises(wallet.InsufficientFunds):
+            room.add_player(b, 2)
+        room.start_game()
+        assert room.finish()
+
+    assert room.total_players() == 1
+    assert wallet.balance(session, a) == 100
+    assert wallet.balance(session, b) == 5
+    assert session.get(Game, game.game_id, populate_existing=True).settled_at is not None
@@ -0,0 +1,85 @@
+# tests/test_wallet.py
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from models import WalletEntry
+import wallet
+
+def entries(session, kind):
+    return session.execute(select(func.count()).where(WalletEntry.kind == kind)).scalar()
+
+def test_apply_once_per_reference(session, make_user):
+    user = make_user()
+    assert wallet.credit(session, user, 50, "payout", "game:1:1")
+    assert not wallet.credit(session, user, 50, "payout", "game:1:1")
+    session.commit()
+    assert wallet.balance(session, user) == 50
+    assert entries(session, "payout") == 1
+
+def test_reference_is_unique_per_kind(session, make_user):
+    user = make_user(100)
+    assert wallet.debit(session, user, 10, "stake", "game:1:7")
+    assert wallet.credit(session, user, 10, "refund", "game:1:7")
+    session.commit()
+    assert wallet.balance(session, user) == 100
+
+def test_debit_refused_when_funds_are_short(session, make_user):
+    user = make_user(20)
+    assert not wallet.debit(session, user, 30, "stake", "game:1:1")
+    session.commit()
+    assert wallet.balance(session, user) == 20
+    assert entries(session, "stake") == 0
+
+    # A refused debit leaves its reference free for a later attempt
+    assert wallet.debit(session, user, 20, "stake", "game:1:1")
+    session.commit()
+    assert wallet.balance(session, user) == 0
+
+def test_debit_without_floor_may_overdraw(session, make_user):
+    user = make_user(5)
+    assert wallet.apply(session, wallet.Entry(user, -10, "adjustment", "fix:1"), min_balance=None)
+    session.commit()
+    assert wallet.balance(session, user) == -5
+
+def test_cents_are_exact(session, make_user):
+    user = make_user()
+    for i in range(10):
+        wallet.credit(session, user, 0.1, "referral_bonus", f"ref:{i}")
+    session.commit()
+    assert wallet.balance(session, user) == 1.0
+
+def test_apply_many_credits_in_one_pass(session, make_user):
+    a, b = make_user(), make_user(10)
+    results = wallet.apply_many(session, [
+        wallet.Entry(a, 30, "payout", "game:2:a"),
+        wallet.Entry(b, 30, "payout", "game:2:b"),
+        wallet.Entry(a, 5, "refund", "game:2:1"),
+    ])
+    session.commit()
+    assert results == [True, True, True]
+    assert wallet.balance(session, a) == 35
+    assert wallet.balance(session, b) == 40
+
+def test_apply_many_checks_each_debit(session, make_user):
+    rich, poor = make_user(50), make_user(5)
+    results = wallet.apply_many(session, [
+        wallet.Entry(rich, -20, "stake", "game:3:1"),
+        wallet.Entry(poor, -20, "stake", "game:3:2"),
+        wallet.Entry(poor, 10, "payout", "game:3:poor"),
+    ])
+    session.commit()
+    assert results == [True, False, True]
+    assert wallet.balance(session, rich) == 30
+    assert wallet.balance(session, poor) == 15
+
+def test_apply_many_refuses_a_repeated_batch(session, make_user):
+    user = make_user()
+    batch = [wallet.Entry(user, 30, "payout", "game:4:1")]
+    wallet.apply_many(session, batch)
+    session.commit()
+    with pytest.raises(IntegrityError):
+        wallet.apply_many(session, batch)
+    session.rollback()
+    assert wallet.balance(session, user) == 30
+    assert entries(session, "payout") == 1
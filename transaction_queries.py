@@ -0,0 +1,127 @@
+# transaction_queries.py
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from models import User, Transaction
+
+# Admin transaction listings. Each page is one SELECT of just the rendered columns with
+# the username joined in, walked by a (sort key, id) cursor so deep pages cost the same
+# as the first. The filters line up with ix_transaction_type_status_created.
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+LIST_COLUMNS = (
+    Transaction.id,
+    Transaction.user_id,
+    User.username,
+    User.telegram_id,
+    Transaction.type,
+    Transaction.amount,
+    Transaction.method,
+    Transaction.reference,
+    Transaction.status,
+    Transaction.created_at,
+    Transaction.completed_at,
+    Transaction.approved_by,
+    Transaction.approval_note,
+)
+
+SORT_KEYS = {"created_at": Transaction.created_at, "completed_at": Transaction.completed_at}
+
+Page = Tuple[List[Any], Optional[str]]   # rows, cursor for the next page
+
+def encode_cursor(key: datetime, tx_id: int) -> str:
+    return f"{key.isoformat()}|{tx_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    key, tx_id = cursor.rsplit("|", 1)
+    return datetime.fromisoformat(key), int(tx_id)
+
+def _one_or_many(column, value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return column == value
+    return column.in_(tuple(value))
+
+def query(session: Session,
+          types: Optional[Sequence[str]] = None,
+          status: Optional[Sequence[str]] = None,
+          method: Optional[Sequence[str]] = None,
+          since: Optional[datetime] = None,
+          until: Optional[datetime] = None,
+          cursor: Optional[str] = None,
+          limit: int = PAGE_SIZE,
+          sort: str = "created_at",
+          oldest_first: bool = False) -> Page:
+    """
+    One page of transactions matching every given filter; each of types / status /
+    method is a single value or a list. since / until bound the sort column. Rows are
+    read-only projections (tx.username rather than tx.user.username).
+    Raises ValueError for an unknown sort key or a malformed cursor.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort}")
+    key = SORT_KEYS[sort]
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    criteria = [c for c in (
+        _one_or_many(Transaction.type, types),
+        _one_or_many(Transaction.status, status),
+        _one_or_many(Transaction.method, method),
+    ) if c is not None]
+    criteria.append(key.isnot(None))
+    if since:
+        criteria.append(key >= since)
+    if until:
+        criteria.append(key < until)
+    if cursor:
+        at, tx_id = decode_cursor(cursor)
+        if oldest_first:
+            criteria.append(or_(key > at, and_(key == at, Transaction.id > tx_id)))
+        else:
+            criteria.append(or_(key < at, and_(key == at, Transaction.id < tx_id)))
+
+    order = (key.asc(), Transaction.id.asc()) if oldest_first else (key.desc(), Transaction.id.desc())
+    rows = session.execute(
+        select(*LIST_COLUMNS)
+        .join(User, User.id == Transaction.user_id)
+        .where(*criteria)
+        .order_by(*order)
+        .limit(limit + 1)
+    ).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(getattr(rows[-1], sort), rows[-1].id)
+
+def as_dict(row) -> Dict[str, Any]:
+    data = dict(row._mapping)
+    for name in ("created_at", "completed_at"):
+        if data.get(name):
+            data[name] = data[name].isoformat()
+    return data
+
+def filters_from_args(args) -> Dict[str, Any]:
+    """
+    query() keyword arguments from a request's query string:
+    ?type=deposit&status=pending&method=telebirr&since=2024-01-01&until=...&cursor=...&limit=50
+    Repeated keys become lists. Raises ValueError for malformed dates.
+    """
+    filters: Dict[str, Any] = {}
+    for arg, name in (("type", "types"), ("status", "status"), ("method", "method")):
+        values = args.getlist(arg)
+        if values:
+            filters[name] = values
+    for name in ("since", "until"):
+        if args.get(name):
+            filters[name] = datetime.fromisoformat(args[name])
+    if args.get("cursor"):
+        filters["cursor"] = args["cursor"]
+    filters["limit"] = args.get("limit", PAGE_SIZE, type=int)
+    return filters
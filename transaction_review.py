@@ -0,0 +1,176 @@
+# transaction_review.py
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from models import User, Transaction
+import outbox
+import wallet
+
+# Approving or rejecting many pending transactions at once. A batch is validated with
+# one SELECT, credits go through one batched wallet pass, the status and audit fields
+# are one UPDATE, and the notifications are one bulk INSERT into the outbox.
+
+MAX_BATCH = 1000
+WITHDRAW_TYPES = ("withdraw", "withdrawal")
+
+Result = Dict[str, Any]   # {"id", "status", "reason"?}
+
+def pending_ids(session: Session, types: Optional[Iterable[str]] = None, method: Optional[str] = None,
+                since: Optional[datetime] = None, until: Optional[datetime] = None,
+                limit: int = MAX_BATCH) -> List[int]:
+    """
+    IDs of pending transactions matching a filter, oldest first, for "approve everything like this".
+    """
+    stmt = select(Transaction.id).where(Transaction.status == "pending")
+    if types:
+        stmt = stmt.where(Transaction.type.in_(tuple(types)))
+    if method:
+        stmt = stmt.where(Transaction.method == method)
+    if since:
+        stmt = stmt.where(Transaction.created_at >= since)
+    if until:
+        stmt = stmt.where(Transaction.created_at < until)
+    return list(session.execute(stmt.order_by(Transaction.created_at, Transaction.id).limit(min(limit, MAX_BATCH))).scalars())
+
+def ids_from_payload(session: Session, payload: Dict[str, Any]) -> List[int]:
+    """
+    {"ids": [...]} or {"filter": {"type": "deposit", "method": "telebirr", "since": iso, "until": iso, "limit": n}},
+    optionally with "amounts" for approve_many (see amounts_from_payload).
+    Raises ValueError when neither is given or a date is malformed.
+    """
+    if payload.get("ids"):
+        return _dedupe(payload["ids"])
+    flt = payload.get("filter")
+    if not isinstance(flt, dict):
+        raise ValueError("Pass either ids or filter")
+    kind = flt.get("type")
+    return pending_ids(
+        session,
+        types=WITHDRAW_TYPES if kind in WITHDRAW_TYPES else ((kind,) if kind else None),
+        method=flt.get("method"),
+        since=datetime.fromisoformat(flt["since"]) if flt.get("since") else None,
+        until=datetime.fromisoformat(flt["until"]) if flt.get("until") else None,
+        limit=int(flt.get("limit", MAX_BATCH)),
+    )
+
+def amounts_from_payload(payload: Dict[str, Any]) -> Dict[int, float]:
+    """
+    {"amounts": {"<id>": amount}}: what the admin confirmed was paid, for deposit claims
+    that don't state it. Raises ValueError when an amount isn't a positive number.
+    """
+    amounts = {}
+    for tx_id, amount in (payload.get("amounts") or {}).items():
+        try:
+            amounts[int(tx_id)] = float(amount)
+        except (TypeError, ValueError):
+            raise ValueError(f"Amount for transaction {tx_id} is not a number")
+        if amounts[int(tx_id)] <= 0:
+            raise ValueError(f"Amount for transaction {tx_id} must be positive")
+    return amounts
+
+def _load(session: Session, tx_ids: List[int]) -> Tuple[Dict[int, Any], Dict[int, Result]]:
+    rows = {
+        r.id: r for r in session.execute(
+            select(Transaction.id, Transaction.user_id, Transaction.type, Transaction.amount,
+                   Transaction.status, User.telegram_id)
+            .join(User, User.id == Transaction.user_id)
+            .where(Transaction.id.in_(tx_ids))
+        )
+    }
+    rejected: Dict[int, Result] = {}
+    for tx_id in tx_ids:
+        row = rows.get(tx_id)
+        if row is None:
+            rejected[tx_id] = {"id": tx_id, "status": "error", "reason": "not_found"}
+        elif row.status != "pending":
+            rejected[tx_id] = {"id": tx_id, "status": "error", "reason": "already_processed"}
+    return rows, rejected
+
+def _dedupe(tx_ids: Iterable[int]) -> List[int]:
+    ids = list(dict.fromkeys(int(i) for i in tx_ids))
+    if len(ids) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} transactions per batch")
+    return ids
+
+def approve_many(session: Session, tx_ids: Iterable[int], approved_by: str, note: str = "",
+                 amounts: Optional[Dict[int, float]] = None) -> List[Result]:
+    """
+    Approves every valid pending deposit and withdrawal in tx_ids in one transaction and
+    returns one result per ID, in order. Deposits are credited in a single batch, for the
+    amount in `amounts` or else the one on the claim; a claim with neither (the bot
+    stores deposit claims with amount 0) is reported as amount_required and left pending.
+    Withdrawals keep the per-row balance check, and those that would overdraw are
+    reported as insufficient_balance and left pending. The caller commits.
+    """
+    ids = _dedupe(tx_ids)
+    rows, results = _load(session, ids)
+    amounts = amounts or {}
+
+    candidates = []
+    for tx_id in ids:
+        if tx_id in results:
+            continue
+        row = rows[tx_id]
+        if row.type == "deposit":
+            amount = amounts.get(tx_id, abs(row.amount or 0))
+            if amount <= 0:
+                results[tx_id] = {"id": tx_id, "status": "error", "reason": "amount_required"}
+                continue
+            candidates.append(wallet.Entry(row.user_id, amount, "deposit", f"tx:{tx_id}", tx_id))
+        elif row.type in WITHDRAW_TYPES:
+            candidates.append(wallet.Entry(row.user_id, -abs(row.amount), "withdraw", f"tx:{tx_id}", tx_id))
+        else:
+            results[tx_id] = {"id": tx_id, "status": "error", "reason": "unsupported_type"}
+
+    approved: List[wallet.Entry] = []
+    for entry, applied in zip(candidates, wallet.apply_many(session, candidates)):
+        if applied:
+            approved.append(entry)
+        else:
+            results[entry.transaction_id] = {"id": entry.transaction_id, "status": "error", "reason": "insufficient_balance"}
+
+    if approved:
+        transactions = Transaction.__table__
+        session.execute(
+            update(transactions)
+            .where(transactions.c.id == bindparam("tid"), transactions.c.status == "pending")
+            .values(status="approved", amount=bindparam("paid"), completed_at=datetime.utcnow(),
+                    approved_by=approved_by, approval_note=note),
+            [{"tid": e.transaction_id, "paid": abs(e.amount)} for e in approved]
+        )
+        outbox.enqueue_many(session, [
+            (rows[e.transaction_id].telegram_id,
+             f"✅ Your {'deposit' if e.amount > 0 else 'withdrawal'} of {abs(e.amount)} birr was approved.")
+            for e in approved
+        ])
+        for e in approved:
+            results[e.transaction_id] = {"id": e.transaction_id, "status": "approved"}
+
+    return [results[tx_id] for tx_id in ids]
+
+def reject_many(session: Session, tx_ids: Iterable[int], rejected_by: str, reason: str = "No reason provided") -> List[Result]:
+    """
+    Rejects every pending transaction in tx_ids with one UPDATE. Balances are untouched.
+    """
+    ids = _dedupe(tx_ids)
+    rows, results = _load(session, ids)
+    rejected = [tx_id for tx_id in ids if tx_id not in results]
+
+    if rejected:
+        session.execute(
+            update(Transaction)
+            .where(Transaction.id.in_(rejected), Transaction.status == "pending")
+            .values(status="rejected", completed_at=datetime.utcnow(), approved_by=rejected_by, admin_note=reason)
+        )
+        outbox.enqueue_many(session, [
+            (rows[tx_id].telegram_id,
+             f"❌ Your {'deposit' if rows[tx_id].type == 'deposit' else 'withdrawal'} was rejected.\nReason: {reason}")
+            for tx_id in rejected
+        ])
+        for tx_id in rejected:
+            results[tx_id] = {"id": tx_id, "status": "rejected"}
+
+    return [results[tx_id] for tx_id in ids]
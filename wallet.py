@@ -0,0 +1,146 @@
+# wallet.py
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Optional, Sequence
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from models import User, WalletEntry
+import leaderboards
+
+# Every balance change goes through this module: one conditional UPDATE on user plus one
+# append-only wallet_entry row, both in integer cents. User.balance mirrors balance_cents
+# for the templates and is written in the same statement. Every change also marks the
+# user for the global leaderboards, which pick it up when the transaction commits.
+
+_users = User.__table__
+
+class InsufficientFunds(Exception):
+    pass
+
+def to_cents(amount) -> int:
+    return int(Decimal(str(amount or 0)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) * 100)
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+@dataclass(frozen=True)
+class Entry:
+    user_id: int
+    amount: float                      # birr, negative for debits
+    kind: str                          # deposit, withdraw, stake, payout, refund, jackpot_win, referral_bonus, adjustment
+    reference: Optional[str] = None    # idempotency key, unique per kind
+    transaction_id: Optional[int] = None
+
+def _expire(session: Session, user_id: int):
+    user = session.identity_map.get(identity_key(User, user_id))
+    if user is not None:
+        session.expire(user, ["balance", "balance_cents"])
+
+def _touch(session: Session, entries: Sequence[Entry]):
+    leaderboards.touch(session, {e.user_id for e in entries})
+    jackpots = {e.user_id for e in entries if e.kind == "jackpot_win"}
+    if jackpots:
+        leaderboards.touch(session, jackpots, ("jackpot",))
+
+def _balance_update(delta_cents: int):
+    return {
+        "balance_cents": _users.c.balance_cents + delta_cents,
+        "balance": (_users.c.balance_cents + delta_cents) / 100.0,
+    }
+
+# -------------------- SINGLE CHANGES --------------------
+
+def apply(session: Session, entry: Entry, min_balance: Optional[float] = 0) -> bool:
+    """
+    Applies one entry atomically. Debits only go through while the resulting balance stays
+    >= min_balance (pass None to allow overdraft). Returns False when the funds are short or
+    the (kind, reference) pair was already applied. The caller commits.
+    """
+    delta = to_cents(entry.amount)
+    stmt = update(_users).where(_users.c.id == entry.user_id).values(**_balance_update(delta))
+    if delta < 0 and min_balance is not None:
+        stmt = stmt.where(_users.c.balance_cents >= to_cents(min_balance) - delta)
+
+    savepoint = session.begin_nested()
+    try:
+        if entry.reference is not None:
+            session.execute(insert(WalletEntry).values(_entry_row(entry, delta)))
+        if session.execute(stmt).rowcount != 1:
+            savepoint.rollback()
+            return False
+        if entry.reference is None:
+            session.execute(insert(WalletEntry).values(_entry_row(entry, delta)))
+        savepoint.commit()
+    except IntegrityError:
+        savepoint.rollback()
+        return False
+    _expire(session, entry.user_id)
+    _touch(session, [entry])
+    return True
+
+def credit(session: Session, user_id: int, amount: float, kind: str,
+           reference: Optional[str] = None, transaction_id: Optional[int] = None) -> bool:
+    return apply(session, Entry(user_id, abs(amount), kind, reference, transaction_id))
+
+def debit(session: Session, user_id: int, amount: float, kind: str,
+          reference: Optional[str] = None, transaction_id: Optional[int] = None) -> bool:
+    return apply(session, Entry(user_id, -abs(amount), kind, reference, transaction_id))
+
+def adjust(session: Session, user_id: int, amount: float, reference: Optional[str] = None) -> bool:
+    """
+    Admin correction; a negative adjustment may not take the balance below zero.
+    """
+    return apply(session, Entry(user_id, amount, "adjustment", reference))
+
+def balance(session: Session, user_id: int) -> float:
+    cents = session.execute(select(_users.c.balance_cents).where(_users.c.id == user_id)).scalar()
+    return from_cents(cents or 0)
+
+# -------------------- BATCHES --------------------
+
+def apply_many(session: Session, entries: Sequence[Entry], min_balance: Optional[float] = 0) -> List[bool]:
+    """
+    Settlement path. Credits are sent as one executemany UPDATE and one bulk INSERT.
+    Debits keep their per-row balance check unless min_balance is None, in which case
+    they join the batch too. A duplicate (kind, reference) in the batch raises IntegrityError.
+    """
+    results: List[bool] = [False] * len(entries)
+    batch = []
+    for i, entry in enumerate(entries):
+        if entry.amount < 0 and min_balance is not None:
+            results[i] = apply(session, entry, min_balance)
+        else:
+            batch.append((i, entry))
+
+    if batch:
+        deltas: dict = {}
+        for _, entry in batch:
+            deltas[entry.user_id] = deltas.get(entry.user_id, 0) + to_cents(entry.amount)
+        session.execute(
+            update(_users)
+            .where(_users.c.id == bindparam("uid"))
+            .values(
+                balance_cents=_users.c.balance_cents + bindparam("delta"),
+                balance=(_users.c.balance_cents + bindparam("delta")) / 100.0,
+            ),
+            [{"uid": uid, "delta": delta} for uid, delta in deltas.items()]
+        )
+        session.execute(insert(WalletEntry), [_entry_row(entry, to_cents(entry.amount)) for _, entry in batch])
+        for i, entry in batch:
+            results[i] = True
+            _expire(session, entry.user_id)
+        _touch(session, [entry for _, entry in batch])
+    return results
+
+def _entry_row(entry: Entry, delta_cents: int) -> dict:
+    return {
+        "user_id": entry.user_id,
+        "amount_cents": delta_cents,
+        "kind": entry.kind,
+        "reference": entry.reference,
+        "transaction_id": entry.transaction_id,
+    }
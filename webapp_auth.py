@@ -0,0 +1,47 @@
+# webapp_auth.py
+import hashlib
+import hmac
+import json
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode
+
+from config import TELEGRAM_BOT_TOKEN, WEBAPP_AUTH_MAX_AGE
+
+# Pages opened from the bot's WebApp buttons get Telegram.WebApp.initData, a query
+# string signed with a key derived from the bot token. Checking it here is how the web
+# API knows which Telegram user is calling without a login of its own.
+
+HEADER = "X-Telegram-Init-Data"
+
+def _signature(fields: Dict[str, str], bot_token: str) -> str:
+    check = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    return hmac.new(secret, check.encode(), hashlib.sha256).hexdigest()
+
+def sign(user: Dict[str, Any], bot_token: Optional[str] = TELEGRAM_BOT_TOKEN, auth_date: Optional[float] = None) -> str:
+    """
+    initData for user as Telegram would send it; for the benchmark and tests.
+    """
+    fields = {"auth_date": str(int(auth_date if auth_date is not None else time.time())), "user": json.dumps(user)}
+    return urlencode({**fields, "hash": _signature(fields, bot_token)})
+
+def telegram_user(init_data: str, bot_token: Optional[str] = TELEGRAM_BOT_TOKEN,
+                  max_age: float = WEBAPP_AUTH_MAX_AGE, now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    The "user" object from init_data, or None if it is missing, not signed with
+    bot_token or older than max_age seconds.
+    """
+    if not init_data or not bot_token:
+        return None
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    given = fields.pop("hash", "")
+    if not hmac.compare_digest(_signature(fields, bot_token), given):
+        return None
+    try:
+        if (now if now is not None else time.time()) - int(fields.get("auth_date", 0)) > max_age:
+            return None
+        user = json.loads(fields.get("user", ""))
+    except ValueError:
+        return None
+    return user if isinstance(user, dict) and "id" in user else None